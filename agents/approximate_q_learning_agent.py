@@ -1,8 +1,52 @@
-import random
+import numpy as np
 
 from agents.q_learning_agent import QLearningMarioAgent
 
 
+class InfoFeatureExtractor:
+    """
+    Turns an info dict into a float vector with one entry per feature. A feature is an info value (status mapped
+    through status_map) divided by its scale, so every feature stays around [0, 1] and one learning rate suits all of
+    them.
+    """
+
+    status_map = {"small": 1, "tall": 2, "fireball": 3}
+    # feature -> value it is divided by (features not listed are used as they are)
+    scales = {
+        "status": 3.0,
+        "time": 400.0,
+        "x_pos": 3000.0,
+        "y_pos": 255.0,
+        "coins": 100.0,
+        "life": 3.0,
+        "score": 10000.0,
+    }
+
+    def __init__(self, names=("status", "time", "x_pos", "y_pos")):
+        """
+        :param names: Info keys to use as features, in order
+        """
+        self.names = list(names)
+        self._divisors = np.array([self.scales.get(name, 1.0) for name in self.names])
+        self._status = self.names.index("status") if "status" in self.names else None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __call__(self, info):
+        """
+        Extracts the feature vector of an info dict.
+
+        :param info: The info dict returned by the env (or the initial one of the scripts)
+        :return (np.ndarray): float64 vector of the features
+        """
+        values = [
+            self.status_map[info[name]] if i == self._status else info[name]
+            for i, name in enumerate(self.names)
+        ]
+        return np.array(values, dtype=np.float64) / self._divisors
+
+
 class ApproxQLearningMarioAgent(QLearningMarioAgent):
     def __init__(
         self,
@@ -12,7 +56,21 @@ class ApproxQLearningMarioAgent(QLearningMarioAgent):
         learning_rate=0.6,
         discount=0.9,
         decay=0.99,
+        features=None,
     ):
+        """
+        Q-learning agent with a linear approximation of the q-values: one weight vector per action over the features
+        of the info dict, so the q-values of all actions are one matrix-vector product.
+
+        :param actions (int): Number of possible actions
+        :param weights: Weight matrix to continue from, (actions, features). A dict of feature -> weight (the format
+            from before each action had its own weights) starts every action from those weights
+        :param exploration_rate (float): representing the rate of exploration (taking random action)
+        :param learning_rate (float): learning rate
+        :param discount (float): discount factor
+        :param decay (float): represents the rate to decay frequency of random action by
+        :param features (InfoFeatureExtractor): The features to use (None for status, time, x_pos and y_pos)
+        """
         super().__init__(
             actions,
             exploration_rate=exploration_rate,
@@ -20,89 +78,42 @@ class ApproxQLearningMarioAgent(QLearningMarioAgent):
             discount=discount,
             decay=decay,
         )
-        self.status_map = {"small": 1, "tall": 2, "fireball": 3}
-        if weights:
-            self.weights = weights
+        if isinstance(weights, dict):
+            features = InfoFeatureExtractor(weights.keys())
+            weights = np.tile(list(weights.values()), (actions, 1))
+        self.features = features if features is not None else InfoFeatureExtractor()
+        if weights is None:
+            self.weights = np.zeros((actions, len(self.features)))
         else:
-            # if not given, initialize empty dictionary
-            self.weights = {
-                "status": 0.0,
-                "time": 0.0,
-                "x_pos": 0.0,
-                "y_pos": 0.0,
-            }
+            self.weights = np.array(weights, dtype=np.float64)
+            if self.weights.shape != (actions, len(self.features)):
+                raise ValueError(
+                    f"Expecting weights of shape {(actions, len(self.features))}, got: {self.weights.shape}"
+                )
 
     def get_weights(self):
         return self.weights
 
     def get_q_value(self, state, action):
-        q_value = 0
-        for key in self.weights.keys():
-            if key == "status":
-                value = self.status_map[state[key]]
-            else:
-                value = state[key]
+        return float(self.weights[action] @ self.features(state))
 
-            q_value += self.weights[key] * value
+    def compute_q_row(self, state):
+        """
+        Computes the q-values of every action for a given state.
 
-        return q_value
+        :param state: The info dict to get the q-values for
+        :return (np.ndarray): The q-value of each action, indexed by action
+        """
+        return self.weights @ self.features(state)
 
     def update(self, state, action, next_state, reward):
         difference = (
             reward
             + self.discount * self.compute_value_from_q_value(next_state)
-            - self.get_q_value(state, action)
+            - self.get_q_row(state)[action]
         )
-
-        for feature in self.weights.keys():
-            if feature == "status":
-                value = self.status_map[state[feature]]
-            else:
-                value = state[feature]
-            self.weights[feature] += self.learning_rate * difference * value
-
-    def get_q_values(self):
-        """
-        Returns the map of State, Action pairs to Q-values
-        """
-        return self.q_values
-
-    def compute_value_from_q_value(self, state):
-        """
-        Computes the value of the given state.
-
-        :param state: The state to find value for.
-        :return (float): The highest q-value over all actions possible from this state
-        """
-        return max(self.get_q_value(state, action) for action in range(self.actions))
-
-    def compute_action_from_q_value(self, state):
-        """
-        Computes the best action for a given state using the currently stored q-values.
-
-        :param state: The state to find an action for
-        :return: the action with the highest q-value for this state
-        """
-        potential_actions = []
-        for action in range(self.actions):
-            if self.get_q_value(state, action) == self.compute_value_from_q_value(state):
-                potential_actions.append(action)
-        if not potential_actions:
-            return None
-        else:
-            return random.choice(potential_actions)
-
-    def get_action(self, state):
-        """
-        Gets the action to perform next in the environment using exploration rate as the probability of random action
-        chosen over best action.
-
-        :param state: The state to determine an action for.
-        :return: the action to take from the current state.
-        """
-        if random.random() < self.exploration_rate:
-            action = random.randint(0, self.actions - 1)
-        else:
-            action = self.compute_action_from_q_value(state)
-        self.exploration_rate *= self.decay
-        return action
+        # the gradient step is the outer product of the one-hot action and the features, i.e. only the row of the
+        # action taken changes
+        self.weights[action] += self.learning_rate * difference * self.features(state)
+        # new weights change the q-values of every state
+        self.clear_q_rows()
@@ -1,5 +1,6 @@
 import copy
 
+import torch
 import torch.nn as nn
 
 
@@ -41,3 +42,54 @@ class MarioNet(nn.Module):
             return self.online(input)
         elif model == 'target':
             return self.target(input)
+
+
+# precisions MarioInferenceNet can run in
+INFERENCE_PRECISIONS = ('float32', 'bfloat16', 'int8')
+
+
+class MarioInferenceNet(nn.Module):
+    '''copy of MarioNet.online for picking actions, without autograd
+    channels_last: convolutions on channels-last tensors, which CPU backends handle faster
+    precision: 'float32', 'bfloat16' (autocast) or 'int8' (dynamic quantization of the 3136 -> 512 layer, which holds
+    1.6M of the network's 1.7M weights; CPU only)
+    '''
+
+    def __init__(self, online, precision='float32', channels_last=True):
+        super().__init__()
+        if precision not in INFERENCE_PRECISIONS:
+            raise ValueError(f"Expecting precision in {INFERENCE_PRECISIONS}, got: {precision}")
+        self.precision = precision
+        self.channels_last = channels_last
+
+        self.net = copy.deepcopy(online).eval()
+        for p in self.net.parameters():
+            p.requires_grad = False
+        if channels_last:
+            self.net = self.net.to(memory_format=torch.channels_last)
+        if precision == 'int8':
+            self.net = torch.ao.quantization.quantize_dynamic(self.net.cpu(), {'7'}, dtype=torch.qint8)
+
+    def forward(self, input):
+        with torch.inference_mode():
+            if self.precision == 'int8':
+                input = input.cpu()
+            if self.channels_last:
+                input = input.contiguous(memory_format=torch.channels_last)
+            if self.precision == 'bfloat16':
+                with torch.autocast(device_type=input.device.type, dtype=torch.bfloat16):
+                    return self.net(input).float()
+            return self.net(input)
+
+
+def greedy_agreement(online, inference_net, states, batch_size=256):
+    '''fraction of states on which inference_net picks the same greedy action as the float32 online network
+    states: float states in [0, 1], dimension is (n, state_dim)
+    '''
+    matches = 0
+    with torch.inference_mode():
+        for i in range(0, len(states), batch_size):
+            batch = states[i:i + batch_size]
+            expected = torch.argmax(online(batch), axis=1)
+            matches += (torch.argmax(inference_net(batch), axis=1).to(expected.device) == expected).sum().item()
+    return matches / len(states)
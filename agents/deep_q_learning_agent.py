@@ -1,19 +1,27 @@
-from collections import deque
-import random
+import copy
+import os
+import shutil
+import threading
+from pathlib import Path
 
 import torch
 import numpy as np
 
-from agents.conv_neural_network import MarioNet
+from agents.conv_neural_network import MarioNet, MarioInferenceNet
+from agents.replay_buffer import REPLAY_STORAGE, PrioritizedReplayBuffer
+from util.checkpoint import get_rng_state, load_replay, save_replay, set_rng_state
+from util.profiling import PhaseTimer
 
 
 class DeepQLearningMario:
-    def __init__(self, state_dim, action_dim, save_dir):
+    def __init__(self, state_dim, action_dim, save_dir, replay_storage='frames', replay_capacity=100000,
+                 prioritized=False, num_envs=1, batch_size=32, updates_per_learn=1, act_precision=None):
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.save_dir = save_dir
 
         self.use_cuda = torch.cuda.is_available()
+        self.device = 'cuda' if self.use_cuda else 'cpu'
 
         # Mario's DNN to predict the most optimal action - we implement this in the Learn section
         self.net = MarioNet(self.state_dim, self.action_dim).float()
@@ -24,17 +32,45 @@ class DeepQLearningMario:
         self.exploration_rate_decay = 0.99999975
         self.exploration_rate_min = 0.1
         self.curr_step = 0
+        self.updates = 0  # no. of gradient updates to Q_online so far
+
+        # actions are picked by a MarioInferenceNet copy of Q_online in this precision, refreshed every
+        # act_refresh_every updates (None to pick them with Q_online itself)
+        self.act_precision = act_precision
+        self.act_refresh_every = 100
+        self._act_net = None
+        self._act_net_updates = 0
 
         self.save_every = 5e5  # no. of experiences between saving Mario Net
-        self.memory = deque(maxlen=100000)
-        self.batch_size = 32
+        self.save_replay = True  # whether checkpoints include the replay buffer
+        self.keep_replays = 1  # no. of newest replay buffer checkpoints kept, older ones are deleted
+        self._replay_dirs = []  # replay buffer checkpoints written by this run, oldest first
+        self._save_thread = None
+        self._save_error = None
+        # 'frames' keeps each frame once, 'stacks' keeps both full frame stacks of every transition
+        self.memory = REPLAY_STORAGE[replay_storage](replay_capacity, self.state_dim, device=self.device,
+                                                     streams=num_envs)
+        # prioritized replay samples transitions by their last TD error and weights their losses to correct for it
+        self.prioritized = prioritized
+        if self.prioritized:
+            self.memory = PrioritizedReplayBuffer(self.memory)
+        self.batch_size = batch_size
         self.gamma = 0.9
         self.optimizer = torch.optim.Adam(self.net.parameters(), lr=0.00025)
         self.loss_fn = torch.nn.SmoothL1Loss()
 
         self.burnin = 1e5  # min. experiences before training
         self.learn_every = 3  # no. of experiences between updates to Q_online
+        self.updates_per_learn = updates_per_learn  # no. of gradient updates every learn_every experiences
+        # run Q_online once on states and next states together; fewer launches, which helps small batches on a GPU,
+        # but the backward pass then also runs over the next states, which makes it slower on a CPU
+        self.fuse_online_pass = False
         self.sync_every = 1e4  # no. of experiences between Q_target & Q_online sync
+        # step learn() last ran at; with several envs curr_step moves several steps at a time, so the counters above
+        # are checked for multiples crossed since then rather than hit exactly
+        self._last_learn_step = 0
+        # times recall, forward, backward and priorities in learn_batch when enabled (see util/profiling.py)
+        self.timer = PhaseTimer(enabled=False)
 
 
     def act(self, state):
@@ -42,7 +78,7 @@ class DeepQLearningMario:
             Given a state, choose an epsilon-greedy action and update value of step.
 
             Inputs:
-            state(LazyFrame): A single observation of the current state, dimension is (state_dim)
+            state(LazyFrame): A single uint8 observation of the current state, dimension is (state_dim)
             Outputs:
             action_idx (int): An integer representing which action Mario will perform
             """
@@ -52,9 +88,7 @@ class DeepQLearningMario:
 
         # EXPLOIT
         else:
-            state = torch.FloatTensor(state).cuda() if self.use_cuda else torch.FloatTensor(state)
-            state = state.unsqueeze(0)
-            action_values = self.net(state, model='online')
+            action_values = self.action_values(np.asarray(state)[None])
             action_idx = torch.argmax(action_values, axis=1).item()
 
         # decrease exploration_rate
@@ -66,42 +100,100 @@ class DeepQLearningMario:
         return action_idx
 
 
-    def cache(self, state, next_state, action, reward, done):
+    def act_batch(self, states):
+        """
+            Chooses epsilon-greedy actions for a batch of envs with one forward pass, and counts a step for each env.
+
+            Inputs:
+            states(np.ndarray): uint8 observations of the current states, dimension is (num_envs, state_dim)
+            Outputs:
+            actions (np.ndarray): The action for each env
+            """
+        num_envs = len(states)
+        # the exploration rate each env's step would have had if they were taken one after another
+        rates = np.maximum(self.exploration_rate * self.exploration_rate_decay ** np.arange(num_envs),
+                           self.exploration_rate_min)
+        explore = np.random.rand(num_envs) < rates
+        actions = np.random.randint(self.action_dim, size=num_envs)
+
+        # EXPLOIT
+        if not explore.all():
+            action_values = self.action_values(np.asarray(states)[~explore])
+            actions[~explore] = torch.argmax(action_values, axis=1).cpu().numpy()
+
+        # decrease exploration_rate
+        self.exploration_rate *= self.exploration_rate_decay ** num_envs
+        self.exploration_rate = max(self.exploration_rate_min, self.exploration_rate)
+
+        # increment step
+        self.curr_step += num_envs
+        return actions
+
+
+    def action_values(self, states):
+        """
+            Q values of a batch of uint8 states for picking actions, computed without autograd.
+
+            Inputs:
+            states(np.ndarray): uint8 observations, dimension is (n, state_dim)
+            Outputs:
+            action_values (torch.Tensor): Q values, dimension is (n, action_dim)
+            """
+        if self.act_precision is not None and (self._act_net is None or
+                                               self.updates - self._act_net_updates >= self.act_refresh_every):
+            self._act_net = MarioInferenceNet(self.net.online, self.act_precision)
+            self._act_net_updates = self.updates
+
+        with torch.inference_mode():
+            states = torch.as_tensor(states, device=self.device).float().div_(255)
+            if self._act_net is None:
+                return self.net(states, model='online')
+            return self._act_net(states)
+
+
+    def cache(self, state, next_state, action, reward, done, stream=0):
         """Add the experience to memory"""
-        state = torch.FloatTensor(state).cuda() if self.use_cuda else torch.FloatTensor(state)
-        next_state = torch.FloatTensor(next_state).cuda() if self.use_cuda else torch.FloatTensor(next_state)
-        action = torch.LongTensor([action]).cuda() if self.use_cuda else torch.LongTensor([action])
-        reward = torch.DoubleTensor([reward]).cuda() if self.use_cuda else torch.DoubleTensor([reward])
-        done = torch.BoolTensor([done]).cuda() if self.use_cuda else torch.BoolTensor([done])
+        self.memory.push(state, next_state, action, reward, done, stream)
 
-        self.memory.append((state, next_state, action, reward, done,))
+
+    def cache_batch(self, states, next_states, actions, rewards, dones):
+        """Add one experience per env to memory"""
+        for i in range(len(actions)):
+            self.memory.push(states[i], next_states[i], actions[i], rewards[i], dones[i], i)
 
 
     def recall(self):
         """
-        Retrieve a batch of experiences from memory
+        Retrieve a batch of experiences from memory, with the slots they were sampled from and their importance-sampling
+        weights (both None when sampling uniformly)
         """
-        batch = random.sample(self.memory, self.batch_size)
-        state, next_state, action, reward, done = map(torch.stack, zip(*batch))
-        return state, next_state, action.squeeze(), reward.squeeze(), done.squeeze()
+        if self.prioritized:
+            return self.memory.sample(self.batch_size)
+        return self.memory.sample(self.batch_size), None, None
 
 
-    def td_estimate(self, state, action):
-        current_Q = self.net(state, model='online')[np.arange(0, self.batch_size), action]  # Q_online(s,a)
+    def td_estimate(self, state, action, state_Q=None):
+        if state_Q is None:
+            state_Q = self.net(state, model='online')
+        current_Q = state_Q.gather(1, action.unsqueeze(1)).squeeze(1)  # Q_online(s,a)
         return current_Q
 
 
     @torch.no_grad()
-    def td_target(self, reward, next_state, done):
-        next_state_Q = self.net(next_state, model='online')
+    def td_target(self, reward, next_state, done, next_state_Q=None):
+        if next_state_Q is None:
+            next_state_Q = self.net(next_state, model='online')
         best_action = torch.argmax(next_state_Q, axis=1)
-        next_Q = self.net(next_state, model='target')[np.arange(0, self.batch_size), best_action]
+        next_Q = self.net(next_state, model='target').gather(1, best_action.unsqueeze(1)).squeeze(1)
         return (reward + (1 - done.float()) * self.gamma * next_Q).float()
 
 
-    def update_Q_online(self, td_estimate, td_target):
-        loss = self.loss_fn(td_estimate, td_target)
-        self.optimizer.zero_grad()
+    def update_Q_online(self, td_estimate, td_target, weights=None):
+        if weights is None:
+            loss = self.loss_fn(td_estimate, td_target)
+        else:
+            loss = (weights * torch.nn.functional.smooth_l1_loss(td_estimate, td_target, reduction='none')).mean()
+        self.optimizer.zero_grad(set_to_none=True)
         loss.backward()
         self.optimizer.step()
         return loss.item()
@@ -110,40 +202,149 @@ class DeepQLearningMario:
         self.net.target.load_state_dict(self.net.online.state_dict())
 
     def save(self):
-        save_path = self.save_dir / f"mario_net_{int(self.curr_step // self.save_every)}.chkpt"
-        torch.save(
-            dict(
-                model=self.net.state_dict(),
-                exploration_rate=self.exploration_rate
-            ),
-            save_path
+        """
+        Writes a checkpoint with everything needed to resume training: Mario Net, the Adam state, the step
+        counters and the RNG states go to mario_net_<n>.chkpt, and the replay buffer to replay_<n>/ (see
+        util.checkpoint). Only copying the network and optimizer state happens here; the files are written by a
+        background thread while training goes on, and once they are, replay buffer checkpoints beyond the newest
+        keep_replays are deleted (their mario_net_<n>.chkpt files are kept). An error writing them is raised by the
+        next save or wait_for_save.
+        """
+        number = int(self.curr_step // self.save_every)
+        save_path = self.save_dir / f"mario_net_{number}.chkpt"
+        replay_dir = self.save_dir / f"replay_{number}"
+        # one checkpoint is written at a time
+        self.wait_for_save()
+
+        checkpoint = dict(
+            model={name: tensor.detach().clone() for name, tensor in self.net.state_dict().items()},
+            exploration_rate=self.exploration_rate,
+            optimizer=copy.deepcopy(self.optimizer.state_dict()),
+            curr_step=self.curr_step,
+            updates=self.updates,
+            last_learn_step=self._last_learn_step,
+            rng=get_rng_state(),
+            replay=replay_dir.name if self.save_replay else None,
         )
-        print(f"MarioNet saved to {save_path} at step {self.curr_step}")
+        replay = self.memory.checkpoint() if self.save_replay else None
+        curr_step = self.curr_step
+
+        def write():
+            try:
+                if replay is not None:
+                    save_replay(replay_dir, self.memory, *replay)
+                # the network file goes last and is renamed into place, so it only exists once the checkpoint is
+                # complete
+                partial = save_path.with_name(save_path.name + '.partial')
+                torch.save(checkpoint, partial)
+                os.replace(partial, save_path)
+                print(f"MarioNet saved to {save_path} at step {curr_step}")
+                if replay is not None:
+                    self._replay_dirs.append(replay_dir)
+                    while len(self._replay_dirs) > self.keep_replays:
+                        shutil.rmtree(self._replay_dirs.pop(0), ignore_errors=True)
+            except Exception as error:
+                self._save_error = error
+
+        self._save_thread = threading.Thread(target=write)
+        self._save_thread.start()
+
+
+    def wait_for_save(self):
+        """Wait for the checkpoint being written in the background, if any, and raise the error it failed with"""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+        if self._save_error is not None:
+            error, self._save_error = self._save_error, None
+            raise error
+
+
+    def load(self, save_path):
+        """
+        Resumes from a checkpoint written by save(). The replay buffer is memory-mapped from its files rather than read
+        in. Checkpoints that only hold the network and exploration rate load those alone.
+        """
+        save_path = Path(save_path)
+        checkpoint = torch.load(save_path, map_location=self.device)
+        self.net.load_state_dict(checkpoint['model'])
+        self.exploration_rate = checkpoint['exploration_rate']
+        self._act_net = None
+        if 'optimizer' not in checkpoint:
+            return
+
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.curr_step = checkpoint['curr_step']
+        self.updates = checkpoint['updates']
+        self._last_learn_step = checkpoint['last_learn_step']
+        self._act_net_updates = self.updates
+        set_rng_state(checkpoint['rng'])
+        replay_dir = None if checkpoint['replay'] is None else save_path.parent / checkpoint['replay']
+        if replay_dir is not None and not replay_dir.is_dir():
+            # a newer checkpoint's replay buffer replaced it (see keep_replays)
+            print(f"Replay buffer {replay_dir} not found, resuming with an empty one")
+        elif replay_dir is not None:
+            self.memory.load_checkpoint(*load_replay(replay_dir))
+
+
+    def _crossed(self, every, last_step):
+        """Number of multiples of every passed since last_step"""
+        return int(self.curr_step // every - last_step // every)
 
 
     def learn(self):
-        if self.curr_step % self.sync_every == 0:
+        last_step, self._last_learn_step = self._last_learn_step, self.curr_step
+
+        if self._crossed(self.sync_every, last_step):
             self.sync_Q_target()
 
-        if self.curr_step % self.save_every == 0:
+        if self._crossed(self.save_every, last_step):
             self.save()
 
         if self.curr_step < self.burnin:
             return None, None
 
-        if self.curr_step % self.learn_every != 0:
+        # updates_per_learn updates per learn_every experiences, however many arrived since the last call
+        updates = self._crossed(self.learn_every, max(last_step, self.burnin - 1)) * self.updates_per_learn
+        if updates == 0:
             return None, None
 
+        q, losses = 0.0, 0.0
+        for _ in range(updates):
+            update_q, update_loss = self.learn_batch()
+            q += update_q
+            losses += update_loss
+        return q / updates, losses / updates
+
+
+    def learn_batch(self):
+        """Runs one update of Q_online on a batch sampled from memory"""
         # Sample from memory
-        state, next_state, action, reward, done = self.recall()
+        with self.timer.phase('recall'):
+            (state, next_state, action, reward, done), indices, weights = self.recall()
+
+        # on a GPU the passes are queued rather than run, so their time shows up where the loss is read in backward
+        with self.timer.phase('forward'):
+            if self.fuse_online_pass:
+                online_Q = self.net(torch.cat([state, next_state]), model='online')
+                state_Q, next_state_Q = online_Q[:len(state)], online_Q[len(state):].detach()
+            else:
+                state_Q, next_state_Q = None, None
 
-        # Get TD Estimate
-        td_est = self.td_estimate(state, action)
+            # Get TD Estimate
+            td_est = self.td_estimate(state, action, state_Q)
 
-        # Get TD Target
-        td_tgt = self.td_target(reward, next_state, done)
+            # Get TD Target
+            td_tgt = self.td_target(reward, next_state, done, next_state_Q)
 
         # Backpropagate loss through Q_online
-        loss = self.update_Q_online(td_est, td_tgt)
+        with self.timer.phase('backward'):
+            loss = self.update_Q_online(td_est, td_tgt, weights)
+
+        if indices is not None:
+            with self.timer.phase('priorities'):
+                self.memory.update_priorities(indices, (td_tgt - td_est).detach().cpu().numpy())
+
+        self.updates += 1
 
         return (td_est.mean().item(), loss)
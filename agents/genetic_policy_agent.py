@@ -1,47 +1,31 @@
 import math
-import multiprocessing
-import random
 
-import gym_super_mario_bros
+import numpy as np
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
-from nes_py.wrappers import JoypadSpace
+
+from util.env_pool import get_env
+from util.shared_population import get_worker_population
 
 
 def get_starting_generation(number_in_generation, max_x, max_y):
     """
-    Creates a starting generation (list of policies)
+    Creates a starting generation of random policies. A policy is a uint8 array indexed by [x, y] holding the action
+    to take at that position.
 
     :param number_in_generation: Number of policies per generation
     :param max_x: Max x position possible
     :param max_y: Max y position possible
-    :return: List of policies
+    :return: Array of policies with shape (number_in_generation, max_x + 1, max_y + 1)
     """
-    # parallelized for faster computation
-    pool = multiprocessing.Pool()
-    policies = [
-        pool.apply(_get_random_policy, args=(max_x, max_y))
-        for _ in range(number_in_generation)
-    ]
-    pool.close()
-    return policies
+    return np.random.randint(
+        0,
+        len(SIMPLE_MOVEMENT),
+        size=(number_in_generation, max_x + 1, max_y + 1),
+        dtype=np.uint8,
+    )
 
 
-def _get_random_policy(max_x, max_y):
-    """
-    Gets a random policy
-
-    :param max_x: Max x to consider in policy
-    :param max_y: Max y to consider in policy
-    :return: Random policy
-    """
-    policy = {}
-    for x in range(max_x + 1):
-        for y in range(max_y + 1):
-            policy[(x, y)] = random.randint(0, len(SIMPLE_MOVEMENT) - 1)
-    return policy
-
-
-def run_policy(policy, generation, number, world, stage):
+def run_policy(policy, generation, number, world, stage, env=None):
     """
     Runs the given policy and returns information on it
 
@@ -50,11 +34,11 @@ def run_policy(policy, generation, number, world, stage):
     :param number: the id of this policy in the generation
     :param world: the world this policy is being evaluated in
     :param stage: the stage this policy is being evaluated in
-    :return: Negated fitness level, data on the run, and policy
+    :param env: Env to run the policy in instead of this process' pooled one (e.g. one wrapped by util.run_mode)
+    :return: Negated fitness level and data on the run
     """
-    stage_name = f"SuperMarioBros-{world}-{stage}-v3"
-    env = gym_super_mario_bros.make(stage_name)
-    env = JoypadSpace(env, SIMPLE_MOVEMENT)
+    if env is None:
+        env = get_env(f"SuperMarioBros-{world}-{stage}-v3")
     env.reset()
     info = {
         "x_pos": 40,
@@ -66,14 +50,14 @@ def run_policy(policy, generation, number, world, stage):
         x = info["x_pos"]
         y = info["y_pos"]
         max_x = max(x, max_x)
-        curr_action = policy.get((x, y), False)
-        if not curr_action:
-            curr_action = random.randint(0, len(SIMPLE_MOVEMENT) - 1)
-            policy[(x, y)] = curr_action
+        if x < policy.shape[0] and 0 <= y < policy.shape[1]:
+            curr_action = int(policy[x, y])
+        else:
+            # outside of the area the policy covers
+            curr_action = np.random.randint(len(SIMPLE_MOVEMENT))
         state, reward, done, info = env.step(curr_action)
         if done:
             break
-    env.close()
     fitness = _get_fitness(info["score"], max_x)
     data = [
         generation + 1,
@@ -84,7 +68,25 @@ def run_policy(policy, generation, number, world, stage):
         info["stage"],
         max_x,
     ]
-    return -fitness, data, policy
+    return -fitness, data
+
+
+def run_policy_shared(index, generation, world, stage):
+    """
+    Runs a policy of the shared population in a worker and writes its data row into the population's results.
+
+    :param index: Index of the policy in the shared population
+    :param generation: the generation this policy belongs to
+    :param world: the world this policy is being evaluated in
+    :param stage: the stage this policy is being evaluated in
+    :return: The index of the policy
+    """
+    population = get_worker_population()
+    neg_fitness, data = run_policy(
+        population.genes[index], generation, index, world, stage
+    )
+    population.results[index] = data
+    return index
 
 
 def _get_fitness(score, max_x):
@@ -107,31 +109,23 @@ def do_crossover(policies_to_breed, number_to_make, max_x, max_y):
     :param number_to_make: The number of policies to create
     :param max_x: The max x for this level
     :param max_y: The max y for this level
-    :return:
-    """
-    pool = multiprocessing.Pool()
-    new_generation = [
-        pool.apply(_create_one_child, args=(policies_to_breed, max_x, max_y))
-        for _ in range(number_to_make)
-    ]
-    pool.close()
-    return new_generation
-
-
-def _create_one_child(policies_to_breed, max_x, max_y):
-    """
-    Creates a single child policy from the parents given.
-
-    :param policies_to_breed: Policies to breed
-    :param max_x: Max x in the policy
-    :param max_y: Max y in the policy
-    :return: The "child" policy
+    :return: Array of the new policies with shape (number_to_make, max_x + 1, max_y + 1)
     """
-    child = {}
-    for x in range(max_x + 1):
-        for y in range(max_y + 1):
-            child[(x, y)] = random.choice(policies_to_breed)[(x, y)]
-    return child
+    parents = np.asarray(policies_to_breed).reshape(len(policies_to_breed), -1)
+    new_generation = np.empty((number_to_make, parents.shape[1]), dtype=np.uint8)
+    # seeded from the global RNG so seeded runs stay reproducible, but draws small ints much faster
+    rng = np.random.default_rng(np.random.randint(2**32))
+    index_type = np.min_scalar_type(len(parents) - 1)
+    # one child at a time, so the gather's index temporary stays one child's size
+    for i in range(number_to_make):
+        # which parent each gene is taken from
+        parent_of_gene = rng.integers(
+            0, len(parents), size=parents.shape[1], dtype=index_type
+        )
+        new_generation[i] = np.take_along_axis(
+            parents, parent_of_gene[None, :], axis=0
+        )[0]
+    return new_generation.reshape(number_to_make, max_x + 1, max_y + 1)
 
 
 def mutate(policies, mutation_rate, max_x, max_y):
@@ -142,12 +136,13 @@ def mutate(policies, mutation_rate, max_x, max_y):
     :param mutation_rate: The rate to make mutations at
     :param max_x: The max x in the policies
     :param max_y: The max y in the policies
-    :return: The policy list with mutations
+    :return: The policies with mutations (mutated in place)
     """
     number_mutations = math.ceil(mutation_rate * max_x * max_y)
     for policy in policies:
-        for _ in range(number_mutations):
-            x = random.randint(0, max_x)
-            y = random.randint(0, max_y)
-            policy[(x, y)] = random.randint(0, len(SIMPLE_MOVEMENT) - 1)
+        genes = policy.reshape(-1)
+        places = np.random.randint(0, genes.size, size=number_mutations)
+        genes[places] = np.random.randint(
+            0, len(SIMPLE_MOVEMENT), size=number_mutations, dtype=np.uint8
+        )
     return policies
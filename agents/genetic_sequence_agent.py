@@ -1,9 +1,11 @@
 import random
 
-from nes_py.wrappers import JoypadSpace
-import gym_super_mario_bros
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
 
+from util.env_pool import get_env
+from util.rollout_cache import get_worker_cache
+from util.shared_population import get_worker_population
+
 
 def crossover(max_steps, number_of_crossovers, to_breed, number_of_children):
     """
@@ -60,30 +62,66 @@ def mutate(sequences, max_reached, mutation_rate):
     return sequences
 
 
-def run_sequence(sequence, env_name, stop_when_dead):
+def shared_prefix_length(sequence, parents):
+    """
+    Finds how many leading actions the sequence shares with the parent it has the longest common prefix with.
+
+    :param sequence: The child sequence
+    :param parents: The parent sequences it was bred from
+    :return: Index of that parent, length of the shared prefix
+    """
+    best_parent, best_length = 0, 0
+    for parent_index, parent in enumerate(parents):
+        # binary search on slice equality, which compares in C instead of a python loop per action
+        low, high = 0, min(len(sequence), len(parent))
+        while low < high:
+            middle = (low + high + 1) // 2
+            if sequence[:middle] == parent[:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        if low > best_length:
+            best_parent, best_length = parent_index, low
+    return best_parent, best_length
+
+
+def run_sequence(sequence, env_name, stop_when_dead, cache=None, shared_prefix=0, env=None):
     """
     Runs the sequence and returns info on it.
 
     :param sequence: The sequence to run
-    :param env_name: The env to make to run the sequence
+    :param env_name: The env to run the sequence in (reused across calls in this process)
     :param stop_when_dead: Whether we should stop after first death.
+    :param cache: RolloutCache to resume the shared prefix from (None to always replay from reset)
+    :param shared_prefix: Number of leading actions the sequence shares with its parent
+    :param env: Env to run the sequence in instead of this process' pooled one (e.g. one wrapped by util.run_mode)
     :return: Max step reached, Info on run
     """
-    env = gym_super_mario_bros.make(env_name)
-    env = JoypadSpace(env, SIMPLE_MOVEMENT)
-    env.reset()
+    if cache is None:
+        if env is None:
+            env = get_env(env_name)
+        env.reset()
+        start, park_at = 0, None
+    else:
+        env, start, park_at = cache.resume(sequence, env_name, shared_prefix)
     info = None
-    for i in range(len(sequence)):
+    max_reached = len(sequence) - 1
+    for i in range(start, len(sequence)):
+        if i == park_at:
+            cache.park(env, i)
         curr_action = sequence[i]
         state, reward, done, info = env.step(curr_action)
         if done or (stop_when_dead and (info["life"] < 2 or info["time"] == 0)):
-            env.close()
-            return i, info
-    env.close()
-    return len(sequence) - 1, info
+            max_reached = i
+            break
+    if cache is not None:
+        cache.release(env, start, max_reached)
+    return max_reached, info
 
 
-def run_sequence_parallel(seq, episode, seq_num, stop_when_dead, world, stage):
+def run_sequence_parallel(
+    seq, episode, seq_num, stop_when_dead, world, stage, shared_prefix=0
+):
     """
     Function to support parallelization of running sequences. Runs a specified sequence and gets its fitness.
 
@@ -93,13 +131,16 @@ def run_sequence_parallel(seq, episode, seq_num, stop_when_dead, world, stage):
     :param stop_when_dead: Whether to stop run of sequence after first life lost
     :param world: The world to run sequence in, False if all
     :param stage: The stage to run sequence in, False if all
+    :param shared_prefix: Number of leading actions the sequence shares with its parent
     :return: -fitness, max reached step, data on run, sequence
     """
     if world and stage:
         stage_name = f"SuperMarioBros-{world}-{stage}-v3"
     else:
         stage_name = "SuperMarioBros-v3"
-    max_reached, info = run_sequence(seq, stage_name, stop_when_dead)
+    max_reached, info = run_sequence(
+        seq, stage_name, stop_when_dead, get_worker_cache(), shared_prefix
+    )
     if world and stage:
         fitness = fitness_of_sequence_one_level(info)
     else:
@@ -116,6 +157,33 @@ def run_sequence_parallel(seq, episode, seq_num, stop_when_dead, world, stage):
     return -fitness, max_reached, data, seq
 
 
+def run_sequence_shared(index, episode, stop_when_dead, world, stage, shared_prefix=0):
+    """
+    Runs a sequence of the shared population in a worker and writes its data row, followed by the max reached step,
+    into the population's results.
+
+    :param index: Index of the sequence in the shared population
+    :param episode: The episode of training we are on (generation)
+    :param stop_when_dead: Whether to stop run of sequence after first life lost
+    :param world: The world to run sequence in, False if all
+    :param stage: The stage to run sequence in, False if all
+    :param shared_prefix: Number of leading actions the sequence shares with its parent
+    :return: The index of the sequence
+    """
+    population = get_worker_population()
+    neg_fitness, max_reached, data, seq = run_sequence_parallel(
+        population.genes[index].tolist(),
+        episode,
+        index,
+        stop_when_dead,
+        world,
+        stage,
+        shared_prefix,
+    )
+    population.results[index] = data + [max_reached]
+    return index
+
+
 def fitness_of_sequence_all_levels(info):
     """
     Returns fitness score based on GA for all levels
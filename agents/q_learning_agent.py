@@ -1,5 +1,38 @@
 import random
 
+import numpy as np
+
+from agents.q_table import DictQTable
+
+
+def argmax_random_tie(values):
+    """
+    Finds the index of the highest value in one pass, choosing uniformly at random between tied values.
+
+    :param values: The values to search, e.g. the q-values of every action
+    :return: The index of a highest value, or None if there are no values
+    """
+    if isinstance(values, np.ndarray):
+        best_indices = np.flatnonzero(values == values.max()) if len(values) else []
+        if len(best_indices) == 1:
+            return int(best_indices[0])
+        return int(random.choice(best_indices)) if len(best_indices) else None
+    best_value = None
+    best_indices = []
+    for index, value in enumerate(values):
+        if best_indices and value < best_value:
+            continue
+        if not best_indices or value > best_value:
+            best_value = value
+            best_indices = [index]
+        else:
+            best_indices.append(index)
+    if not best_indices:
+        return None
+    if len(best_indices) == 1:
+        return best_indices[0]
+    return random.choice(best_indices)
+
 
 class QLearningMarioAgent:
     """
@@ -19,7 +52,8 @@ class QLearningMarioAgent:
         Initializes the Q-Learning agent.
 
         :param actions (list): representing possible actions.
-        :param q_values (dict): represents the current q-values with state and action mapped to q-value
+        :param q_values (dict or q-table): represents the current q-values, either a dict with state and action
+            mapped to q-value or a q-table from agents/q_table.py (e.g. a DenseQTable to intern states)
         :param exploration_rate (float): representing the rate of exploration (taking random action)
         :param learning_rate (float): learning rate
         :param discount (float): discount factor
@@ -31,11 +65,14 @@ class QLearningMarioAgent:
         self.actions = actions
         self.exploration_rate = exploration_rate
         self.decay = decay
-        if q_values:
-            self.q_values = q_values
-        else:
+        if q_values is None or isinstance(q_values, dict):
             # if not given, initialize empty dictionary
-            self.q_values = {}
+            self.q_table = DictQTable(actions, q_values)
+        else:
+            self.q_table = q_values
+        # (state, q-values of every action) of the last states seen, so a state's row is fetched once for its
+        # get_action and update calls
+        self._q_rows = []
 
     def get_q_value(self, state, action):
         """
@@ -45,13 +82,51 @@ class QLearningMarioAgent:
         :param action: Represents the action to get the q-value for
         :return: The stored q-value or 0.0 if it does not exist
         """
-        return self.q_values.get((state, action), 0.0)
+        return self.q_table.get(state, action)
 
     def get_q_values(self):
         """
-        Returns the map of State, Action pairs to Q-values
+        Returns the map of State, Action pairs to Q-values, or the q-table itself if it isn't dict based. Either can
+        be passed back as q_values to continue training.
+        """
+        if isinstance(self.q_table, DictQTable):
+            return self.q_table.q_values
+        return self.q_table
+
+    def compute_q_row(self, state):
+        """
+        Computes the q-values of every action for a given state.
+
+        :param state: The state to get the q-values for
+        :return (list): The q-value of each action, indexed by action
+        """
+        return self.q_table.row(state)
+
+    def get_q_row(self, state):
+        """
+        Gets the q-values of every action for a given state, computing them only if the state is not one of the
+        last two states seen (the state of the current step and the next state of the last update). Array states
+        are matched by identity, so an array must not be modified after it is passed.
+
+        :param state: The state to get the q-values for
+        :return (list): The q-value of each action, indexed by action
+        """
+        for cached_state, row in self._q_rows:
+            if cached_state is state or (
+                not isinstance(state, np.ndarray)
+                and not isinstance(cached_state, np.ndarray)
+                and cached_state == state
+            ):
+                return row
+        row = self.compute_q_row(state)
+        self._q_rows = [self._q_rows[-1], (state, row)] if self._q_rows else [(state, row)]
+        return row
+
+    def clear_q_rows(self):
+        """
+        Forgets the cached q-values, for when a change can affect the q-values of any state.
         """
-        return self.q_values
+        self._q_rows = []
 
     def compute_value_from_q_value(self, state):
         """
@@ -60,7 +135,8 @@ class QLearningMarioAgent:
         :param state: The state to find value for.
         :return (float): The highest q-value over all actions possible from this state
         """
-        return max(self.get_q_value(state, action) for action in range(self.actions))
+        row = self.get_q_row(state)
+        return float(row.max()) if isinstance(row, np.ndarray) else max(row)
 
     def compute_action_from_q_value(self, state):
         """
@@ -69,16 +145,7 @@ class QLearningMarioAgent:
         :param state: The state to find an action for
         :return: the action with the highest q-value for this state
         """
-        potential_actions = []
-        for action in range(self.actions):
-            if self.get_q_value(state, action) == self.compute_value_from_q_value(
-                state
-            ):
-                potential_actions.append(action)
-        if not potential_actions:
-            return None
-        else:
-            return random.choice(potential_actions)
+        return argmax_random_tie(self.get_q_row(state))
 
     def get_action(self, state):
         """
@@ -105,7 +172,9 @@ class QLearningMarioAgent:
         :param next_state: the state that was reached
         :param reward: the reward that was gained
         """
+        row = self.get_q_row(state)
         sample = reward + (self.discount * self.compute_value_from_q_value(next_state))
-        self.q_values[(state, action)] = (
-            (1 - self.learning_rate) * self.get_q_value(state, action)
-        ) + (self.learning_rate * sample)
+        q_value = ((1 - self.learning_rate) * row[action]) + (self.learning_rate * sample)
+        self.q_table.set(state, action, q_value)
+        # keep the cached row of this state in step with the table
+        row[action] = q_value
@@ -0,0 +1,151 @@
+import hashlib
+
+import numpy as np
+
+
+class DictQTable:
+    """
+    Q-table backed by a dict mapping (state, action) pairs to q-values. States can be anything hashable; pairs that
+    were never updated have a q-value of 0.0.
+    """
+
+    def __init__(self, actions, q_values=None):
+        """
+        :param actions (int): Number of possible actions
+        :param q_values (dict): Existing map of (state, action) pairs to q-values to continue from
+        """
+        self.actions = actions
+        self.q_values = q_values if q_values is not None else {}
+
+    def __len__(self):
+        return len(self.q_values)
+
+    def get(self, state, action):
+        """
+        Gets the q-value of a state action pair.
+
+        :param state: The state
+        :param action: The action
+        :return: The stored q-value or 0.0 if it does not exist
+        """
+        return self.q_values.get((state, action), 0.0)
+
+    def row(self, state):
+        """
+        Gets the q-values of every action for a state.
+
+        :param state: The state
+        :return (list): The q-value of each action, indexed by action
+        """
+        return [self.q_values.get((state, action), 0.0) for action in range(self.actions)]
+
+    def set(self, state, action, value):
+        """
+        Sets the q-value of a state action pair.
+
+        :param state: The state
+        :param action: The action
+        :param value: The new q-value
+        """
+        self.q_values[(state, action)] = value
+
+
+class DenseQTable:
+    """
+    Q-table that interns every distinct state to an integer id and keeps the q-values in a float32 array of shape
+    (states, actions), which doubles in size when it fills up. A state-action pair costs 4 bytes plus, per state, an
+    entry in the id map: numpy arrays (e.g. raw frames) are keyed by a 16 byte blake2b digest of their bytes, anything
+    else (e.g. info tuples) by itself.
+
+    The keys of the last two array states are remembered by object identity so that the row and update of a step
+    hash each frame once; an array passed as a state must not be modified afterwards (copy observations the env
+    reuses, as nes_py does with its screen).
+    """
+
+    def __init__(self, actions, initial_states=1024):
+        """
+        :param actions (int): Number of possible actions
+        :param initial_states (int): Number of states room is allocated for up front
+        """
+        self.actions = actions
+        self.values = np.zeros((max(1, initial_states), actions), dtype=np.float32)
+        self.state_ids = {}
+        self._recent = []
+
+    def __len__(self):
+        return len(self.state_ids)
+
+    def state_key(self, state):
+        """
+        Gets the key a state is interned under.
+
+        :param state: The state
+        :return: A digest of the bytes of an array state, or the state itself
+        """
+        if isinstance(state, np.ndarray):
+            return hashlib.blake2b(np.ascontiguousarray(state), digest_size=16).digest()
+        return state
+
+    def state_id(self, state, add=True):
+        """
+        Gets the id of a state, which is its row in values.
+
+        :param state: The state
+        :param add: Whether to give a new state an id (with q-values of 0.0)
+        :return: The id of the state, or None if it is new and add is False
+        """
+        is_array = isinstance(state, np.ndarray)
+        key = None
+        if is_array:
+            for recent_state, recent_key in self._recent:
+                if recent_state is state:
+                    key = recent_key
+                    break
+        if key is None:
+            key = self.state_key(state)
+            if is_array:
+                self._recent = self._recent[-1:] + [(state, key)]
+        state_id = self.state_ids.get(key)
+        if state_id is None and add:
+            state_id = len(self.state_ids)
+            if state_id == len(self.values):
+                values = np.zeros((2 * len(self.values), self.actions), dtype=np.float32)
+                values[:state_id] = self.values
+                self.values = values
+            self.state_ids[key] = state_id
+        return state_id
+
+    def get(self, state, action):
+        """
+        Gets the q-value of a state action pair.
+
+        :param state: The state
+        :param action: The action
+        :return: The stored q-value or 0.0 if the state is new
+        """
+        state_id = self.state_id(state, add=False)
+        return 0.0 if state_id is None else float(self.values[state_id, action])
+
+    def row(self, state):
+        """
+        Gets the q-values of every action for a state.
+
+        :param state: The state
+        :return (np.ndarray): Copy of the q-value of each action, indexed by action
+        """
+        state_id = self.state_id(state, add=False)
+        if state_id is None:
+            return np.zeros(self.actions, dtype=np.float32)
+        return self.values[state_id].copy()
+
+    def set(self, state, action, value):
+        """
+        Sets the q-value of a state action pair.
+
+        :param state: The state
+        :param action: The action
+        :param value: The new q-value
+        """
+        # interning can grow values, so the id is taken first
+        state_id = self.state_id(state)
+        self.values[state_id, action] = value
@@ -0,0 +1,491 @@
+import numpy as np
+import torch
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of transitions stored in preallocated tensors. Frames are kept as uint8 and only a sampled batch is
+    converted to float in [0, 1] (and moved to the training device).
+    """
+
+    def __init__(self, capacity, state_dim, device='cpu', streams=1):
+        """
+        :param capacity: Number of transitions kept before the oldest ones are overwritten
+        :param state_dim: Shape of one state, e.g. (4, 84, 84)
+        :param device: Device sampled batches are moved to
+        :param streams: Number of envs pushing transitions (full transitions can be interleaved, so it is unused)
+        """
+        self.capacity = int(capacity)
+        self.state_dim = tuple(state_dim)
+        self.device = device
+
+        self.states = torch.empty((self.capacity,) + self.state_dim, dtype=torch.uint8)
+        self.next_states = torch.empty((self.capacity,) + self.state_dim, dtype=torch.uint8)
+        self.actions = torch.empty(self.capacity, dtype=torch.long)
+        self.rewards = torch.empty(self.capacity, dtype=torch.float32)
+        self.dones = torch.empty(self.capacity, dtype=torch.bool)
+
+        self.position = 0  # slot the next transition is written to
+        self.size = 0
+        self.pushes = 0  # transitions pushed so far
+
+    def __len__(self):
+        return self.size
+
+    def push(self, state, next_state, action, reward, done, stream=0):
+        """
+        Adds a transition, overwriting the oldest one once the buffer is full.
+
+        Inputs:
+        state(LazyFrames): uint8 frame stack the action was taken in
+        next_state(LazyFrames): uint8 frame stack the action led to
+        action(int), reward(float), done(bool)
+        stream(int): The env the transition comes from (unused)
+        Outputs:
+        index(int): The slot the transition was written to
+        """
+        index = self.position
+        self.states[index] = torch.from_numpy(np.asarray(state))
+        self.next_states[index] = torch.from_numpy(np.asarray(next_state))
+        self.actions[index] = int(action)
+        self.rewards[index] = float(reward)
+        self.dones[index] = bool(done)
+
+        self.position = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.pushes += 1
+        return index
+
+    def unsampleable_slots(self):
+        """
+        Returns the slots holding transitions that can't be sampled (every stored transition is complete here).
+        """
+        return []
+
+    def sample(self, batch_size):
+        """
+        Samples a batch of transitions uniformly (with replacement).
+        """
+        age = torch.randint(0, self.size, (batch_size,))
+        return self.gather((self.position - 1 - age) % self.capacity)
+
+    def gather(self, indices):
+        """
+        Returns the transitions at the given slots as a batch on the training device, with frames as float in [0, 1].
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        state = self._to_device(self.states[indices]).float().div_(255)
+        next_state = self._to_device(self.next_states[indices]).float().div_(255)
+        action = self._to_device(self.actions[indices])
+        reward = self._to_device(self.rewards[indices])
+        done = self._to_device(self.dones[indices])
+        return state, next_state, action, reward, done
+
+    def checkpoint(self):
+        """
+        Starts a checkpoint: returns the arrays to write (the live tensors, which keep changing while they are
+        written) and a snapshot of the counters, to pass to finish_checkpoint once the arrays are written.
+        """
+        arrays = {'states': self.states, 'next_states': self.next_states, 'actions': self.actions,
+                  'rewards': self.rewards, 'dones': self.dones}
+        return arrays, {'position': self.position, 'size': self.size, 'pushes': self.pushes}
+
+    def finish_checkpoint(self, counters):
+        """
+        Finishes a checkpoint. Transitions pushed since checkpoint() overwrote the oldest transitions of the snapshot
+        in the written arrays, so those are dropped from it.
+
+        Outputs:
+        counters(dict): The counters to store
+        overwritten(list): Slots written to since checkpoint()
+        patches(dict): Array name -> {slot: value} to set in the written arrays
+        """
+        position, size = counters['position'], counters['size']
+        pushed = min(self.pushes - counters['pushes'], self.capacity)
+        dropped = min(size, max(0, size + pushed - self.capacity))
+        overwritten = [(position + k) % self.capacity for k in range(pushed)]
+        return {'position': position, 'size': size - dropped, 'pushes': counters['pushes']}, overwritten, {}
+
+    def load_checkpoint(self, arrays, counters):
+        """
+        Makes the buffer use the arrays of a checkpoint (e.g. memory-mapped by util.checkpoint.load_replay).
+        """
+        if tuple(arrays['states'].shape) != tuple(self.states.shape):
+            raise ValueError(f"Expecting replay states of shape {tuple(self.states.shape)}, "
+                             f"got: {tuple(arrays['states'].shape)}")
+        for name in ['states', 'next_states', 'actions', 'rewards', 'dones']:
+            setattr(self, name, torch.from_numpy(arrays[name]))
+        self.position, self.size, self.pushes = counters['position'], counters['size'], counters['pushes']
+
+    def _to_device(self, tensor):
+        return tensor.to(self.device, non_blocking=True)
+
+
+class FrameReplayBuffer:
+    """
+    Replay buffer that stores every frame once. Consecutive FrameStack states overlap (the next state is the state
+    shifted by one frame), so each transition only keeps the newest frame of its state and stacks are rebuilt from
+    frame indices when sampled. Frames from before the start of an episode are replaced by the episode's first frame,
+    the same way FrameStack pads after a reset.
+
+    With several envs feeding the buffer, each one gets its own stream: an equal, contiguous share of the slots used as
+    a separate ring, so the frames of an episode stay consecutive.
+
+    An episode that is cut off without done loses the frame of its last next state to the next episode's first
+    frame. The training loop only cuts episodes on flag_get, which single stage envs also report as done.
+    """
+
+    def __init__(self, capacity, state_dim, device='cpu', streams=1):
+        """
+        :param capacity: Number of transitions (and frames) kept before the oldest ones are overwritten
+        :param state_dim: Shape of one state, (stack size, height, width)
+        :param device: Device sampled batches are moved to
+        :param streams: Number of envs pushing transitions
+        """
+        self.streams = int(streams)
+        self.stream_capacity = int(capacity) // self.streams
+        self.capacity = self.stream_capacity * self.streams
+        self.state_dim = tuple(state_dim)
+        self.stack_size = self.state_dim[0]
+        self.device = device
+
+        # frames[i] is the newest frame of the state of transition i
+        self.frames = torch.empty((self.capacity,) + self.state_dim[1:], dtype=torch.uint8)
+        self.actions = torch.empty(self.capacity, dtype=torch.long)
+        self.rewards = torch.empty(self.capacity, dtype=torch.float32)
+        self.dones = torch.empty(self.capacity, dtype=torch.bool)
+        # whether transition i is the first of its episode
+        self.starts = torch.zeros(self.capacity, dtype=torch.bool)
+
+        # slot (within the stream) the next transition of each stream is written to
+        self.positions = torch.zeros(self.streams, dtype=torch.long)
+        self.sizes = torch.zeros(self.streams, dtype=torch.long)
+        self.pushes = torch.zeros(self.streams, dtype=torch.long)  # transitions pushed to each stream so far
+        self._episode_over = torch.ones(self.streams, dtype=torch.bool)
+        self._stack_offsets = torch.arange(1 - self.stack_size, 1)
+        # oldest transitions of a full stream left out of sampling (see sampleable)
+        self._unsampleable = self.stack_size
+
+    def __len__(self):
+        return int(self.sizes.sum())
+
+    def share_memory(self):
+        """
+        Moves the buffer into shared memory, so that processes it is passed to (with torch.multiprocessing) can each
+        push to their own stream while another one samples. A push writes the frame slot after its own before it
+        moves the stream's position on, so one more of the oldest transitions of each full stream is left out of
+        sampling: no sampleable stack reads that slot while it is being written.
+        """
+        self._unsampleable = self.stack_size + 1
+        for tensor in [self.frames, self.actions, self.rewards, self.dones, self.starts, self.positions, self.sizes,
+                       self.pushes, self._episode_over]:
+            tensor.share_memory_()
+        return self
+
+    def push(self, state, next_state, action, reward, done, stream=0):
+        """
+        Adds a transition, overwriting the oldest one of its stream once the stream is full.
+
+        Inputs:
+        state(LazyFrames): uint8 frame stack the action was taken in
+        next_state(LazyFrames): uint8 frame stack the action led to
+        action(int), reward(float), done(bool)
+        stream(int): The env the transition comes from
+        Outputs:
+        index(int): The slot the transition was written to
+        """
+        base = stream * self.stream_capacity
+        position = int(self.positions[stream])
+        index = base + position
+        following = base + (position + 1) % self.stream_capacity
+        frame = torch.from_numpy(np.asarray(state[-1]))
+        # the slot already holds the previous next_state's frame; if it differs, an episode ended without done
+        self.starts[index] = bool(self._episode_over[stream]) or not torch.equal(self.frames[index], frame)
+        self.frames[index] = frame
+        # the next state's frame goes into the slot of the following transition, which will be this episode's
+        # next transition (same frame) or, after done, the first transition of a new episode
+        self.frames[following] = torch.from_numpy(np.asarray(next_state[-1]))
+        self.actions[index] = int(action)
+        self.rewards[index] = float(reward)
+        self.dones[index] = bool(done)
+        self._episode_over[stream] = bool(done)
+
+        # counters last, so a process sampling concurrently never sees the new transition before it is written; the
+        # following slot was overwritten above while it still counted as sampleable, which share_memory allows for
+        self.positions[stream] = following - base
+        self.sizes[stream] = min(int(self.sizes[stream]) + 1, self.stream_capacity)
+        self.pushes[stream] += 1
+        return index
+
+    def sampleable(self):
+        """
+        Returns the number of newest transitions of each stream whose full stacks are still in the buffer. Once a
+        stream wraps, its oldest transition's frame slot holds the newest next frame, and the next stack_size - 1
+        transitions look back into it, so those are left out (and one more in shared memory, see share_memory).
+        """
+        sizes = self.sizes.numpy()
+        return np.where(sizes < self.stream_capacity, sizes, self.stream_capacity - self._unsampleable)
+
+    def unsampleable_slots(self):
+        """
+        Returns the slots of the transitions left out by sampleable().
+        """
+        full = np.flatnonzero(self.sizes.numpy() == self.stream_capacity)
+        local = (self.positions.numpy()[full, None] + np.arange(self._unsampleable)) % self.stream_capacity
+        return (full[:, None] * self.stream_capacity + local).ravel().tolist()
+
+    def sample(self, batch_size):
+        """
+        Samples a batch of transitions uniformly (with replacement).
+        """
+        counts = self.sampleable()
+        ends = np.cumsum(counts)
+        draws = np.random.randint(0, ends[-1], batch_size)
+        stream = np.searchsorted(ends, draws, side='right')
+        age = draws - (ends[stream] - counts[stream])
+        local = (self.positions.numpy()[stream] - 1 - age) % self.stream_capacity
+        return self.gather(torch.from_numpy(stream * self.stream_capacity + local))
+
+    def gather(self, indices):
+        """
+        Returns the transitions at the given slots as a batch on the training device, with frames as float in [0, 1].
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        base = indices - indices % self.stream_capacity
+        local = indices - base
+        stack = base[:, None] + (local[:, None] + self._stack_offsets) % self.stream_capacity
+        # walk back from the newest frame; everything before an episode's first frame becomes that frame
+        before_start = self.starts[stack]
+        for k in range(self.stack_size - 2, -1, -1):
+            cut = before_start[:, k + 1]
+            stack[:, k] = torch.where(cut, stack[:, k + 1], stack[:, k])
+            before_start[:, k] |= cut
+        following = base + (local + 1) % self.stream_capacity
+        next_stack = torch.cat([stack[:, 1:], following[:, None]], dim=1)
+
+        state = self._to_device(self.frames[stack]).float().div_(255)
+        next_state = self._to_device(self.frames[next_stack]).float().div_(255)
+        action = self._to_device(self.actions[indices])
+        reward = self._to_device(self.rewards[indices])
+        done = self._to_device(self.dones[indices])
+        return state, next_state, action, reward, done
+
+    def checkpoint(self):
+        """
+        Starts a checkpoint: returns the arrays to write (the live tensors, which keep changing while they are
+        written) and a snapshot of the counters, to pass to finish_checkpoint once the arrays are written.
+        """
+        arrays = {'frames': self.frames, 'actions': self.actions, 'rewards': self.rewards, 'dones': self.dones,
+                  'starts': self.starts}
+        counters = {
+            'streams': self.streams,
+            'positions': self.positions.tolist(),
+            'sizes': self.sizes.tolist(),
+            'pushes': self.pushes.tolist(),
+            'episode_over': self._episode_over.tolist(),
+        }
+        # the slot each stream writes next holds the frame of its newest next state, which its next push replaces
+        bases = torch.arange(self.streams) * self.stream_capacity
+        counters['next_frames'] = self.frames[bases + self.positions].clone()
+        return arrays, counters
+
+    def finish_checkpoint(self, counters):
+        """
+        Finishes a checkpoint. Transitions pushed since checkpoint() overwrote the oldest transitions of each
+        stream of the snapshot in the written arrays, so those are dropped from it, the oldest transition left is
+        marked as an episode start (its stack can't look back into overwritten frames) and the frame of each stream's
+        newest next state is put back.
+
+        Outputs:
+        counters(dict): The counters to store
+        overwritten(list): Slots whose frames were written to since checkpoint()
+        patches(dict): Array name -> {slot: value} to set in the written arrays
+        """
+        counters = dict(counters)
+        next_frames = counters.pop('next_frames')
+        overwritten = []
+        patches = {'frames': {}, 'starts': {}}
+        for stream in range(self.streams):
+            base = stream * self.stream_capacity
+            position, size = counters['positions'][stream], counters['sizes'][stream]
+            pushed = min(int(self.pushes[stream]) - counters['pushes'][stream], self.stream_capacity)
+            if pushed == 0:
+                continue
+            # the pushes wrote the frames of slots position to position + pushed
+            dropped = min(size, max(0, size + pushed + 1 - self.stream_capacity))
+            size -= dropped
+            counters['sizes'][stream] = size
+            overwritten += [base + (position + k) % self.stream_capacity for k in range(pushed + 1)]
+            patches['frames'][base + position] = next_frames[stream]
+            if dropped and size:
+                patches['starts'][base + (position - size) % self.stream_capacity] = True
+        return counters, overwritten, patches
+
+    def load_checkpoint(self, arrays, counters):
+        """
+        Makes the buffer use the arrays of a checkpoint (e.g. memory-mapped by util.checkpoint.load_replay).
+        """
+        if counters['streams'] != self.streams or tuple(arrays['frames'].shape) != tuple(self.frames.shape):
+            raise ValueError(f"Expecting {self.streams} replay streams of frames {tuple(self.frames.shape)}, "
+                             f"got: {counters['streams']} of {tuple(arrays['frames'].shape)}")
+        for name in ['frames', 'actions', 'rewards', 'dones', 'starts']:
+            setattr(self, name, torch.from_numpy(arrays[name]))
+        self.positions = torch.tensor(counters['positions'], dtype=torch.long)
+        self.sizes = torch.tensor(counters['sizes'], dtype=torch.long)
+        self.pushes = torch.tensor(counters['pushes'], dtype=torch.long)
+        self._episode_over = torch.tensor(counters['episode_over'], dtype=torch.bool)
+
+    def _to_device(self, tensor):
+        return tensor.to(self.device, non_blocking=True)
+
+
+class SumTree:
+    """
+    Binary tree over the priorities of the replay slots where every node holds the sum of its two children, for
+    O(log n) proportional sampling and priority updates. It is a flat array with the root at 1 and the leaves at
+    [leaf_offset, leaf_offset + capacity); both operations walk a whole batch down or up one level at a time.
+    """
+
+    def __init__(self, capacity):
+        self.depth = max(0, (int(capacity) - 1).bit_length())
+        self.leaf_offset = 1 << self.depth
+        self.tree = np.zeros(2 * self.leaf_offset, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def leaves(self, indices):
+        return self.tree[np.asarray(indices) + self.leaf_offset]
+
+    def update(self, indices, priorities):
+        """
+        Sets the priorities of the given slots and recomputes the sums above them.
+        """
+        nodes = np.asarray(indices, dtype=np.int64) + self.leaf_offset
+        if nodes.size == 0:
+            return
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Returns, for every value in (0, total], the slot whose range of the cumulative priorities contains it.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values > self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaf_offset
+
+
+class PrioritizedReplayBuffer:
+    """
+    Proportional prioritized replay over one of the storages above. Slots are sampled with probability p^alpha / sum,
+    where p is the absolute TD error the transition last had (new transitions get the highest priority seen so far),
+    and come with importance-sampling weights whose exponent beta is annealed to 1 over beta_steps samples.
+    """
+
+    def __init__(self, storage, alpha=0.6, beta=0.4, beta_steps=1e6, epsilon=1e-5):
+        """
+        :param storage: ReplayBuffer or FrameReplayBuffer holding the transitions
+        :param alpha: How strongly priorities skew sampling (0 is uniform)
+        :param beta: Initial importance-sampling exponent
+        :param beta_steps: Number of sampled batches over which beta reaches 1
+        :param epsilon: Added to every TD error so no transition gets priority 0
+        """
+        self.storage = storage
+        self.capacity = storage.capacity
+        self.device = storage.device
+        self.tree = SumTree(storage.capacity)
+        self.alpha = alpha
+        self.beta_start = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.samples = 0
+
+    def __len__(self):
+        return len(self.storage)
+
+    @property
+    def beta(self):
+        return min(1.0, self.beta_start + (1.0 - self.beta_start) * self.samples / self.beta_steps)
+
+    def push(self, state, next_state, action, reward, done, stream=0):
+        index = self.storage.push(state, next_state, action, reward, done, stream)
+        self.tree.update([index], self.max_priority ** self.alpha)
+        self.tree.update(self.storage.unsampleable_slots(), 0.0)
+        return index
+
+    def sample(self, batch_size):
+        """
+        Samples a batch with one slot from each of batch_size equal ranges of the cumulative priorities.
+
+        Outputs:
+        batch: (state, next_state, action, reward, done) as returned by the storage
+        indices (np.ndarray): The slots sampled, to pass back to update_priorities
+        weights (torch.Tensor): Importance-sampling weights, normalized to a max of 1
+        """
+        total = self.tree.total()
+        segment = total / batch_size
+        # (0, 1] rather than [0, 1), so a value never falls on a slot with priority 0
+        values = (np.arange(batch_size) + 1 - np.random.random(batch_size)) * segment
+        indices = self.tree.find(np.minimum(values, total))
+
+        probabilities = self.tree.leaves(indices) / total
+        weights = (len(self) * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.samples += 1
+
+        batch = self.storage.gather(torch.from_numpy(indices))
+        weights = torch.as_tensor(weights, dtype=torch.float32).to(self.device, non_blocking=True)
+        return batch, indices, weights
+
+    def checkpoint(self):
+        """
+        Starts a checkpoint of the storage and the priorities (see ReplayBuffer.checkpoint).
+        """
+        arrays, counters = self.storage.checkpoint()
+        leaves = self.tree.tree[self.tree.leaf_offset:self.tree.leaf_offset + self.capacity]
+        arrays['priorities'] = leaves
+        counters['max_priority'] = self.max_priority
+        counters['samples'] = self.samples
+        return arrays, counters
+
+    def finish_checkpoint(self, counters):
+        """
+        Finishes a checkpoint of the storage, and gives the slots overwritten since it started priority 0.
+        """
+        counters = dict(counters)
+        max_priority, samples = counters.pop('max_priority'), counters.pop('samples')
+        counters, overwritten, patches = self.storage.finish_checkpoint(counters)
+        counters['max_priority'] = max_priority
+        counters['samples'] = samples
+        patches['priorities'] = {slot: 0.0 for slot in overwritten}
+        return counters, overwritten, patches
+
+    def load_checkpoint(self, arrays, counters):
+        self.storage.load_checkpoint(arrays, counters)
+        self.tree.update(np.arange(self.capacity), arrays['priorities'])
+        self.max_priority = counters['max_priority']
+        self.samples = counters['samples']
+
+    def update_priorities(self, indices, td_errors):
+        """
+        Sets the priorities of sampled slots from the TD errors computed for them.
+        """
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+
+# replay storage modes DeepQLearningMario can be built with
+REPLAY_STORAGE = {
+    'stacks': ReplayBuffer,
+    'frames': FrameReplayBuffer,
+}
@@ -0,0 +1,96 @@
+"""
+Benchmark of DQN training throughput with acting and learning interleaved on one thread (deep_q_learning.py) and
+split across actor processes and a learner (deep_q_learning_async.py). Both run for the same wall time with the same
+burn-in, and the env steps/s and gradient updates/s of each are reported.
+
+Run from the repository root:
+    python -m benchmarks.dqn_async_benchmark --seconds 60 --actors 3
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from agents.deep_q_learning_agent import DeepQLearningMario
+from deep_q_learning_async import train_async
+from util.wrappers import make_mario_env
+
+
+def benchmark_sync(seconds, burnin, replay_capacity):
+    """
+    Runs the single-threaded act/cache/learn loop for the given time.
+
+    :param seconds: Wall time to run for
+    :param burnin: Transitions before learning starts
+    :param replay_capacity: Replay capacity
+    :return: Dict of env steps/s and updates/s
+    """
+    env = make_mario_env()
+    mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=env.action_space.n,
+                               save_dir=Path(tempfile.mkdtemp()), replay_capacity=replay_capacity)
+    mario.burnin = burnin
+    mario.save_every = float('inf')
+    updates = 0
+    learn_start = None
+    start = time.time()
+    while time.time() - start < seconds:
+        state = env.reset()
+        while time.time() - start < seconds:
+            action = mario.act(state)
+            next_state, reward, done, info = env.step(action)
+            mario.cache(state, next_state, action, reward, done)
+            q, loss = mario.learn()
+            if loss is not None:
+                if learn_start is None:
+                    learn_start = time.time()
+                updates += 1
+            state = next_state
+            if done or info['flag_get']:
+                break
+    elapsed = time.time() - start
+    env.close()
+    return {
+        'seconds': elapsed,
+        'env_steps': mario.curr_step,
+        'updates': updates,
+        'env_steps_per_s': mario.curr_step / elapsed,
+        'updates_per_s': updates / (time.time() - learn_start) if learn_start else 0.0,
+    }
+
+
+def benchmark_dqn_async(seconds, actors, burnin=1000, replay_capacity=20000):
+    """
+    Times the synchronous and the asynchronous training loops for the same wall time.
+
+    :param seconds: Wall time of each run
+    :param actors: Number of actor processes of the asynchronous run
+    :param burnin: Transitions before learning starts, for both
+    :param replay_capacity: Replay capacity, for both
+    :return: Dict with the results of both runs
+    """
+    sync = benchmark_sync(seconds, burnin, replay_capacity)
+    asynchronous = train_async(Path(tempfile.mkdtemp()), actors, replay_capacity, episodes=None, seconds=seconds,
+                               burnin=burnin, report_every=0)
+    return {
+        'cpus': torch.multiprocessing.cpu_count(),
+        'cuda': torch.cuda.is_available(),
+        'sync': sync,
+        'async': asynchronous,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark synchronous vs asynchronous DQN training.")
+    parser.add_argument("--seconds", default=60.0, type=float)
+    parser.add_argument("--actors", default=max(1, torch.multiprocessing.cpu_count() - 1), type=int)
+    parser.add_argument("--burnin", default=1000, type=int)
+    args = parser.parse_args()
+
+    results = benchmark_dqn_async(args.seconds, args.actors, args.burnin)
+    print(f"{results['cpus']} CPUs, CUDA: {results['cuda']}")
+    for name in ['sync', 'async']:
+        run = results[name]
+        print(f"{name:>5}: {run['env_steps_per_s']:.1f} env steps/s, {run['updates_per_s']:.1f} updates/s "
+              f"({run['env_steps']} steps, {run['updates']} updates in {run['seconds']:.1f}s)")
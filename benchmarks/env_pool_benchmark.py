@@ -0,0 +1,98 @@
+"""
+Benchmark of GA rollouts with and without the worker-local environment pool. The same random sequences are run once
+with a new environment per individual (the old behaviour of run_sequence) and once through util.env_pool, and the
+individuals evaluated per second are reported for both.
+
+Run from the repository root:
+    python -m benchmarks.env_pool_benchmark --individuals 20 --sequence_length 500
+"""
+import argparse
+import random
+import time
+
+from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+
+from agents import genetic_sequence_agent
+from util.env_pool import close_envs, make_env
+
+
+def _run_sequence_fresh_env(sequence, env_name, stop_when_dead):
+    """
+    Runs the sequence the way run_sequence did before the pool: make, run and close an environment.
+
+    :param sequence: The sequence to run
+    :param env_name: The env to make to run the sequence
+    :param stop_when_dead: Whether we should stop after first death.
+    :return: Max step reached, Info on run
+    """
+    env = make_env(env_name)
+    env.reset()
+    info = None
+    for i in range(len(sequence)):
+        state, reward, done, info = env.step(sequence[i])
+        if done or (stop_when_dead and (info["life"] < 2 or info["time"] == 0)):
+            env.close()
+            return i, info
+    env.close()
+    return len(sequence) - 1, info
+
+
+def benchmark_env_pool(
+    env_name, individuals, sequence_length, stop_when_dead=True, seed=0
+):
+    """
+    Times the evaluation of the same random individuals with and without the environment pool.
+
+    :param env_name: The env to run the individuals in
+    :param individuals: Number of individuals to evaluate
+    :param sequence_length: Length of each random sequence
+    :param stop_when_dead: Whether to stop each run after the first death
+    :param seed: Seed for the random sequences
+    :return: Dict of individuals per second before and after
+    """
+    random.seed(seed)
+    sequences = genetic_sequence_agent.get_initial_sequences(
+        sequence_length, individuals, len(SIMPLE_MOVEMENT)
+    )
+
+    start = time.perf_counter()
+    for sequence in sequences:
+        _run_sequence_fresh_env(sequence, env_name, stop_when_dead)
+    fresh_seconds = time.perf_counter() - start
+
+    # the pooled timing includes building the env once, as a worker would
+    close_envs()
+    start = time.perf_counter()
+    for sequence in sequences:
+        genetic_sequence_agent.run_sequence(sequence, env_name, stop_when_dead)
+    pooled_seconds = time.perf_counter() - start
+    close_envs()
+
+    return {
+        "env_name": env_name,
+        "individuals": individuals,
+        "sequence_length": sequence_length,
+        "fresh_env_individuals_per_s": individuals / fresh_seconds,
+        "pooled_env_individuals_per_s": individuals / pooled_seconds,
+        "speedup": fresh_seconds / pooled_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the GA env pool.")
+    parser.add_argument("--env", default="SuperMarioBros-1-1-v3")
+    parser.add_argument("--individuals", default=20, type=int)
+    parser.add_argument("--sequence_length", default=500, type=int)
+    args = parser.parse_args()
+
+    results = benchmark_env_pool(args.env, args.individuals, args.sequence_length)
+    print(
+        f"{results['individuals']} individuals of {results['sequence_length']} actions on {results['env_name']}"
+    )
+    print(
+        f"New env per individual: {results['fresh_env_individuals_per_s']:.2f} individuals/s"
+    )
+    print(
+        f"Pooled env:             {results['pooled_env_individuals_per_s']:.2f} individuals/s"
+    )
+    print(f"Speedup: {results['speedup']:.2f}x")
@@ -0,0 +1,93 @@
+"""
+Benchmark of DQN action-selection latency. States are recorded from the env with random actions, then the greedy
+action for one state at a time is timed with the original act path (a float32 forward pass with autograd) and with
+MarioInferenceNet in every precision, with and without channels-last. Each variant also reports the fraction of
+states on which it picks the same greedy action as the float32 network.
+
+Use --checkpoint to load trained weights: with a freshly initialized network, Q values of both actions are almost
+equal and the agreement check says little.
+
+Run from the repository root:
+    python -m benchmarks.inference_benchmark --states 500 --checkpoint data/checkpoints/mario_net_1.chkpt
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from agents.conv_neural_network import INFERENCE_PRECISIONS, MarioInferenceNet, MarioNet, greedy_agreement
+from util.wrappers import make_mario_env
+
+
+def record_states(states, seed=0):
+    """
+    Plays random actions and returns the frame stacks seen, as float states in [0, 1].
+
+    :param states: Number of states to record
+    :param seed: Seed for the random actions
+    :return: Tensor of states, dimension is (states, 4, 84, 84)
+    """
+    rng = np.random.default_rng(seed)
+    env = make_mario_env()
+    observations = [np.asarray(env.reset())]
+    while len(observations) < states:
+        observation, reward, done, info = env.step(int(rng.integers(env.action_space.n)))
+        observations.append(np.asarray(env.reset() if done else observation))
+    env.close()
+    return torch.from_numpy(np.stack(observations)).float().div_(255)
+
+
+def time_per_action(net, states, repeats=3):
+    """
+    Returns the best of repeats runs of the mean seconds to pick the greedy action for one state.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(len(states)):
+            torch.argmax(net(states[i:i + 1]), axis=1).item()
+        best = min(best, (time.perf_counter() - start) / len(states))
+    return best
+
+
+def benchmark_inference(states=500, checkpoint=None):
+    """
+    Times batch-1 action selection and checks greedy agreement for every inference variant.
+
+    :param states: Number of recorded states to use
+    :param checkpoint: Path of a MarioNet checkpoint saved by DeepQLearningMario.save (None for random weights)
+    :return: Dict of variant name -> (microseconds per action, greedy agreement)
+    """
+    torch.manual_seed(0)
+    recorded = record_states(states)
+    net = MarioNet((4, 84, 84), 2).float()
+    if checkpoint is not None:
+        net.load_state_dict(torch.load(checkpoint, map_location='cpu')['model'])
+    online = net.online
+
+    variants = {'autograd_float32': online}
+    for precision in INFERENCE_PRECISIONS:
+        variants[f'{precision}'] = MarioInferenceNet(online, precision, channels_last=False)
+        variants[f'{precision}_channels_last'] = MarioInferenceNet(online, precision, channels_last=True)
+
+    # warm up, for one-time kernel selection
+    for variant in variants.values():
+        variant(recorded[:1])
+    return {
+        name: (time_per_action(variant, recorded) * 1e6, greedy_agreement(online, variant, recorded))
+        for name, variant in variants.items()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DQN action selection latency.")
+    parser.add_argument("--states", default=500, type=int)
+    parser.add_argument("--checkpoint", default=None)
+    args = parser.parse_args()
+
+    print(f"Threads: {torch.get_num_threads()}")
+    results = benchmark_inference(args.states, args.checkpoint)
+    baseline = results['autograd_float32'][0]
+    for name, (latency, agreement) in results.items():
+        print(f"{name:>26}: {latency:8.1f} us/action ({baseline / latency:.2f}x), greedy agreement {agreement:.3f}")
@@ -0,0 +1,97 @@
+"""
+Microbenchmark of DQN gradient updates per second for a range of batch sizes. A replay buffer is filled with random
+frames once, then each update (sampling included) is timed three ways: the original learn step (three separate
+forward passes with np.arange indexing), the current one (a forward pass with gradients on the states and one
+no-grad block for the Double-DQN target, indexed with gather on the device) and the current one with the online
+passes on states and next states fused into one.
+
+Run from the repository root:
+    python -m benchmarks.learner_benchmark --batch_sizes 32 64 128 256 512
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from agents.deep_q_learning_agent import DeepQLearningMario
+
+
+def _learn_batch_original(mario):
+    """
+    One update the way learn() did it before: np.arange indexing and three separate forward passes.
+    """
+    (state, next_state, action, reward, done), indices, weights = mario.recall()
+    batch = np.arange(0, mario.batch_size)
+    td_est = mario.net(state, model='online')[batch, action]
+    with torch.no_grad():
+        best_action = torch.argmax(mario.net(next_state, model='online'), axis=1)
+        next_Q = mario.net(next_state, model='target')[batch, best_action]
+        td_tgt = (reward + (1 - done.float()) * mario.gamma * next_Q).float()
+    loss = mario.loss_fn(td_est, td_tgt)
+    mario.optimizer.zero_grad()
+    loss.backward()
+    mario.optimizer.step()
+    return td_est.mean().item(), loss.item()
+
+
+def fill_memory(mario, transitions, seed=0):
+    """
+    Pushes random frame stacks into the agent's replay buffer, with an episode end every 200 transitions.
+    """
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 256, (transitions + 4, 84, 84), dtype=np.uint8)
+    for i in range(transitions):
+        mario.cache(frames[i:i + 4], frames[i + 1:i + 5], int(rng.integers(mario.action_dim)), float(rng.normal()),
+                    i % 200 == 199)
+
+
+def benchmark_learner(batch_sizes, seconds=5.0, transitions=5000):
+    """
+    Times updates of each learn step variant for each batch size.
+
+    :param batch_sizes: Batch sizes to time
+    :param seconds: Minimum time spent on each variant and batch size
+    :param transitions: Number of transitions in replay
+    :return: List of dicts with the updates/s of every variant for each batch size
+    """
+    mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=2, save_dir=Path(tempfile.mkdtemp()),
+                               replay_capacity=transitions)
+    fill_memory(mario, transitions)
+
+    variants = {
+        'original': lambda: _learn_batch_original(mario),
+        'current': mario.learn_batch,
+        'fused': mario.learn_batch,
+    }
+    results = []
+    for batch_size in batch_sizes:
+        mario.batch_size = batch_size
+        row = {'batch_size': batch_size}
+        for name, learn_batch in variants.items():
+            mario.fuse_online_pass = name == 'fused'
+            learn_batch()  # warm up
+            updates = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                learn_batch()
+                updates += 1
+            row[f'{name}_updates_per_s'] = updates / (time.perf_counter() - start)
+        mario.fuse_online_pass = False
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DQN learner updates/s.")
+    parser.add_argument("--batch_sizes", default=[32, 64, 128, 256, 512], type=int, nargs='+')
+    parser.add_argument("--seconds", default=5.0, type=float)
+    args = parser.parse_args()
+
+    print(f"Device: {'cuda' if torch.cuda.is_available() else 'cpu'}, threads: {torch.get_num_threads()}")
+    print(f"{'Batch':>6}{'Original':>12}{'Current':>12}{'Fused':>12}   updates/s")
+    for row in benchmark_learner(args.batch_sizes, args.seconds):
+        print(f"{row['batch_size']:6d}{row['original_updates_per_s']:12.1f}{row['current_updates_per_s']:12.1f}"
+              f"{row['fused_updates_per_s']:12.1f}")
@@ -0,0 +1,109 @@
+"""
+Benchmark of the per-frame latency of DQN observation preprocessing. Raw frames are recorded from the emulator once,
+then run through the old wrapper chain (GrayScaleObservation, skimage ResizeObservation and the x / 255. float64
+TransformObservation the training script used to apply), the same chain without the float conversion, and the fused
+cv2 PreprocessObservation, with and without normalization.
+
+Run from the repository root:
+    python -m benchmarks.preprocess_benchmark --frames 500
+"""
+import argparse
+import time
+
+import gym_super_mario_bros
+import numpy as np
+from gym.wrappers import GrayScaleObservation
+from nes_py.wrappers import JoypadSpace
+
+from util.wrappers import PreprocessObservation, ResizeObservation
+
+
+def record_frames(env_name, frames, seed=0):
+    """
+    Plays random actions and returns the raw RGB frames seen.
+
+    :param env_name: The env to play
+    :param frames: Number of frames to record
+    :param seed: Seed for the random actions
+    :return: The env (still open, for building wrappers on) and the list of frames
+
+    Observations are views of the emulator's screen buffer, so each frame is kept as a copy with the same strides.
+    """
+    rng = np.random.default_rng(seed)
+    env = JoypadSpace(gym_super_mario_bros.make(env_name), [['right'], ['right', 'A']])
+    observations = [_copy_screen(env.reset())]
+    while len(observations) < frames:
+        observation, reward, done, info = env.step(int(rng.integers(2)))
+        observations.append(_copy_screen(env.reset() if done else observation))
+    return env, observations
+
+
+def _copy_screen(observation):
+    """
+    Copies the screen buffer behind an observation and returns the same view of the copy.
+    """
+    screen = observation.base.copy()
+    return np.ndarray(observation.shape, observation.dtype, screen,
+                      observation.__array_interface__['data'][0] - observation.base.__array_interface__['data'][0],
+                      observation.strides)
+
+
+def time_per_frame(preprocess, observations, repeats=3):
+    """
+    Returns the best of repeats runs of the mean seconds per frame of preprocess over observations.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for observation in observations:
+            preprocess(observation)
+        best = min(best, (time.perf_counter() - start) / len(observations))
+    return best
+
+
+def benchmark_preprocess(env_name='SuperMarioBros-1-1-v0', frames=500):
+    """
+    Times every preprocessing chain on the same recorded frames.
+
+    :param env_name: The env to record frames from
+    :param frames: Number of frames
+    :return: Dict of microseconds per frame for each chain, and the largest difference between the uint8 outputs of
+    the old and fused chains
+    """
+    env, observations = record_frames(env_name, frames)
+    gray = GrayScaleObservation(env, keep_dim=False)
+    resize = ResizeObservation(gray, shape=84)
+    fused = PreprocessObservation(env, shape=84)
+    fused_normalized = PreprocessObservation(env, shape=84, normalize=True)
+
+    chains = {
+        'skimage_float64': lambda observation: resize.observation(gray.observation(observation)) / 255.,
+        'skimage_uint8': lambda observation: resize.observation(gray.observation(observation)),
+        'cv2_uint8': fused.observation,
+        'cv2_float32': fused_normalized.observation,
+    }
+    results = {
+        f'{name}_us_per_frame': time_per_frame(chain, observations) * 1e6 for name, chain in chains.items()
+    }
+    differences = [
+        np.abs(chains['skimage_uint8'](observation).astype(int) - fused.observation(observation))
+        for observation in observations
+    ]
+    results['max_abs_difference'] = int(max(difference.max() for difference in differences))
+    results['mean_abs_difference'] = float(np.mean([difference.mean() for difference in differences]))
+    env.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DQN frame preprocessing.")
+    parser.add_argument("--env", default="SuperMarioBros-1-1-v0")
+    parser.add_argument("--frames", default=500, type=int)
+    args = parser.parse_args()
+
+    results = benchmark_preprocess(args.env, args.frames)
+    for name in ['skimage_float64', 'skimage_uint8', 'cv2_uint8', 'cv2_float32']:
+        print(f"{name:>16}: {results[f'{name}_us_per_frame']:8.1f} us/frame")
+    print(f"Speedup over skimage float64: "
+          f"{results['skimage_float64_us_per_frame'] / results['cv2_uint8_us_per_frame']:.1f}x")
+    print(f"uint8 difference to skimage: max {results['max_abs_difference']}, mean {results['mean_abs_difference']:.2f}")
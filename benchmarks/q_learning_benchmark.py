@@ -0,0 +1,214 @@
+"""
+Benchmark of the tabular and approximate Q-learning agents. Transitions are recorded from the envs of
+q_learning_features.py (states are tuples of the info values) and q_learning_approx.py (states are the info dicts)
+with random actions, then replayed through get_action and update the way the scripts call them, with the original
+agents (O(actions^2) action selection, and for the approximate agent one dict of weights for all actions) and with
+the current ones. Exploration is off so every step takes the greedy path. The steps/s of each script's full loop, env
+included, are reported as well.
+
+Run from the repository root:
+    python -m benchmarks.q_learning_benchmark --steps 2000
+"""
+import argparse
+import random
+import time
+
+import gym_super_mario_bros
+from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+from nes_py.wrappers import JoypadSpace
+
+from agents.approximate_q_learning_agent import ApproxQLearningMarioAgent
+from agents.q_learning_agent import QLearningMarioAgent
+
+
+class _OriginalQLearningMarioAgent(QLearningMarioAgent):
+    """QLearningMarioAgent with its action selection and update from before the row cache"""
+
+    def compute_value_from_q_value(self, state):
+        return max(self.get_q_value(state, action) for action in range(self.actions))
+
+    def compute_action_from_q_value(self, state):
+        potential_actions = []
+        for action in range(self.actions):
+            if self.get_q_value(state, action) == self.compute_value_from_q_value(state):
+                potential_actions.append(action)
+        if not potential_actions:
+            return None
+        else:
+            return random.choice(potential_actions)
+
+    def update(self, state, action, next_state, reward):
+        sample = reward + (self.discount * self.compute_value_from_q_value(next_state))
+        self.q_table.set(
+            state,
+            action,
+            ((1 - self.learning_rate) * self.get_q_value(state, action)) + (self.learning_rate * sample),
+        )
+
+
+class _OriginalApproxQLearningMarioAgent(QLearningMarioAgent):
+    """ApproxQLearningMarioAgent from before the row cache and the weight matrix: one dict of weights for all actions"""
+
+    compute_value_from_q_value = _OriginalQLearningMarioAgent.compute_value_from_q_value
+    compute_action_from_q_value = _OriginalQLearningMarioAgent.compute_action_from_q_value
+
+    def __init__(self, actions, exploration_rate=0.8, learning_rate=0.6, discount=0.9, decay=0.99):
+        super().__init__(
+            actions, exploration_rate=exploration_rate, learning_rate=learning_rate, discount=discount, decay=decay
+        )
+        self.status_map = {"small": 1, "tall": 2, "fireball": 3}
+        self.weights = {"status": 0.0, "time": 0.0, "x_pos": 0.0, "y_pos": 0.0}
+
+    def get_q_value(self, state, action):
+        q_value = 0
+        for key in self.weights.keys():
+            if key == "status":
+                value = self.status_map[state[key]]
+            else:
+                value = state[key]
+            q_value += self.weights[key] * value
+        return q_value
+
+    def update(self, state, action, next_state, reward):
+        difference = (
+            reward
+            + self.discount * self.compute_value_from_q_value(next_state)
+            - self.get_q_value(state, action)
+        )
+        for feature in self.weights.keys():
+            if feature == "status":
+                value = self.status_map[state[feature]]
+            else:
+                value = state[feature]
+            self.weights[feature] += self.learning_rate * difference * value
+
+
+def _make_env(env_name):
+    return JoypadSpace(gym_super_mario_bros.make(env_name), SIMPLE_MOVEMENT)
+
+
+def _features_state(info):
+    return tuple(info.values())
+
+
+def _approx_state(info):
+    return info
+
+
+# script -> (env, state made from the step's info, initial state, original agent, current agent)
+SCRIPTS = {
+    "q_learning_features": (
+        "SuperMarioBros-v0",
+        _features_state,
+        (0, False, 3, 0, 1, "small", 400, 1, 40, 79),
+        _OriginalQLearningMarioAgent,
+        QLearningMarioAgent,
+    ),
+    "q_learning_approx": (
+        "SuperMarioBros-v3",
+        _approx_state,
+        {"coins": 0, "flag_get": False, "life": 3, "score": 0, "stage": 1, "status": "small", "time": 400,
+         "world": 1, "x_pos": 40, "y_pos": 79},
+        _OriginalApproxQLearningMarioAgent,
+        ApproxQLearningMarioAgent,
+    ),
+}
+
+
+def record_transitions(env_name, make_state, initial_state, steps, seed=0):
+    """
+    Plays random actions and returns the transitions seen.
+
+    :param env_name: The env to play
+    :param make_state: Function making the agent's state from a step's info
+    :param initial_state: The state the script starts every game in
+    :param steps: Number of transitions to record
+    :param seed: Seed for the random actions
+    :return: List of (state, action, next state, reward)
+    """
+    rng = random.Random(seed)
+    env = _make_env(env_name)
+    env.reset()
+    state = initial_state
+    transitions = []
+    while len(transitions) < steps:
+        action = rng.randrange(len(SIMPLE_MOVEMENT))
+        _, reward, done, info = env.step(action)
+        next_state = make_state(info)
+        transitions.append((state, action, next_state, reward))
+        state = next_state
+        if done:
+            env.reset()
+            state = initial_state
+    env.close()
+    return transitions
+
+
+def time_agent(agent_class, transitions, repeats=3):
+    """
+    Returns the best of repeats runs of the steps/s of get_action and update over the recorded transitions, each
+    run with a fresh agent.
+    """
+    best = 0.0
+    for _ in range(repeats):
+        agent = agent_class(len(SIMPLE_MOVEMENT), exploration_rate=0.0)
+        start = time.perf_counter()
+        for state, action, next_state, reward in transitions:
+            agent.get_action(state)
+            agent.update(state, action, next_state, reward)
+        best = max(best, len(transitions) / (time.perf_counter() - start))
+    return best
+
+
+def time_script_loop(env_name, make_state, initial_state, agent_class, steps):
+    """
+    Returns the steps/s of a script's training loop, env included, over steps steps.
+    """
+    env = _make_env(env_name)
+    env.reset()
+    agent = agent_class(len(SIMPLE_MOVEMENT))
+    state = initial_state
+    start = time.perf_counter()
+    for _ in range(steps):
+        action = agent.get_action(state)
+        _, reward, done, info = env.step(action)
+        next_state = make_state(info)
+        agent.update(state, action, next_state, reward)
+        state = next_state
+        if done:
+            env.reset()
+            state = initial_state
+    elapsed = time.perf_counter() - start
+    env.close()
+    return steps / elapsed
+
+
+def benchmark_q_learning(steps=2000):
+    """
+    Times both Q-learning scripts' agents, with the original and the current action selection.
+
+    :param steps: Number of transitions to record and replay per script
+    :return: Dict of script -> dict of original agent steps/s, current agent steps/s and full loop steps/s
+    """
+    results = {}
+    for script, (env_name, make_state, initial_state, original, current) in SCRIPTS.items():
+        transitions = record_transitions(env_name, make_state, initial_state, steps)
+        results[script] = {
+            "original_agent": time_agent(original, transitions),
+            "current_agent": time_agent(current, transitions),
+            "loop": time_script_loop(env_name, make_state, initial_state, current, steps),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Q-learning agents' action selection.")
+    parser.add_argument("--steps", default=2000, type=int)
+    args = parser.parse_args()
+
+    for script, result in benchmark_q_learning(args.steps).items():
+        print(
+            f"{script}: agent {result['original_agent']:.0f} -> {result['current_agent']:.0f} steps/s "
+            f"({result['current_agent'] / result['original_agent']:.2f}x), "
+            f"full loop with env {result['loop']:.0f} steps/s"
+        )
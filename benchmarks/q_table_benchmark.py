@@ -0,0 +1,123 @@
+"""
+Benchmark of the Q-table backends on the pixel states of q_learning_pixels.py. Frames are recorded from the env with
+random actions, then replayed through get_action and update the way the script calls them: originally with
+numpy.array2string keys in a dict (three conversions per step), now with each frame copied and interned by a
+DenseQTable. Reports steps/s, the number of distinct states each one found and the memory each stored state costs.
+
+numpy.array2string summarizes arrays of more than 1000 elements with "...", so the original keys only hold the corners
+of each frame and most distinct frames collapse into a few states.
+
+Run from the repository root:
+    python -m benchmarks.q_table_benchmark --steps 300
+"""
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+
+from agents.q_learning_agent import QLearningMarioAgent
+from agents.q_table import DenseQTable
+from benchmarks.q_learning_benchmark import _make_env
+
+
+def record_frames(steps, seed=0):
+    """
+    Plays random actions and returns copies of the frames seen.
+
+    :param steps: Number of transitions to record
+    :param seed: Seed for the random actions
+    :return: List of (frame, action, next frame, reward)
+    """
+    rng = random.Random(seed)
+    env = _make_env("SuperMarioBros-v3")
+    state = env.reset().copy()
+    transitions = []
+    while len(transitions) < steps:
+        action = rng.randrange(len(SIMPLE_MOVEMENT))
+        next_state, reward, done, info = env.step(action)
+        next_state = next_state.copy()
+        transitions.append((state, action, next_state, reward))
+        state = env.reset().copy() if done else next_state
+    env.close()
+    return transitions
+
+
+def time_array2string_dict(transitions):
+    """
+    Returns the steps/s of the original script's agent calls, and the agent.
+    """
+    agent = QLearningMarioAgent(len(SIMPLE_MOVEMENT), exploration_rate=0.0)
+    start = time.perf_counter()
+    for state, action, next_state, reward in transitions:
+        agent.get_action(np.array2string(state))
+        agent.update(np.array2string(state), action, np.array2string(next_state), reward)
+    return len(transitions) / (time.perf_counter() - start), agent
+
+
+def time_dense(transitions):
+    """
+    Returns the steps/s of the current script's agent calls, frame copies included, and the agent.
+    """
+    table = DenseQTable(len(SIMPLE_MOVEMENT))
+    agent = QLearningMarioAgent(len(SIMPLE_MOVEMENT), q_values=table, exploration_rate=0.0)
+    start = time.perf_counter()
+    next_copy = transitions[0][0].copy()
+    for state, action, next_state, reward in transitions:
+        state_copy = next_copy
+        agent.get_action(state_copy)
+        next_copy = next_state.copy()
+        agent.update(state_copy, action, next_copy, reward)
+    return len(transitions) / (time.perf_counter() - start), agent
+
+
+def dict_bytes_per_state(q_values):
+    """
+    Approximate memory per state of a dict q-table: its keys' strings and tuples plus its hash table slots.
+    """
+    states = {state for state, _ in q_values}
+    key_bytes = sum(sys.getsizeof(state) for state in states) + len(q_values) * sys.getsizeof((None, 0))
+    return (key_bytes + sys.getsizeof(q_values)) / max(1, len(states))
+
+
+def dense_bytes_per_state(table):
+    """
+    Approximate memory per state of a DenseQTable: its row of values, digest key and id map slots.
+    """
+    key_bytes = sum(sys.getsizeof(key) for key in table.state_ids)
+    return (len(table) * table.values.itemsize * table.actions + key_bytes + sys.getsizeof(table.state_ids)) / max(
+        1, len(table)
+    )
+
+
+def benchmark_q_table(steps=300):
+    """
+    Times the original and dense q-tables on recorded frames.
+
+    :param steps: Number of transitions to record and replay
+    :return: Dict of backend -> (steps/s, distinct states, bytes per state)
+    """
+    transitions = record_frames(steps)
+    dict_rate, dict_agent = time_array2string_dict(transitions)
+    dense_rate, dense_agent = time_dense(transitions)
+    q_values = dict_agent.get_q_values()
+    table = dense_agent.get_q_values()
+    return {
+        "array2string_dict": (
+            dict_rate,
+            len({state for state, _ in q_values}),
+            dict_bytes_per_state(q_values),
+        ),
+        "dense": (dense_rate, len(table), dense_bytes_per_state(table)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Q-table backends on pixel states.")
+    parser.add_argument("--steps", default=300, type=int)
+    args = parser.parse_args()
+
+    for backend, (rate, states, state_bytes) in benchmark_q_table(args.steps).items():
+        print(f"{backend:>17}: {rate:8.1f} steps/s, {states} distinct states, {state_bytes:.0f} bytes per state")
@@ -0,0 +1,312 @@
+"""
+Reproducible throughput suite for every agent. Each benchmark runs in a fresh process with fixed seeds and a fixed
+budget of work, and reports its metrics along with the peak RSS of that process:
+
+    emulator          emulator steps/s, and steps/s of the DQN env (4 frames each, preprocessed and stacked)
+    dqn               act latency on recorded states, learner updates/s on a filled replay buffer
+    q_learning        decision latency and updates/s of the features, approx and pixels agents on recorded transitions
+    genetic_sequence  individuals/s of GA sequence rollouts, and the time to breed a generation
+    genetic_policy    individuals/s of GA policy rollouts, and the time to breed a generation
+
+Results are written to a JSON file together with the commit, machine and library versions. With --compare, every
+metric is compared to an earlier results file, and the run fails if one got worse by more than --tolerance.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --output before.json
+    python -m benchmarks.run_benchmarks --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from util.seeding import seed_everything
+
+# budgets of the default run; --scale multiplies them
+BUDGETS = {
+    'emulator': {'steps': 2000},
+    'dqn': {'states': 200, 'transitions': 2000, 'updates': 50},
+    'q_learning': {'steps': 2000, 'frames': 300},
+    'genetic_sequence': {'individuals': 8, 'sequence_length': 1000, 'population': 100},
+    'genetic_policy': {'individuals': 2, 'population': 20},
+}
+
+
+def _per_s(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+def _median_us(function, inputs):
+    """
+    Calls function on each input and returns the median microseconds per call.
+    """
+    times = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def bench_emulator(steps):
+    import gym_super_mario_bros
+    from nes_py.wrappers import JoypadSpace
+    from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+
+    from util.wrappers import make_mario_env
+
+    results = {}
+    for name, env in [
+        ('emulator', JoypadSpace(gym_super_mario_bros.make('SuperMarioBros-1-1-v0'), SIMPLE_MOVEMENT)),
+        ('dqn_env', make_mario_env()),
+    ]:
+        actions = np.random.default_rng(0).integers(env.action_space.n, size=steps)
+        env.reset()
+        start = time.perf_counter()
+        for action in actions:
+            _, _, done, _ = env.step(int(action))
+            if done:
+                env.reset()
+        results[f'{name}_steps_per_s'] = _per_s(steps, time.perf_counter() - start)
+        env.close()
+    return results
+
+
+def bench_dqn(states, transitions, updates):
+    from agents.deep_q_learning_agent import DeepQLearningMario
+    from benchmarks.inference_benchmark import record_states
+    from benchmarks.learner_benchmark import fill_memory
+
+    mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=2, save_dir=Path(tempfile.mkdtemp()),
+                               replay_capacity=transitions)
+    mario.exploration_rate = 0.0
+    mario.exploration_rate_min = 0.0
+    recorded = (record_states(states) * 255).to(torch.uint8).numpy()
+    mario.act(recorded[0])  # warm up
+    act_us = _median_us(mario.act, recorded)
+
+    fill_memory(mario, transitions)
+    mario.learn_batch()  # warm up
+    start = time.perf_counter()
+    for _ in range(updates):
+        mario.learn_batch()
+    return {
+        'act_latency_us': act_us,
+        'learner_updates_per_s': _per_s(updates, time.perf_counter() - start),
+        'batch_size': mario.batch_size,
+    }
+
+
+def bench_q_learning(steps, frames):
+    from agents.q_learning_agent import QLearningMarioAgent
+    from agents.q_table import DenseQTable
+    from benchmarks.q_learning_benchmark import SCRIPTS, record_transitions
+    from benchmarks.q_table_benchmark import record_frames
+    from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+    from util.state_encoding import FrameEncoder
+
+    results = {}
+    for script, (env_name, make_state, initial_state, _, agent_class) in SCRIPTS.items():
+        transitions = record_transitions(env_name, make_state, initial_state, steps)
+        agent = agent_class(len(SIMPLE_MOVEMENT), exploration_rate=0.0)
+        start = time.perf_counter()
+        for state, action, next_state, reward in transitions:
+            agent.update(state, action, next_state, reward)
+        results[f'{script}_updates_per_s'] = _per_s(len(transitions), time.perf_counter() - start)
+        results[f'{script}_decision_us'] = _median_us(agent.get_action, [t[0] for t in transitions])
+
+    # the pixel agent's decision includes encoding the frame, as the script does once per step
+    encoder = FrameEncoder()
+    transitions = [(encoder.encode(s), a, encoder.encode(n), r) for s, a, n, r in record_frames(frames)]
+    agent = QLearningMarioAgent(len(SIMPLE_MOVEMENT), q_values=DenseQTable(len(SIMPLE_MOVEMENT)), exploration_rate=0.0)
+    start = time.perf_counter()
+    for state, action, next_state, reward in transitions:
+        agent.update(state, action, next_state, reward)
+    results['q_learning_pixels_updates_per_s'] = _per_s(len(transitions), time.perf_counter() - start)
+    observations = [t[0] for t in record_frames(frames, seed=1)]
+    results['q_learning_pixels_decision_us'] = _median_us(lambda o: agent.get_action(encoder.encode(o)), observations)
+    return results
+
+
+def bench_genetic_sequence(individuals, sequence_length, population):
+    from agents import genetic_sequence_agent
+    from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+    from util.env_pool import close_envs, get_env
+
+    env_name = 'SuperMarioBros-1-1-v3'
+    get_env(env_name)  # the env is built once per worker in the script, so it isn't timed
+    sequences = genetic_sequence_agent.get_initial_sequences(sequence_length, individuals, len(SIMPLE_MOVEMENT))
+    steps = 0
+    start = time.perf_counter()
+    for sequence in sequences:
+        max_reached, _ = genetic_sequence_agent.run_sequence(sequence, env_name, True)
+        steps += max_reached + 1
+    seconds = time.perf_counter() - start
+    close_envs()
+
+    # one generation of the script: the best tenth breeds a population of children
+    parents = genetic_sequence_agent.get_initial_sequences(sequence_length, max(2, population // 10),
+                                                           len(SIMPLE_MOVEMENT))
+    start = time.perf_counter()
+    children = genetic_sequence_agent.crossover(sequence_length, 1, parents, population)
+    genetic_sequence_agent.mutate(children, sequence_length, 0.4)
+    return {
+        'individuals_per_s': _per_s(individuals, seconds),
+        'steps_per_s': _per_s(steps, seconds),
+        'breeding_ms': (time.perf_counter() - start) * 1e3,
+    }
+
+
+def bench_genetic_policy(individuals, population, max_x=5000, max_y=255):
+    from agents import genetic_policy_agent
+    from util.env_pool import close_envs, get_env
+
+    get_env('SuperMarioBros-1-1-v3')
+    policies = genetic_policy_agent.get_starting_generation(individuals, max_x, max_y)
+    start = time.perf_counter()
+    for number, policy in enumerate(policies):
+        genetic_policy_agent.run_policy(policy, 0, number, 1, 1)
+    seconds = time.perf_counter() - start
+    close_envs()
+
+    parents = genetic_policy_agent.get_starting_generation(max(2, population // 10), max_x, max_y)
+    start = time.perf_counter()
+    children = genetic_policy_agent.do_crossover(parents, population, max_x, max_y)
+    genetic_policy_agent.mutate(children, 0.4, max_x, max_y)
+    return {
+        'individuals_per_s': _per_s(individuals, seconds),
+        'breeding_ms': (time.perf_counter() - start) * 1e3,
+    }
+
+
+BENCHMARKS = {
+    'emulator': bench_emulator,
+    'dqn': bench_dqn,
+    'q_learning': bench_q_learning,
+    'genetic_sequence': bench_genetic_sequence,
+    'genetic_policy': bench_genetic_policy,
+}
+
+
+def _run_one(name, budget, seed):
+    """
+    Runs one benchmark in this (fresh) process and adds its wall time and peak RSS to its metrics.
+    """
+    seed_everything(seed)
+    start = time.perf_counter()
+    metrics = BENCHMARKS[name](**budget)
+    metrics['wall_seconds'] = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics['peak_rss_mb'] = max_rss / (2**20 if sys.platform == 'darwin' else 2**10)
+    return metrics
+
+
+def run_benchmarks(names=None, scale=1.0, seed=0):
+    """
+    Runs benchmarks, each in a new process so their peak RSS and warm caches don't carry over.
+
+    :param names: Benchmarks to run (None for all of BENCHMARKS)
+    :param scale: Factor applied to every budget
+    :param seed: Seed of python, numpy and torch in every benchmark
+    :return: Dict of benchmark -> dict of metric -> value
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names or BENCHMARKS:
+        budget = {key: max(1, int(value * scale)) for key, value in BUDGETS[name].items()}
+        print(f"Running {name} {budget}", flush=True)
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(_run_one, (name, budget, seed))
+        results[name]['budget'] = budget
+    return results
+
+
+def environment():
+    """
+    The commit, machine and library versions results were measured with.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import gym
+    import nes_py
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': multiprocessing.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'cuda': torch.cuda.is_available(),
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'gym': gym.__version__,
+        'nes_py': getattr(nes_py, '__version__', None),
+    }
+
+
+def _lower_is_better(metric):
+    return metric.endswith(('_us', '_ms', '_mb', '_seconds'))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every metric found in both results, and returns the ones that got worse by more than
+    tolerance (a fraction).
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old or metric in (
+                    'wall_seconds', 'batch_size'):
+                continue
+            change = value / old - 1
+            worse = change > tolerance if _lower_is_better(metric) else change < -tolerance
+            print(f"{name + '.' + metric:>45}: {old:12.2f} -> {value:12.2f} ({change:+7.1%}){'  WORSE' if worse else ''}")
+            if worse:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every agent and write the results to JSON.")
+    parser.add_argument("--output", default="benchmarks.json", type=Path)
+    parser.add_argument("--only", default=None, nargs='+', choices=list(BENCHMARKS))
+    parser.add_argument("--scale", default=1.0, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--compare", default=None, type=Path)
+    parser.add_argument("--tolerance", default=0.1, type=float)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only, args.scale, args.seed)
+    with open(args.output, "w") as f:
+        json.dump({'environment': environment(), 'seed': args.seed, 'scale': args.scale, 'results': results}, f,
+                  indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['scale'] != args.scale or baseline['environment']['cpus'] != multiprocessing.cpu_count():
+            print("The baseline was measured with a different scale or number of CPUs")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"Worse by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,85 @@
+"""
+Benchmark of the state keys of q_learning_pixels.py. Frames are recorded from the env with random actions, then the
+time to turn one frame into a key is reported for the original numpy.array2string key, a blake2b digest of the full
+frame (DenseQTable's key for array states) and FrameEncoder with each available hash.
+
+The collision report counts distinct raw frames, distinct array2string keys, and for FrameEncoder distinct quantized
+frames and distinct 64-bit keys. Fewer quantized frames than raw frames is the intended merging of near-identical
+frames; fewer keys than quantized frames would be hash collisions. array2string summarizes large arrays with "...", so
+its keys merge frames that differ anywhere but the corners.
+
+Run from the repository root:
+    python -m benchmarks.state_encoding_benchmark --frames 1000
+"""
+import argparse
+import hashlib
+import time
+
+import numpy as np
+
+from agents.q_table import DenseQTable
+from benchmarks.preprocess_benchmark import record_frames
+from util.state_encoding import FrameEncoder, xxhash
+
+
+def time_per_frame(encode, observations, repeats=3):
+    """
+    Returns the best of repeats runs of the mean seconds per frame of encode over observations.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for observation in observations:
+            encode(observation)
+        best = min(best, (time.perf_counter() - start) / len(observations))
+    return best
+
+
+def benchmark_state_encoding(frames=1000, shape=(60, 64), levels=8):
+    """
+    Times every way of keying a frame and counts the distinct keys each gives.
+
+    :param frames: Number of frames to record
+    :param shape: (height, width) FrameEncoder downsamples to
+    :param levels: Gray levels FrameEncoder keeps
+    :return: Dict of key name -> (microseconds per frame, distinct keys), and the number of distinct raw frames
+    """
+    env, observations = record_frames('SuperMarioBros-v3', frames)
+    env.close()
+    table = DenseQTable(1)
+
+    raw_frames = len({hashlib.blake2b(np.ascontiguousarray(o), digest_size=16).digest() for o in observations})
+    results = {
+        'array2string': (time_per_frame(np.array2string, observations), len({np.array2string(o) for o in observations})),
+        'blake2b_full_frame': (time_per_frame(table.state_key, observations),
+                               len({table.state_key(o) for o in observations})),
+    }
+    hash_names = ['xxh3', 'blake2b'] if xxhash is not None else ['blake2b']
+    for hash_name in hash_names:
+        encoder = FrameEncoder(shape, levels, hash_name)
+        quantized = [encoder.quantize(o) for o in observations]
+        if hash_name == hash_names[0]:
+            results['quantize_only'] = (time_per_frame(encoder.quantize, observations),
+                                        len({q.tobytes() for q in quantized}))
+        results[f'frame_encoder_{hash_name}'] = (time_per_frame(encoder.encode, observations),
+                                                 len({encoder.key(q) for q in quantized}))
+    return {name: (seconds * 1e6, keys) for name, (seconds, keys) in results.items()}, raw_frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pixel Q-learner's state keys.")
+    parser.add_argument("--frames", default=1000, type=int)
+    parser.add_argument("--height", default=60, type=int)
+    parser.add_argument("--width", default=64, type=int)
+    parser.add_argument("--levels", default=8, type=int)
+    args = parser.parse_args()
+
+    results, raw_frames = benchmark_state_encoding(args.frames, (args.height, args.width), args.levels)
+    baseline = results['array2string'][0]
+    print(f"{args.frames} frames, {raw_frames} distinct")
+    for name, (latency, keys) in results.items():
+        print(f"{name:>22}: {latency:8.1f} us/frame ({baseline / latency:6.1f}x), {keys} distinct keys")
+    quantized = results['quantize_only'][1]
+    encoded = min(keys for name, (_, keys) in results.items() if name.startswith('frame_encoder'))
+    print(f"Hash collisions: {quantized - encoded} of {quantized} quantized frames "
+          f"(expected for 64-bit keys: {quantized ** 2 / 2 ** 65:.1e})")
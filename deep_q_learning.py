@@ -1,82 +1,188 @@
+import argparse
+import functools
 import torch
 from pathlib import Path
 import random, datetime, numpy as np, cv2
-from gym.wrappers import FrameStack, GrayScaleObservation, TransformObservation
+import gym
 from agents.deep_q_learning_agent import DeepQLearningMario
 
-#NES Emulator for OpenAI Gym
-from nes_py.wrappers import JoypadSpace
-
-# Super Mario environment for OpenAI Gym
-import gym_super_mario_bros
-
 # Initialize Super Mario environment
 from util.deep_q_logging import MetricLogger
-from util.wrappers import SkipFrame, ResizeObservation
-
-env = gym_super_mario_bros.make('SuperMarioBros-1-1-v0')
-
-# Limit the action-space to
-#   0. walk right
-#   1. jump right
-env = JoypadSpace(
-    env,
-    [['right'],
-    ['right', 'A']]
-)
-env = SkipFrame(env, skip=4)
-env = GrayScaleObservation(env, keep_dim=False)
-env = ResizeObservation(env, shape=84)
-env = TransformObservation(env, f=lambda x: x / 255.)
-env = FrameStack(env, num_stack=4)
-
-use_cuda = torch.cuda.is_available()
-print(f"Using CUDA: {use_cuda}")
-print()
-
-save_dir = Path('./data/checkpoints')
-
-mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=env.action_space.n, save_dir=save_dir)
-
-logger = MetricLogger(save_dir)
-
-episodes = 40000
-
-### for Loop that train the model num_episodes times by playing the game
-for e in range(episodes):
-
-    state = env.reset()
-
-    # Play the game!
-    while True:
-
-        # Run agent on the state
-        action = mario.act(state)
-
-        # Agent performs action
-        next_state, reward, done, info = env.step(action)
-
-        # Remember
-        mario.cache(state, next_state, action, reward, done)
-
-        # Learn
-        q, loss = mario.learn()
-
-        # Logging
-        logger.log_step(reward, loss, q)
-
-        # Update state
-        state = next_state
-
-        # Check if end of game
-        if done or info['flag_get']:
-            break
-
-    logger.log_episode()
-
-    if e % 20 == 0:
-        logger.record(
-            episode=e,
-            epsilon=mario.exploration_rate,
-            step=mario.curr_step
-        )
\ No newline at end of file
+from util.profiling import PhaseTimer, TraceWindow
+from util.run_mode import add_run_mode_arguments, run_mode_from_args
+from util.seeding import seed_env, seed_everything
+from util.wrappers import make_mario_env
+
+
+def train(env, mario, logger, episodes, trace=None):
+    ### for Loop that train the model num_episodes times by playing the game
+    timer = mario.timer
+    for e in range(episodes):
+
+        state = env.reset()
+
+        # Play the game!
+        while True:
+
+            if trace is not None:
+                trace.step(mario.curr_step)
+
+            # Run agent on the state
+            with timer.phase('act'):
+                action = mario.act(state)
+
+            # Agent performs action (the env phase is the wrappers' time, the emulator's is its own phase)
+            with timer.phase('env'):
+                next_state, reward, done, info = env.step(action)
+
+            # Remember
+            with timer.phase('cache'):
+                mario.cache(state, next_state, action, reward, done)
+
+            # Learn
+            with timer.phase('learn'):
+                q, loss = mario.learn()
+
+            # Logging
+            logger.log_step(reward, loss, q)
+
+            # Update state
+            state = next_state
+
+            # Check if end of game
+            if done or info['flag_get']:
+                break
+
+        logger.log_episode()
+
+        if e % 20 == 0:
+            logger.record(
+                episode=e,
+                epsilon=mario.exploration_rate,
+                step=mario.curr_step
+            )
+
+
+def final_observation(infos, i):
+    """
+    Returns the last observation of env i's finished episode from the infos of a vector env step. Up to gym 0.23 the
+    infos are a tuple of dicts with 'terminal_observation'; later versions rename it 'final_observation' and, from
+    0.25 on, give one dict of arrays instead. Older versions of gym don't keep it at all.
+    """
+    if isinstance(infos, dict):
+        if "final_observation" in infos:
+            return infos["final_observation"][i]
+    else:
+        for key in ("terminal_observation", "final_observation"):
+            if key in infos[i]:
+                return infos[i][key]
+    keys = list(infos if isinstance(infos, dict) else infos[i])
+    raise KeyError("The vector env's infos have no final observation of a finished episode, use a gym version that "
+                   f"keeps it or --num-envs 1, got info keys: {keys}")
+
+
+def train_vectorized(envs, mario, logger, episodes, trace=None):
+    """
+    Same as train, with one step of every env of a vector env per loop: actions for all of them come from one forward
+    pass and their transitions are cached together. The vector env resets an env as soon as its episode is done.
+    The envs step in their own processes, so their env phase includes the emulator.
+    """
+    timer = mario.timer
+    states = envs.reset()
+    e = 0
+    while e < episodes:
+        if trace is not None:
+            trace.step(mario.curr_step)
+
+        with timer.phase('act'):
+            actions = mario.act_batch(states)
+        with timer.phase('env'):
+            next_states, rewards, dones, infos = envs.step(actions)
+
+        # the observation of a finished env is already the first one of its next episode
+        with timer.phase('cache'):
+            final_states = [final_observation(infos, i) if dones[i] else next_states[i]
+                            for i in range(len(dones))]
+            mario.cache_batch(states, final_states, actions, rewards, dones)
+
+        with timer.phase('learn'):
+            q, loss = mario.learn()
+
+        for _ in range(logger.log_vector_step(rewards, dones, loss, q)):
+            if e % 20 == 0:
+                logger.record(
+                    episode=e,
+                    epsilon=mario.exploration_rate,
+                    step=mario.curr_step
+                )
+            e += 1
+
+        states = next_states
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Double Deep Q-Learning for SMB.")
+    parser.add_argument("--replay-storage", default="frames", choices=["frames", "stacks"])
+    parser.add_argument("--replay-capacity", default=100000, type=int)
+    parser.add_argument("--prioritized", action="store_true")
+    parser.add_argument("--num-envs", default=1, type=int)
+    parser.add_argument("--batch-size", default=32, type=int)
+    parser.add_argument("--updates-per-learn", default=1, type=int)
+    parser.add_argument("--act-precision", default=None, choices=["float32", "bfloat16", "int8"])
+    parser.add_argument("--resume", default=None, type=Path)
+    parser.add_argument("--seed", default=None, type=int)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile-trace", default=None, choices=["cprofile", "torch"])
+    # step the trace starts at, by default the end of burn-in, when learning starts
+    parser.add_argument("--profile-trace-start", default=None, type=int)
+    parser.add_argument("--profile-trace-steps", default=1000, type=int)
+    add_run_mode_arguments(parser)
+    args = parser.parse_args()
+    run_mode = run_mode_from_args(args)
+    timer = PhaseTimer(enabled=args.profile)
+
+    if args.num_envs > 1:
+        # each env runs in its own process; only the first one is rendered or recorded
+        env = gym.vector.AsyncVectorEnv(
+            [functools.partial(make_mario_env, run_mode=run_mode)] + [make_mario_env] * (args.num_envs - 1))
+        action_space = env.single_action_space
+    else:
+        env = make_mario_env(run_mode=run_mode, timer=timer if args.profile else None)
+        action_space = env.action_space
+    if args.seed is not None:
+        seed_everything(args.seed)
+        seed_env(env, args.seed)
+
+    use_cuda = torch.cuda.is_available()
+    print(f"Using CUDA: {use_cuda}")
+    print()
+
+    save_dir = Path('./data/checkpoints')
+
+    mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=action_space.n, save_dir=save_dir,
+                               replay_storage=args.replay_storage, replay_capacity=args.replay_capacity,
+                               prioritized=args.prioritized, num_envs=args.num_envs, batch_size=args.batch_size,
+                               updates_per_learn=args.updates_per_learn, act_precision=args.act_precision)
+
+    if args.resume is not None:
+        mario.load(args.resume)
+        print(f"Resumed from {args.resume} at step {mario.curr_step} with {len(mario.memory)} transitions in replay")
+
+    mario.timer = timer
+    logger = MetricLogger(save_dir, timer=timer if args.profile else None)
+    trace = None
+    if args.profile_trace is not None:
+        trace_start = args.profile_trace_start if args.profile_trace_start is not None else int(mario.burnin)
+        trace = TraceWindow(args.profile_trace, save_dir, trace_start, args.profile_trace_steps)
+
+    episodes = 40000
+
+    if args.num_envs > 1:
+        train_vectorized(env, mario, logger, episodes, trace)
+    else:
+        train(env, mario, logger, episodes, trace)
+    if trace is not None:
+        trace.close()
+    logger.close()
+    mario.wait_for_save()
+    env.close()
@@ -0,0 +1,251 @@
+"""
+Double Deep Q-Learning with acting and learning split across processes. Actor processes each play their own env and
+push their transitions into a replay buffer in shared memory (one stream each), while the main process samples it
+and updates Q_online without waiting on the emulators. Actors pick up the learner's latest Q_online weights from a
+copy of the network in shared memory every few steps.
+
+Everything runs on CPU if there is no GPU: actors use one thread each and the learner gets the rest of the cores.
+"""
+import argparse
+import copy
+import queue
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from agents.conv_neural_network import MarioInferenceNet
+from agents.deep_q_learning_agent import DeepQLearningMario
+from util.deep_q_logging import MetricLogger
+from util.run_mode import add_run_mode_arguments, run_mode_from_args
+from util.seeding import derive_seed, seed_env, seed_everything
+from util.wrappers import make_mario_env
+
+
+def run_actor(rank, memory, shared_online, weights_version, weights_lock, global_steps, stop, finished_episodes,
+              exploration_rate_decay, exploration_rate_min, weights_every, act_precision='float32', run_mode=None,
+              seed=None):
+    """
+    Plays episodes epsilon-greedily with a local MarioInferenceNet copy of Q_online and pushes every transition to its
+    replay stream.
+
+    :param rank: Index of the actor, which is also its stream of memory
+    :param memory: FrameReplayBuffer in shared memory
+    :param shared_online: Q_online in shared memory, published by the learner
+    :param weights_version: Shared counter the learner increments every time it publishes
+    :param weights_lock: Lock held while shared_online is written or copied
+    :param global_steps: Shared count of the env steps of all actors
+    :param stop: Event set when training is over
+    :param finished_episodes: Queue the reward and length of every finished episode are put on
+    :param exploration_rate_decay: Decay of epsilon per env step (of all actors)
+    :param exploration_rate_min: Lowest epsilon
+    :param weights_every: Steps between checks for newly published weights
+    :param act_precision: Precision of the actor's copy of Q_online
+    :param run_mode: Keyword arguments of util.run_mode.wrap_run_mode for the actor's env (None for headless)
+    :param seed: Seed of the run, the actor seeds its RNGs and env with one derived from it and its rank (None for
+        unseeded)
+    """
+    torch.set_num_threads(1)
+    env = make_mario_env(run_mode=run_mode)
+    if seed is not None:
+        seed_env(env, seed_everything(derive_seed(seed, rank)))
+    online = None
+    version = None
+    step = 0
+    while not stop.is_set():
+        state = env.reset()
+        ep_reward, ep_length = 0.0, 0
+        while not stop.is_set():
+            if step % weights_every == 0 and weights_version.value != version:
+                with weights_lock:
+                    version = weights_version.value
+                    online = MarioInferenceNet(shared_online, act_precision)
+
+            # same epsilon schedule as DeepQLearningMario.act, over the steps of all actors
+            exploration_rate = max(exploration_rate_min, exploration_rate_decay ** global_steps.value)
+            if np.random.rand() < exploration_rate:
+                action = np.random.randint(env.action_space.n)
+            else:
+                action_values = online(torch.as_tensor(np.asarray(state)).unsqueeze(0).float().div_(255))
+                action = torch.argmax(action_values, axis=1).item()
+
+            next_state, reward, done, info = env.step(action)
+            memory.push(state, next_state, action, reward, done, rank)
+            with global_steps.get_lock():
+                global_steps.value += 1
+            step += 1
+            ep_reward += reward
+            ep_length += 1
+            state = next_state
+
+            if done or info['flag_get']:
+                finished_episodes.put((ep_reward, ep_length))
+                break
+    env.close()
+
+
+def train_async(save_dir, num_actors, replay_capacity=100000, episodes=40000, seconds=None, burnin=None,
+                publish_every=50, weights_every=100, report_every=60.0, act_precision='float32', run_mode=None,
+                seed=None):
+    """
+    Trains with num_actors actor processes and a learner in this process, until episodes episodes are finished or
+    seconds seconds have passed.
+
+    :param save_dir: Directory for checkpoints and logs
+    :param num_actors: Number of actor processes
+    :param replay_capacity: Number of transitions kept in replay (split evenly between the actors)
+    :param episodes: Number of episodes to train for (None for no limit)
+    :param seconds: Number of seconds to train for (None for no limit)
+    :param burnin: Transitions in replay before learning starts (None for the agent's default)
+    :param publish_every: Updates between publishing Q_online to the actors
+    :param weights_every: Actor steps between checks for newly published weights
+    :param report_every: Seconds between printing env steps/s and updates/s (0 for never)
+    :param act_precision: Precision of the actors' copies of Q_online (see MarioInferenceNet)
+    :param run_mode: Keyword arguments of util.run_mode.wrap_run_mode for the first actor's env (None for headless)
+    :param seed: Seed of the learner's RNGs, and of the actors' through seeds derived from it (None for unseeded)
+    :return: Dict of env steps/s, updates/s and totals
+    """
+    if seed is not None:
+        seed_everything(seed)
+    env = make_mario_env()
+    action_dim = env.action_space.n
+    env.close()
+
+    mario = DeepQLearningMario(state_dim=(4, 84, 84), action_dim=action_dim, save_dir=save_dir,
+                               replay_storage='frames', replay_capacity=replay_capacity, num_envs=num_actors)
+    if burnin is not None:
+        mario.burnin = burnin
+    mario.memory.share_memory()
+    # actors play with a CPU copy of Q_online
+    shared_online = copy.deepcopy(mario.net.online).cpu().share_memory()
+    # the synchronous loop syncs Q_target every sync_every steps, i.e. every sync_every / learn_every updates
+    sync_every_updates = max(1, int(mario.sync_every // mario.learn_every))
+
+    # spawn, so the actors don't inherit the learner's threads or CUDA state
+    ctx = mp.get_context('spawn')
+    weights_version = ctx.Value('q', 0)
+    weights_lock = ctx.Lock()
+    global_steps = ctx.Value('q', 0)
+    stop = ctx.Event()
+    finished_episodes = ctx.Queue()
+    actors = [
+        ctx.Process(target=run_actor, daemon=True,
+                    args=(rank, mario.memory, shared_online, weights_version, weights_lock, global_steps, stop,
+                          finished_episodes, mario.exploration_rate_decay, mario.exploration_rate_min,
+                          weights_every, act_precision, run_mode if rank == 0 else None, seed))
+        for rank in range(num_actors)
+    ]
+    for actor in actors:
+        actor.start()
+    if not mario.use_cuda:
+        torch.set_num_threads(max(1, torch.get_num_threads() - num_actors))
+
+    logger = MetricLogger(save_dir)
+    e = 0
+    updates = 0
+    saves = 0
+    # losses and Q values of the updates since the last finished episode
+    loss_sum, q_sum, loss_length = 0.0, 0.0, 0
+    start = report_time = time.time()
+    learn_start = None
+    report_steps, report_updates = 0, 0
+
+    while (episodes is None or e < episodes) and (seconds is None or time.time() - start < seconds):
+        mario.curr_step = global_steps.value
+        mario.exploration_rate = max(mario.exploration_rate_min, mario.exploration_rate_decay ** mario.curr_step)
+
+        # log the episodes the actors finished
+        while True:
+            try:
+                reward, length = finished_episodes.get_nowait()
+            except queue.Empty:
+                break
+            logger.add_episode(reward, length, loss_sum, q_sum, loss_length)
+            loss_sum, q_sum, loss_length = 0.0, 0.0, 0
+            if e % 20 == 0:
+                logger.record(
+                    episode=e,
+                    epsilon=mario.exploration_rate,
+                    step=mario.curr_step
+                )
+            e += 1
+
+        if mario.curr_step // mario.save_every > saves:
+            saves = int(mario.curr_step // mario.save_every)
+            mario.save()
+
+        if report_every and time.time() - report_time >= report_every:
+            now = time.time()
+            print(f"Env steps/s {(mario.curr_step - report_steps) / (now - report_time):.1f} - "
+                  f"Updates/s {(updates - report_updates) / (now - report_time):.1f}")
+            report_time, report_steps, report_updates = now, mario.curr_step, updates
+
+        if len(mario.memory) < mario.burnin:
+            time.sleep(0.01)
+            continue
+        if learn_start is None:
+            learn_start = time.time()
+
+        q, loss = mario.learn_batch()
+        loss_sum += loss
+        q_sum += q
+        loss_length += 1
+        updates += 1
+
+        if updates % sync_every_updates == 0:
+            mario.sync_Q_target()
+        if updates % publish_every == 0:
+            with weights_lock:
+                shared_online.load_state_dict(mario.net.online.state_dict())
+                weights_version.value += 1
+
+    elapsed = time.time() - start
+    total_steps = global_steps.value
+    stop.set()
+    # actors can't exit while the episodes they put are still in the queue
+    while any(actor.is_alive() for actor in actors):
+        try:
+            finished_episodes.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    for actor in actors:
+        actor.join()
+    logger.close()
+    mario.wait_for_save()
+
+    return {
+        'actors': num_actors,
+        'seconds': elapsed,
+        'env_steps': total_steps,
+        'updates': updates,
+        'episodes': e,
+        'env_steps_per_s': total_steps / elapsed,
+        'updates_per_s': updates / (time.time() - learn_start) if learn_start else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Double Deep Q-Learning for SMB with parallel actors.")
+    parser.add_argument("--num-actors", default=max(1, mp.cpu_count() - 1), type=int)
+    parser.add_argument("--replay-capacity", default=100000, type=int)
+    parser.add_argument("--episodes", default=40000, type=int)
+    parser.add_argument("--publish-every", default=50, type=int)
+    parser.add_argument("--report-every", default=60.0, type=float)
+    parser.add_argument("--act-precision", default="float32", choices=["float32", "bfloat16", "int8"])
+    parser.add_argument("--seed", default=None, type=int)
+    add_run_mode_arguments(parser)
+    args = parser.parse_args()
+
+    use_cuda = torch.cuda.is_available()
+    print(f"Using CUDA: {use_cuda}")
+    print()
+
+    save_dir = Path('./data/checkpoints')
+    save_dir.mkdir(parents=True, exist_ok=True)
+
+    results = train_async(save_dir, args.num_actors, args.replay_capacity, args.episodes,
+                          publish_every=args.publish_every, report_every=args.report_every,
+                          act_precision=args.act_precision, run_mode=run_mode_from_args(args), seed=args.seed)
+    print(f"Env steps/s {results['env_steps_per_s']:.1f} - Updates/s {results['updates_per_s']:.1f}")
@@ -0,0 +1,272 @@
+"""
+Evaluates a trained agent of any kind on a fixed set of stages with a fixed step budget, reproducibly: every episode
+seeds the python, numpy and torch RNGs from --seed, the stage and the episode number, so the same agent gives the same
+results on every run and on any number of workers. Episodes run in parallel in a pool of processes.
+
+Agents are given as a kind and the file a training script wrote:
+    sequence  best sequence of genetic_super_mario.py (data/best_seq_<world>_<stage>.txt)
+    policy    best policy of genetic_policy.py (data/best_seq_ga_policy_<world>_<stage>.txt)
+    features  q-table of q_learning_features.py (data/features_policy)
+    approx    weights of q_learning_approx.py (data/approx_policy)
+    dqn       checkpoint of deep_q_learning.py (data/checkpoints/mario_net_<n>.chkpt) or a net exported from one
+
+Q-learning and DQN agents act greedily. An episode ends when Mario dies for good, reaches the flag, runs out of
+actions (sequences) or uses up --steps agent steps.
+
+Run:
+    python evaluate.py sequence data/best_seq_1_1.txt --stages 1-1 1-2 --episodes 3 --output eval.json
+"""
+import argparse
+import ast
+import json
+import multiprocessing
+import time
+
+import numpy as np
+import torch
+from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+
+from agents.approximate_q_learning_agent import ApproxQLearningMarioAgent
+from agents.q_learning_agent import QLearningMarioAgent
+from util.env_pool import get_env
+from util.file_utils import read_seq_file
+from util.seeding import derive_seed, seed_env, seed_everything
+from util.wrappers import make_mario_env
+
+AGENT_KINDS = ('sequence', 'policy', 'features', 'approx', 'dqn')
+# info the Q-learning scripts start every game in, before the first step returns one
+_INITIAL_INFO = {"coins": 0, "flag_get": False, "life": 3, "score": 0, "stage": 1, "status": "small", "time": 400,
+                 "world": 1, "x_pos": 40, "y_pos": 79}
+
+
+def _read_after_generation(path):
+    "Reads a file written by util.file_utils: the generation on the first line, the individual after it"
+    with open(path) as f:
+        f.readline()
+        return f.read()
+
+
+def _read_literal(path):
+    "Reads a file written by the Q-learning scripts, an f followed by a python literal"
+    with open(path) as f:
+        return ast.literal_eval(f.read().strip()[1:])
+
+
+class SequenceAgent:
+    def __init__(self, path):
+        _, self.sequence = read_seq_file(path)
+
+    def reset(self, info):
+        self.step = 0
+
+    def act(self, observation, info):
+        if self.step >= len(self.sequence):
+            return None
+        self.step += 1
+        return self.sequence[self.step - 1]
+
+
+class PolicyAgent:
+    def __init__(self, path):
+        self.policy = np.array(json.loads(_read_after_generation(path)), dtype=np.uint8)
+
+    def reset(self, info):
+        pass
+
+    def act(self, observation, info):
+        # same as genetic_policy_agent.run_policy, a random action outside of the area the policy covers
+        x, y = info["x_pos"], info["y_pos"]
+        if x < self.policy.shape[0] and 0 <= y < self.policy.shape[1]:
+            return int(self.policy[x, y])
+        return np.random.randint(len(SIMPLE_MOVEMENT))
+
+
+class FeaturesAgent:
+    def __init__(self, path):
+        self.agent = QLearningMarioAgent(len(SIMPLE_MOVEMENT), q_values=_read_literal(path), exploration_rate=0.0)
+
+    def reset(self, info):
+        pass
+
+    def act(self, observation, info):
+        return self.agent.get_action(tuple(info.values()))
+
+
+class ApproxAgent:
+    def __init__(self, path):
+        self.agent = ApproxQLearningMarioAgent(len(SIMPLE_MOVEMENT), weights=_read_literal(path), exploration_rate=0.0)
+
+    def reset(self, info):
+        pass
+
+    def act(self, observation, info):
+        return self.agent.get_action(info)
+
+
+class DQNAgent:
+    def __init__(self, path):
+        torch.set_num_threads(1)
+        if str(path).endswith(".chkpt"):
+            from export_mario_net import GreedyMarioNet
+            from agents.conv_neural_network import MarioNet
+
+            state_dict = torch.load(path, map_location="cpu")["model"]
+            net = MarioNet((4, 84, 84), state_dict["online.9.weight"].shape[0]).float()
+            net.load_state_dict(state_dict)
+            self.net = GreedyMarioNet(net.online).eval()
+        else:
+            from play_mario_net import load_mario_net
+
+            self.net, _ = load_mario_net(path)
+
+    def reset(self, info):
+        pass
+
+    def act(self, observation, info):
+        with torch.inference_mode():
+            action_values = self.net(torch.from_numpy(np.asarray(observation)).unsqueeze(0))
+        return int(torch.argmax(action_values, axis=1))
+
+
+AGENTS = {
+    'sequence': SequenceAgent,
+    'policy': PolicyAgent,
+    'features': FeaturesAgent,
+    'approx': ApproxAgent,
+    'dqn': DQNAgent,
+}
+
+# agents loaded by this process, by (kind, path)
+_agents = {}
+# DQN envs built by this process, by stage
+_dqn_envs = {}
+
+
+def _get_env(kind, world, stage):
+    "The env an agent plays a stage in: the DQN's preprocessed one, or the simple movement one of the other scripts"
+    if kind == 'dqn':
+        env_name = f"SuperMarioBros-{world}-{stage}-v0"
+        if env_name not in _dqn_envs:
+            _dqn_envs[env_name] = make_mario_env(env_name)
+        return _dqn_envs[env_name]
+    return get_env(f"SuperMarioBros-{world}-{stage}-v3")
+
+
+def run_episode(kind, path, world, stage, episode, seed, steps):
+    """
+    Plays one seeded episode of an agent.
+
+    :param kind: One of AGENT_KINDS
+    :param path: File of the agent
+    :param world: World of the stage
+    :param stage: Stage in the world
+    :param episode: Number of the episode, part of its seed
+    :param seed: Seed of the evaluation
+    :param steps: Maximum agent steps
+    :return: Dict of the episode's results
+    """
+    episode_seed = seed_everything(derive_seed(seed, world, stage, episode))
+    agent = _agents.get((kind, path))
+    if agent is None:
+        agent = _agents[(kind, path)] = AGENTS[kind](path)
+    env = seed_env(_get_env(kind, world, stage), episode_seed)
+
+    observation = env.reset()
+    info = dict(_INITIAL_INFO, world=world, stage=stage)
+    agent.reset(info)
+    total_reward, max_x, step = 0.0, int(info["x_pos"]), 0
+    while step < steps:
+        action = agent.act(observation, info)
+        if action is None:
+            break
+        observation, reward, done, info = env.step(action)
+        total_reward += reward
+        max_x = max(max_x, int(info["x_pos"]))
+        step += 1
+        if done or info["flag_get"]:
+            break
+    return {
+        'world': world,
+        'stage': stage,
+        'episode': episode,
+        'reward': total_reward,
+        'steps': step,
+        'max_x': max_x,
+        'score': int(info["score"]),
+        'flag': bool(info["flag_get"]),
+    }
+
+
+def _run_episode_job(job):
+    return run_episode(*job)
+
+
+def evaluate(kind, path, stages, episodes=1, steps=5000, seed=0, workers=None):
+    """
+    Plays every episode of the evaluation on a pool of worker processes.
+
+    :param kind: One of AGENT_KINDS
+    :param path: File of the agent
+    :param stages: List of (world, stage)
+    :param episodes: Episodes per stage
+    :param steps: Maximum agent steps per episode
+    :param seed: Seed of the evaluation
+    :param workers: Number of worker processes (None for one per core)
+    :return: List of the results of every episode, in order of stage and episode
+    """
+    jobs = [(kind, str(path), world, stage, e, seed, steps) for world, stage in stages for e in range(episodes)]
+    with multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), len(jobs))) as pool:
+        return pool.map(_run_episode_job, jobs, chunksize=1)
+
+
+def summarize(results):
+    """
+    Averages the results of the episodes of each stage.
+
+    :param results: List returned by evaluate
+    :return: Dict of "world-stage" -> mean reward, mean and max x position, flag rate and mean steps
+    """
+    summary = {}
+    for world, stage in dict.fromkeys((r['world'], r['stage']) for r in results):
+        episodes = [r for r in results if (r['world'], r['stage']) == (world, stage)]
+        summary[f"{world}-{stage}"] = {
+            'episodes': len(episodes),
+            'mean_reward': float(np.mean([r['reward'] for r in episodes])),
+            'mean_x': float(np.mean([r['max_x'] for r in episodes])),
+            'max_x': max(r['max_x'] for r in episodes),
+            'flag_rate': float(np.mean([r['flag'] for r in episodes])),
+            'mean_steps': float(np.mean([r['steps'] for r in episodes])),
+        }
+    return summary
+
+
+def _parse_stage(text):
+    world, stage = text.split("-")
+    return int(world), int(stage)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a trained SMB agent reproducibly.")
+    parser.add_argument("kind", choices=AGENT_KINDS)
+    parser.add_argument("path")
+    parser.add_argument("--stages", default=["1-1"], nargs="+", type=_parse_stage)
+    parser.add_argument("--episodes", default=1, type=int)
+    parser.add_argument("--steps", default=5000, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--workers", default=None, type=int)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = evaluate(args.kind, args.path, args.stages, args.episodes, args.steps, args.seed, args.workers)
+    summary = summarize(results)
+    for name, stage in summary.items():
+        print(f"Stage {name} - Episodes {stage['episodes']} - Mean Reward {stage['mean_reward']:.1f} - "
+              f"Mean X {stage['mean_x']:.1f} - Max X {stage['max_x']} - Flag Rate {stage['flag_rate']:.2f} - "
+              f"Mean Steps {stage['mean_steps']:.1f}")
+    print(f"Evaluated in {time.perf_counter() - start:.1f}s")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({'kind': args.kind, 'path': args.path, 'seed': args.seed, 'steps': args.steps,
+                       'summary': summary, 'episodes': results}, f, indent=2)
@@ -0,0 +1,64 @@
+"""
+Exports the online network of a DeepQLearningMario checkpoint as a frozen TorchScript module for play_mario_net.py.
+The module takes a batch of uint8 frame stacks, (n, 4, 84, 84) as make_mario_env returns them, scales them to [0, 1]
+itself and returns the Q value of every action. The env it was trained on is stored alongside it, so the player
+needs nothing but the exported file.
+
+Run:
+    python export_mario_net.py data/checkpoints/mario_net_1.chkpt --output mario_net.pt
+"""
+import argparse
+import json
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from agents.conv_neural_network import MarioNet
+
+
+class GreedyMarioNet(nn.Module):
+    '''online head of MarioNet with the uint8 -> [0, 1] scaling of the agent built in'''
+
+    def __init__(self, online):
+        super().__init__()
+        self.online = online
+
+    def forward(self, state):
+        return self.online(state.float() / 255)
+
+
+def export_mario_net(checkpoint, output, env_name='SuperMarioBros-1-1-v0'):
+    """
+    Writes the online network of a checkpoint as a frozen TorchScript module.
+
+    :param checkpoint: Path of a checkpoint written by DeepQLearningMario.save
+    :param output: Path of the TorchScript file to write
+    :param env_name: The env the network was trained on, stored in the file for the player
+    :return: The exported module
+    """
+    state_dict = torch.load(checkpoint, map_location='cpu')['model']
+    # the last layer of the online network has one output per action
+    action_dim = state_dict['online.9.weight'].shape[0]
+    net = MarioNet((4, 84, 84), action_dim).float()
+    net.load_state_dict(state_dict)
+
+    greedy = GreedyMarioNet(net.online).eval()
+    example = torch.zeros((1, 4, 84, 84), dtype=torch.uint8)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(greedy, example))
+    metadata = {'env_name': env_name, 'action_dim': action_dim, 'checkpoint': str(checkpoint)}
+    torch.jit.save(scripted, str(output), _extra_files={'metadata.json': json.dumps(metadata)})
+    return scripted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a Mario Net checkpoint to TorchScript.")
+    parser.add_argument("checkpoint", type=Path)
+    parser.add_argument("--output", default=None, type=Path)
+    parser.add_argument("--env", default="SuperMarioBros-1-1-v0")
+    args = parser.parse_args()
+
+    output = args.output or args.checkpoint.with_suffix('.pt')
+    export_mario_net(args.checkpoint, output, args.env)
+    print(f"Exported the online network of {args.checkpoint} to {output}")
@@ -10,7 +10,26 @@ import heapq
 import multiprocessing
 
 from agents import genetic_policy_agent
+from util.env_pool import make_env
 from util.file_utils import add_csv_rows, create_csv_file, overwrite_policy_file
+from util.run_mode import add_run_mode_arguments, run_mode_from_args, wrap_run_mode
+from util.seeding import derive_seed, seed_everything
+from util.shared_population import SharedPopulation, attach_worker
+
+
+def _run_policy_job(job):
+    """
+    Unpacks a single evaluation job for the worker pool (imap_unordered only passes one argument).
+
+    :param job: Tuple of arguments for genetic_policy_agent.run_policy_shared, and the seed of the run
+    :return: The index of the policy that was run
+    """
+    *arguments, seed = job
+    if seed is not None:
+        # the random actions outside of a policy depend on the policy, not on which worker runs it
+        index, generation = arguments[:2]
+        seed_everything(derive_seed(seed, generation, index))
+    return genetic_policy_agent.run_policy_shared(*arguments)
 
 
 def run_genetic_algorithm(
@@ -25,6 +44,9 @@ def run_genetic_algorithm(
     policy_file_name,
     max_x,
     max_y,
+    workers=None,
+    run_mode=None,
+    seed=None,
 ):
     """
     Runs the Genetic Algorithm.
@@ -39,7 +61,13 @@ def run_genetic_algorithm(
     :param policy_file_name: TXT file to store policy in
     :param max_x: Max x to generate a policy for
     :param max_y: Max y to generate a policy for
+    :param workers: Number of worker processes evaluating policies (None for one per core)
+    :param run_mode: Keyword arguments of util.run_mode.wrap_run_mode. Workers always run headless; in render or
+    video mode the best policy of every every-th generation is replayed in the driver to be shown (None for headless)
+    :param seed: Seed of the random policies, crossovers, mutations and rollouts (None for unseeded)
     """
+    if seed is not None:
+        seed_everything(seed)
     print("STARTING...")
     fields = [
         "Generation",
@@ -52,53 +80,89 @@ def run_genetic_algorithm(
     ]
     create_csv_file(fields, csv_file_name)
 
-    current_generation = genetic_policy_agent.get_starting_generation(
+    # the population lives in shared memory, workers only get the index of the policy to run
+    population = SharedPopulation(number_per_gen, (max_x + 1, max_y + 1), len(fields))
+    population.genes[:] = genetic_policy_agent.get_starting_generation(
         number_per_gen, max_x, max_y
     )
+    fitness_field = fields.index("Fitness")
     max_fitness_encountered = 0
     print(f"Created initial sequences!")
 
-    for i in range(number_of_generations):
-        print(f"STARTING GENERATION: {i + 1}")
-        # runs and evaluates fitness of each policy
-        multiprocessing_pool = multiprocessing.Pool()
-        best_in_generation = [
-            multiprocessing_pool.apply(
-                genetic_policy_agent.run_policy,
-                args=(current_generation[j], i, j, world, stage),
-            )
-            for j in range(number_per_gen)
-        ]
-        multiprocessing_pool.close()
-        print(f"Finished processing sequences for gen: {i + 1}")
-
-        # save data for this generation
-        data_from_ga = []
-        for neg_fitness, data, policy in best_in_generation:
-            data_from_ga.append(data)
-        add_csv_rows(data_from_ga, csv_file_name)
-
-        # finds the most fit in this generation to breed
-        heapq.heapify(best_in_generation)
-        to_breed = []
-        for parent_index in range(number_to_breed):
-            neg_fitness, data, policy = heapq.heappop(best_in_generation)
-            if parent_index == 0 and abs(neg_fitness) > max_fitness_encountered:
-                max_fitness_encountered = max(max_fitness_encountered, abs(neg_fitness))
-                overwrite_policy_file(policy, i + 1, policy_file_name)
-            to_breed.append(policy)
-
-        # crossover
-        print(f"Crossover for Generation: {i + 1}")
-        current_generation = genetic_policy_agent.do_crossover(
-            to_breed, number_per_gen, max_x, max_y
+    # env the best policy of a generation is shown in, in render or video mode
+    show_env = None
+    if run_mode and run_mode["mode"] != "headless":
+        show_env = wrap_run_mode(
+            make_env(f"SuperMarioBros-{world}-{stage}-v3"),
+            run_mode["mode"],
+            1,
+            run_mode["video_dir"],
+            "generation",
         )
-        # mutate, and decrement mutation rate
-        print(f"Mutations for Generation: {i + 1}")
-        current_generation = genetic_policy_agent.mutate(
-            current_generation, mutation_rate, max_x, max_y
-        )
-        mutation_rate *= mutation_rate_decay
+
+    try:
+        # one pool for the whole run, so each worker keeps its environment between generations
+        with multiprocessing.Pool(
+            workers, attach_worker, (population.spec(),)
+        ) as multiprocessing_pool:
+            for i in range(number_of_generations):
+                print(f"STARTING GENERATION: {i + 1}")
+                # runs and evaluates fitness of each policy
+                jobs = [(j, i, world, stage, seed) for j in range(number_per_gen)]
+                for _ in multiprocessing_pool.imap_unordered(_run_policy_job, jobs):
+                    pass
+                print(f"Finished processing sequences for gen: {i + 1}")
+
+                # save data for this generation
+                data_from_ga = [population.result_row(j) for j in range(number_per_gen)]
+                add_csv_rows(data_from_ga, csv_file_name)
+
+                # finds the most fit in this generation to breed
+                best_in_generation = [
+                    (-population.results[j, fitness_field], j)
+                    for j in range(number_per_gen)
+                ]
+                heapq.heapify(best_in_generation)
+                parents = []
+                for parent_index in range(number_to_breed):
+                    neg_fitness, j = heapq.heappop(best_in_generation)
+                    if parent_index == 0 and abs(neg_fitness) > max_fitness_encountered:
+                        max_fitness_encountered = max(
+                            max_fitness_encountered, abs(neg_fitness)
+                        )
+                        overwrite_policy_file(
+                            population.genes[j], i + 1, policy_file_name
+                        )
+                    if (
+                        parent_index == 0
+                        and show_env is not None
+                        and i % run_mode["every"] == 0
+                    ):
+                        # videos are numbered by generation
+                        show_env.episodes = i + 1
+                        genetic_policy_agent.run_policy(
+                            population.genes[j], i, j, world, stage, env=show_env
+                        )
+                    parents.append(j)
+                # copied out, since the children overwrite the population
+                to_breed = population.genes[parents]
+
+                # crossover
+                print(f"Crossover for Generation: {i + 1}")
+                population.genes[:] = genetic_policy_agent.do_crossover(
+                    to_breed, number_per_gen, max_x, max_y
+                )
+                # mutate, and decrement mutation rate
+                print(f"Mutations for Generation: {i + 1}")
+                genetic_policy_agent.mutate(
+                    population.genes, mutation_rate, max_x, max_y
+                )
+                mutation_rate *= mutation_rate_decay
+    finally:
+        # frees the shared memory even if a generation fails or is interrupted
+        population.close()
+        if show_env is not None:
+            show_env.close()
 
 
 if __name__ == "__main__":
@@ -107,6 +171,9 @@ if __name__ == "__main__":
     parser.add_argument("--generations", required=True, type=int)
     parser.add_argument("--world", required=True, type=int)
     parser.add_argument("--stage", required=True, type=int)
+    parser.add_argument("--workers", default=None, type=int)
+    parser.add_argument("--seed", default=None, type=int)
+    add_run_mode_arguments(parser)
     args = parser.parse_args()
     number_per_gen = max(2, args.num_in_gen)
     number_of_generations = args.generations
@@ -135,4 +202,7 @@ if __name__ == "__main__":
         policy_file_name,
         max_x,
         max_y,
+        args.workers,
+        run_mode_from_args(args),
+        args.seed,
     )
@@ -4,12 +4,80 @@ sorted by fitness level, and then allowed to "breed."
 """
 import argparse
 import heapq
+import math
 import multiprocessing
+import os
 from agents import genetic_sequence_agent
+from util.env_pool import make_env
 from util.file_utils import add_csv_rows, create_csv_file, overwrite_seq_file
+from util.rollout_cache import init_worker_cache
+from util.run_mode import add_run_mode_arguments, run_mode_from_args, wrap_run_mode
+from util.seeding import seed_everything
+from util.shared_population import SharedPopulation, attach_worker
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
 
 
+def _init_worker(population_spec, checkpoint_every, cache_bytes):
+    """
+    Sets up a worker process: attaches it to the shared population and gives it a rollout cache.
+
+    :param population_spec: SharedPopulation.spec() of the driver's population
+    :param checkpoint_every: Actions between rollout cache checkpoints (0 for no cache)
+    :param cache_bytes: Memory budget of the worker's rollout cache
+    """
+    attach_worker(population_spec)
+    if checkpoint_every:
+        init_worker_cache(checkpoint_every, cache_bytes)
+
+
+def _run_sequence_job(job):
+    """
+    Unpacks a single evaluation job for the worker pool (imap_unordered only passes one argument).
+
+    :param job: Tuple of arguments for genetic_sequence_agent.run_sequence_shared
+    :return: The index of the sequence that was run
+    """
+    return genetic_sequence_agent.run_sequence_shared(*job)
+
+
+def evaluate_generation(
+    pool,
+    sequences,
+    generation,
+    stop_when_dead,
+    world,
+    stage,
+    parents=None,
+    chunksize=1,
+):
+    """
+    Evaluates every sequence of a generation at once on the worker pool. All jobs are dispatched up front and
+    results are collected in the order they complete, so every worker stays busy until the generation is done.
+    Workers read the sequences from the shared population and write their results rows into it.
+
+    :param pool: Worker pool that lives for the whole run, attached to the shared population
+    :param sequences: The sequences of this generation (the same ones as in the shared population)
+    :param generation: The generation we are on
+    :param stop_when_dead: Whether to stop run of sequence after first life lost
+    :param world: The world to run sequences in, False if all
+    :param stage: The stage to run sequences in, False if all
+    :param parents: Sequences this generation was bred from. Children are then dispatched grouped by parent, in
+    increasing order of shared prefix, so the workers' rollout caches can resume them from checkpoints on that prefix
+    :param chunksize: Number of consecutive jobs a worker takes at a time
+    :return: List of the indices of the sequences, in completion order
+    """
+    if parents:
+        shared = [
+            genetic_sequence_agent.shared_prefix_length(sequence, parents)
+            for sequence in sequences
+        ]
+    else:
+        shared = [(0, 0)] * len(sequences)
+    order = sorted(range(len(sequences)), key=lambda j: shared[j])
+    jobs = [(j, generation, stop_when_dead, world, stage, shared[j][1]) for j in order]
+    return list(pool.imap_unordered(_run_sequence_job, jobs, chunksize))
+
+
 def run_genetic_algorithm(
     world,
     stage,
@@ -22,6 +90,12 @@ def run_genetic_algorithm(
     mutation_rate_decay,
     csv_file_name,
     seq_file_name,
+    stop_when_dead=True,
+    workers=None,
+    checkpoint_every=500,
+    cache_mb=256,
+    run_mode=None,
+    seed=None,
 ):
     """
     Runs the genetic Algorithm
@@ -37,8 +111,18 @@ def run_genetic_algorithm(
     :param mutation_rate_decay: Rate mutation rate decays at
     :param csv_file_name: CSV file to output info to
     :param seq_file_name: text file to output best sequence to
+    :param stop_when_dead: Whether to stop run of sequence after first life lost
+    :param workers: Number of worker processes evaluating sequences (None for one per core)
+    :param checkpoint_every: Actions between rollout cache checkpoints (0 to replay every child from reset)
+    :param cache_mb: Memory budget of each worker's rollout cache in MB
+    :param run_mode: Keyword arguments of util.run_mode.wrap_run_mode. Workers always run headless; in render or
+    video mode the best sequence of every every-th generation is replayed in the driver to be shown (None for headless)
+    :param seed: Seed of the random sequences, crossovers and mutations (None for unseeded). Rollouts are
+    deterministic, so a seeded run is reproducible on any number of workers
     :return:
     """
+    if seed is not None:
+        seed_everything(seed)
     fields = [
         "Generation",
         "Sequence",
@@ -53,56 +137,115 @@ def run_genetic_algorithm(
     sequences = genetic_sequence_agent.get_initial_sequences(
         sequence_length, number_of_sequences, len(SIMPLE_MOVEMENT)
     )
+    # the population lives in shared memory, workers only get the index of the sequence to run.
+    # each results row is the csv data followed by the max reached step
+    population = SharedPopulation(
+        number_of_sequences, (sequence_length,), len(fields) + 1
+    )
+    fitness_field = fields.index("Fitness")
     max_fitness_encountered = 0
+    to_breed = None
 
-    for i in range(generations):
-        print(f"STARTING GENERATION: {i + 1}")
-
-        # run each member of the generation
-        multiprocessing_pool = multiprocessing.Pool()
-        best_sequences = [
-            multiprocessing_pool.apply(
-                genetic_sequence_agent.run_sequence_parallel,
-                args=(sequences[j], i, j, stop_when_dead, world, stage),
-            )
-            for j in range(number_of_sequences)
-        ]
-        multiprocessing_pool.close()
-        print(f"Finished Initial Processing for Generation: {i + 1}")
-
-        data_from_ga = []
-        # save data for this generation
-        for neg_fitness, max_reached, data, seq in best_sequences:
-            data_from_ga.append(data)
-        add_csv_rows(data_from_ga, csv_file_name)
-        # reset for next generation
-
-        # order sequences
-        heapq.heapify(best_sequences)
-        to_breed = []
-        max_steps = 0
-        # choose the most fit for breeding
-        for seq_num in range(number_to_breed):
-            neg_fitness, max_reached, data, sequence = heapq.heappop(best_sequences)
-            if seq_num == 0:
-                # if this is the best so far we want to save this!
-                if abs(neg_fitness) > max_fitness_encountered:
-                    max_fitness_encountered = max(
-                        max_fitness_encountered, abs(neg_fitness)
-                    )
-                    overwrite_seq_file(sequence, i + 1, seq_file_name)
-            max_steps = max(max_steps, max_reached)
-            to_breed.append(sequence)
-
-        # crossover
-        print(f"Crossover for Generation: {i + 1}")
-        sequences = genetic_sequence_agent.crossover(
-            max_steps, number_of_crossovers, to_breed, number_of_sequences
+    # env the best sequence of a generation is shown in, in render or video mode
+    show_env = None
+    if run_mode and run_mode["mode"] != "headless":
+        if world and stage:
+            stage_name = f"SuperMarioBros-{world}-{stage}-v3"
+        else:
+            stage_name = "SuperMarioBros-v3"
+        show_env = wrap_run_mode(
+            make_env(stage_name),
+            run_mode["mode"],
+            1,
+            run_mode["video_dir"],
+            "generation",
         )
-        # mutate, and decrement mutation rate
-        print(f"Mutations for Generation: {i + 1}")
-        sequences = genetic_sequence_agent.mutate(sequences, max_steps, mutation_rate)
-        mutation_rate *= mutation_rate_decay
+
+    if checkpoint_every:
+        # keep siblings together so they resume from the same parked emulator
+        chunksize = math.ceil(number_of_sequences / (workers or os.cpu_count()))
+    else:
+        chunksize = 1
+
+    try:
+        # one pool for the whole run, so workers are only started once
+        with multiprocessing.Pool(
+            workers,
+            _init_worker,
+            (population.spec(), checkpoint_every, cache_mb * 2**20),
+        ) as multiprocessing_pool:
+            for i in range(generations):
+                print(f"STARTING GENERATION: {i + 1}")
+                population.genes[:] = sequences
+
+                # run each member of the generation
+                evaluate_generation(
+                    multiprocessing_pool,
+                    sequences,
+                    i,
+                    stop_when_dead,
+                    world,
+                    stage,
+                    to_breed if checkpoint_every else None,
+                    chunksize,
+                )
+                print(f"Finished Initial Processing for Generation: {i + 1}")
+
+                # save data for this generation
+                data_from_ga = [
+                    population.result_row(j)[:-1] for j in range(number_of_sequences)
+                ]
+                add_csv_rows(data_from_ga, csv_file_name)
+                # reset for next generation
+
+                # order sequences
+                best_sequences = [
+                    (
+                        -population.results[j, fitness_field],
+                        int(population.results[j, -1]),
+                        j,
+                    )
+                    for j in range(number_of_sequences)
+                ]
+                heapq.heapify(best_sequences)
+                to_breed = []
+                max_steps = 0
+                # choose the most fit for breeding
+                for seq_num in range(number_to_breed):
+                    neg_fitness, max_reached, j = heapq.heappop(best_sequences)
+                    sequence = sequences[j]
+                    if seq_num == 0:
+                        # if this is the best so far we want to save this!
+                        if abs(neg_fitness) > max_fitness_encountered:
+                            max_fitness_encountered = max(
+                                max_fitness_encountered, abs(neg_fitness)
+                            )
+                            overwrite_seq_file(sequence, i + 1, seq_file_name)
+                        if show_env is not None and i % run_mode["every"] == 0:
+                            # videos are numbered by generation
+                            show_env.episodes = i + 1
+                            genetic_sequence_agent.run_sequence(
+                                sequence, stage_name, stop_when_dead, env=show_env
+                            )
+                    max_steps = max(max_steps, max_reached)
+                    to_breed.append(sequence)
+
+                # crossover
+                print(f"Crossover for Generation: {i + 1}")
+                sequences = genetic_sequence_agent.crossover(
+                    max_steps, number_of_crossovers, to_breed, number_of_sequences
+                )
+                # mutate, and decrement mutation rate
+                print(f"Mutations for Generation: {i + 1}")
+                sequences = genetic_sequence_agent.mutate(
+                    sequences, max_steps, mutation_rate
+                )
+                mutation_rate *= mutation_rate_decay
+    finally:
+        # frees the shared memory even if a generation fails or is interrupted
+        population.close()
+        if show_env is not None:
+            show_env.close()
 
 
 if __name__ == "__main__":
@@ -111,6 +254,11 @@ if __name__ == "__main__":
     parser.add_argument("--generations", required=True, type=int)
     parser.add_argument("--world", default=False, type=int)
     parser.add_argument("--stage", default=False, type=int)
+    parser.add_argument("--workers", default=None, type=int)
+    parser.add_argument("--checkpoint_every", default=500, type=int)
+    parser.add_argument("--cache_mb", default=256, type=int)
+    parser.add_argument("--seed", default=None, type=int)
+    add_run_mode_arguments(parser)
     args = parser.parse_args()
     number_of_sequences = max(2, args.num_seq)
     generations = args.generations
@@ -143,4 +291,10 @@ if __name__ == "__main__":
         mutation_rate_decay,
         csv_file_name,
         seq_file_name,
+        stop_when_dead,
+        args.workers,
+        args.checkpoint_every,
+        args.cache_mb,
+        run_mode_from_args(args),
+        args.seed,
     )
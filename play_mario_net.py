@@ -0,0 +1,76 @@
+"""
+Plays greedy episodes with a Mario Net exported by export_mario_net.py. Only the TorchScript file is loaded: no
+agent, optimizer or replay buffer. Runs headless at full emulator speed unless --render is given.
+
+Run:
+    python play_mario_net.py mario_net.pt --episodes 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from util.wrappers import make_mario_env
+
+
+def load_mario_net(path):
+    """
+    Loads an exported Mario Net.
+
+    :param path: Path of the TorchScript file
+    :return: The module and the metadata stored with it
+    """
+    extra_files = {'metadata.json': ''}
+    net = torch.jit.load(str(path), map_location='cpu', _extra_files=extra_files)
+    return net, json.loads(extra_files['metadata.json'])
+
+
+def play(net, env, episodes, render=False):
+    """
+    Plays greedy episodes.
+
+    :param net: Exported Mario Net
+    :param env: Env made by make_mario_env
+    :param episodes: Number of episodes to play
+    :param render: Whether to render every step
+    :return: List of (reward, steps, x position, flag reached) of every episode
+    """
+    results = []
+    for e in range(episodes):
+        state = env.reset()
+        ep_reward, steps = 0.0, 0
+        start = time.perf_counter()
+        while True:
+            with torch.inference_mode():
+                action_values = net(torch.from_numpy(np.asarray(state)).unsqueeze(0))
+            state, reward, done, info = env.step(int(torch.argmax(action_values, axis=1)))
+            ep_reward += reward
+            steps += 1
+            if render:
+                env.render()
+            if done or info['flag_get']:
+                break
+        seconds = time.perf_counter() - start
+        print(f"Episode {e} - Reward {ep_reward} - Steps {steps} - X Position {info['x_pos']} - "
+              f"Flag {info['flag_get']} - {steps / seconds:.1f} steps/s")
+        results.append((ep_reward, steps, info['x_pos'], info['flag_get']))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play SMB greedily with an exported Mario Net.")
+    parser.add_argument("net")
+    parser.add_argument("--episodes", default=1, type=int)
+    parser.add_argument("--env", default=None)
+    parser.add_argument("--render", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    net, metadata = load_mario_net(args.net)
+    env = make_mario_env(args.env or metadata['env_name'])
+    print(f"Loaded {args.net} and {args.env or metadata['env_name']} in {time.perf_counter() - start:.2f}s")
+
+    play(net, env, args.episodes, args.render)
+    env.close()
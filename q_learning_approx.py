@@ -1,14 +1,26 @@
 """
 Q-Learning Algorithm where the representation of state is an abstract list of features.
 """
+import argparse
 import csv
 from nes_py.wrappers import JoypadSpace
 import gym_super_mario_bros
 from agents.approximate_q_learning_agent import ApproxQLearningMarioAgent
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+from util.run_mode import add_run_mode_arguments, run_mode_from_args, wrap_run_mode
+from util.seeding import seed_env, seed_everything
+
+parser = argparse.ArgumentParser(description="Approximate Q-learning on info features for SMB.")
+parser.add_argument("--seed", default=None, type=int)
+add_run_mode_arguments(parser)
+args = parser.parse_args()
 
 env = gym_super_mario_bros.make("SuperMarioBros-v3")
 env = JoypadSpace(env, SIMPLE_MOVEMENT)
+env = wrap_run_mode(env, **run_mode_from_args(args))
+if args.seed is not None:
+    seed_everything(args.seed)
+    seed_env(env, args.seed)
 
 done = False
 episodes = 100
@@ -47,7 +59,10 @@ for i in range(episodes):
             state, reward, done, next_info = env.step(action)
             q_learning_agent.update(info, action, next_info, reward)
             info = next_info
-    q_values = q_learning_agent.get_q_values()
+    # the next episode's agent continues from these weights
+    weights = q_learning_agent.get_weights()
+
+env.close()
 
 with open("data/q_learning_approx.csv", "w") as csvfile:
     csvwriter = csv.writer(csvfile)
@@ -55,4 +70,4 @@ with open("data/q_learning_approx.csv", "w") as csvfile:
     csvwriter.writerows(data_from_training)
 
 file_best_sequence = open("data/approx_policy", "w")
-file_best_sequence.write(f"f{q_values}\n")
+file_best_sequence.write(f"f{weights.tolist()}\n")
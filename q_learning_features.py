@@ -1,14 +1,26 @@
 """
 Q-Learning Algorithm where the representation of state is an abstract list of features.
 """
+import argparse
 import csv
 from nes_py.wrappers import JoypadSpace
 import gym_super_mario_bros
 from agents.q_learning_agent import QLearningMarioAgent
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+from util.run_mode import add_run_mode_arguments, run_mode_from_args, wrap_run_mode
+from util.seeding import seed_env, seed_everything
+
+parser = argparse.ArgumentParser(description="Q-learning on info features for SMB.")
+parser.add_argument("--seed", default=None, type=int)
+add_run_mode_arguments(parser)
+args = parser.parse_args()
 
 env = gym_super_mario_bros.make("SuperMarioBros-v0")
 env = JoypadSpace(env, SIMPLE_MOVEMENT)
+env = wrap_run_mode(env, **run_mode_from_args(args))
+if args.seed is not None:
+    seed_everything(args.seed)
+    seed_env(env, args.seed)
 
 done = False
 episodes = 100
@@ -50,6 +62,8 @@ for i in range(episodes):
             curr_state_tuple = next_state_tuple
     q_values = q_learning_agent.get_q_values()
 
+env.close()
+
 with open("data/q_learning_features.csv", "w") as csvfile:
     csvwriter = csv.writer(csvfile)
     csvwriter.writerow(fields)
@@ -1,22 +1,39 @@
 """
-Q-learning algorithm where state is the direct pixel representation of state.
+Q-learning algorithm where state is the direct pixel representation of state, downsampled and quantized to a 64-bit
+key by util.state_encoding.
 """
-import numpy
+import argparse
 import csv
 from nes_py.wrappers import JoypadSpace
 import gym_super_mario_bros
 from agents.q_learning_agent import QLearningMarioAgent
+from agents.q_table import DenseQTable
 from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+from util.run_mode import add_run_mode_arguments, run_mode_from_args, wrap_run_mode
+from util.seeding import seed_env, seed_everything
+from util.state_encoding import FrameEncoder
+
+parser = argparse.ArgumentParser(description="Q-learning on pixels for SMB.")
+parser.add_argument("--seed", default=None, type=int)
+add_run_mode_arguments(parser)
+args = parser.parse_args()
 
 env = gym_super_mario_bros.make("SuperMarioBros-v3")
 env = JoypadSpace(env, SIMPLE_MOVEMENT)
+env = wrap_run_mode(env, **run_mode_from_args(args))
+if args.seed is not None:
+    seed_everything(args.seed)
+    seed_env(env, args.seed)
 
 done = False
 episodes = 100
 games_per_episode = 20
 info = {}
-curr_state = env.reset()
-q_values = None
+# every frame is encoded once, as soon as the env returns it
+encoder = FrameEncoder()
+curr_state = encoder.encode(env.reset())
+# keys are interned to rows of a float32 table
+q_values = DenseQTable(len(SIMPLE_MOVEMENT))
 data_from_training = []
 fields = ["Episode", "Game", "Coins", "Score", "World", "Level", "Time"]
 
@@ -36,19 +53,14 @@ for i in range(episodes):
                         info["time"],
                     ]
                 )
-                curr_state = env.reset()
+                curr_state = encoder.encode(env.reset())
                 done = False
                 break
-            action = q_learning_agent.get_action(numpy.array2string(curr_state))
+            action = q_learning_agent.get_action(curr_state)
             next_state, reward, done, info = env.step(action)
-            q_learning_agent.update(
-                numpy.array2string(curr_state),
-                action,
-                numpy.array2string(next_state),
-                reward,
-            )
+            next_state = encoder.encode(next_state)
+            q_learning_agent.update(curr_state, action, next_state, reward)
             curr_state = next_state
-            env.render()
     q_values = q_learning_agent.get_q_values()
 
 with open("data/q_learning_data.csv", "w") as csvfile:
@@ -0,0 +1,74 @@
+"""
+Replays a best sequence of genetic_super_mario.py (data/best_seq_<world>_<stage>.txt or data/best_seq_all.txt) headless
+at full emulator speed and reports where Mario died, how far he got and his score.
+
+With --snapshot-every K, the emulator is snapshotted every K actions as the sequence is played, and the states after
+the --scrub steps are then reached from the closest snapshot instead of from the start. --start and --end replay only
+part of the sequence; with --run-mode video, the part between them is recorded.
+
+Run:
+    python replay.py data/best_seq_all.txt --snapshot-every 1000 --scrub 5000 12000 7500
+"""
+import argparse
+import re
+import time
+from pathlib import Path
+
+from util.file_utils import read_seq_file
+from util.run_mode import add_run_mode_arguments, run_mode_from_args
+from util.sequence_replay import SequenceReplay
+
+
+def env_name_for(path):
+    "The env a best sequence file was found in, from its name"
+    match = re.fullmatch(r"best_seq_(\d+)_(\d+)\.txt", Path(path).name)
+    if match is None:
+        return "SuperMarioBros-v3"
+    return f"SuperMarioBros-{match[1]}-{match[2]}-v3"
+
+
+def describe(state):
+    "One line summary of a replay state"
+    info = state["info"]
+    if info is None:
+        return f"Step {state['step']} - not started"
+    return (f"Step {state['step']} - World {info['world']}-{info['stage']} - X {info['x_pos']} - "
+            f"Score {info['score']} - Lives {info['life']} - Flag {info['flag_get']} - Deaths {len(state['deaths'])}"
+            f"{' - Game Over' if state['done'] else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a best sequence of the GA.")
+    parser.add_argument("path")
+    parser.add_argument("--env", default=None)
+    parser.add_argument("--stop-when-dead", action="store_true")
+    parser.add_argument("--snapshot-every", default=0, type=int)
+    parser.add_argument("--start", default=0, type=int)
+    parser.add_argument("--end", default=None, type=int)
+    parser.add_argument("--scrub", default=[], nargs="+", type=int)
+    add_run_mode_arguments(parser)
+    args = parser.parse_args()
+
+    generation, actions = read_seq_file(args.path)
+    env_name = args.env or env_name_for(args.path)
+    print(f"Replaying {len(actions)} actions of generation {generation} in {env_name}")
+
+    replay = SequenceReplay(actions, env_name, args.snapshot_every)
+    try:
+        start = time.perf_counter()
+        if args.start:
+            replay.seek(args.start)
+        state = replay.play(args.end, args.stop_when_dead, run_mode_from_args(args))
+        elapsed = time.perf_counter() - start
+        for step, world, stage, x_pos in state["deaths"]:
+            print(f"Died at step {step} in {world}-{stage} at X {x_pos}")
+        print(describe(state))
+        print(f"Replayed in {elapsed:.2f}s ({state['step'] / elapsed:.0f} steps/s), "
+              f"{len(replay.snapshots)} snapshots")
+
+        for step in args.scrub:
+            start = time.perf_counter()
+            state = replay.seek(step)
+            print(f"{describe(state)} ({time.perf_counter() - start:.2f}s)")
+    finally:
+        replay.close()
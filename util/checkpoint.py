@@ -0,0 +1,111 @@
+"""
+Helpers for full DQN training checkpoints: RNG states, and replay buffers written as one uncompressed .npy file per
+array so that resuming can memory-map them instead of reading them into memory. (A compressed .npz can't be
+memory-mapped; frames in the replay buffer are already uint8 and stored once each.)
+
+Replay buffers are written from their live arrays while training goes on. The buffer's counters are snapshotted when
+the write starts; the transitions pushed while it runs overwrite the oldest transitions of that snapshot, so once the
+arrays are written the buffer drops those from the snapshot and patches the few values the copy still needs
+(see ReplayBuffer.checkpoint and finish_checkpoint).
+"""
+import json
+import os
+import random
+import shutil
+
+import numpy as np
+import torch
+
+# bytes copied into a memory-mapped file at a time
+WRITE_CHUNK_NBYTES = 64 << 20
+
+
+def get_rng_state():
+    """
+    Returns the states of the python, numpy and torch random generators, in types torch.load accepts with
+    weights_only.
+    """
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        'python': random.getstate(),
+        'numpy': (name, torch.from_numpy(keys.astype(np.int64)), position, has_gauss, cached_gaussian),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    Restores random generator states returned by get_rng_state.
+    """
+    random.setstate(state['python'])
+    name, keys, position, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, keys.numpy().astype(np.uint32), position, has_gauss, cached_gaussian))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def write_array(path, array):
+    """
+    Writes an array to an uncompressed .npy file through a memory map, a chunk at a time.
+
+    :param path: Path of the file
+    :param array: numpy array (or CPU tensor) to write
+    """
+    if isinstance(array, torch.Tensor):
+        array = array.numpy()
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype, shape=array.shape)
+    if len(array):
+        step = max(1, WRITE_CHUNK_NBYTES // max(1, array[0].nbytes))
+        for i in range(0, len(array), step):
+            out[i:i + step] = array[i:i + step]
+    out.flush()
+    del out
+
+
+def save_replay(directory, memory, arrays, counters):
+    """
+    Writes a replay buffer checkpoint started with memory.checkpoint(). The files go to a temporary directory that
+    is renamed once everything is written, so a directory with the final name is always complete.
+
+    :param directory: Directory to write the checkpoint to
+    :param memory: The replay buffer
+    :param arrays: Arrays returned by memory.checkpoint()
+    :param counters: Counters returned by memory.checkpoint()
+    """
+    partial = directory.with_name(directory.name + '.partial')
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+    for name, array in arrays.items():
+        write_array(partial / f'{name}.npy', array)
+
+    counters, overwritten, patches = memory.finish_checkpoint(counters)
+    for name, values in patches.items():
+        if values:
+            out = np.load(partial / f'{name}.npy', mmap_mode='r+')
+            for slot, value in values.items():
+                out[slot] = value.numpy() if isinstance(value, torch.Tensor) else value
+            out.flush()
+            del out
+    with open(partial / 'counters.json', 'w') as f:
+        json.dump(counters, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(partial, directory)
+
+
+def load_replay(directory):
+    """
+    Memory-maps a replay buffer checkpoint written by save_replay. The maps are copy-on-write: pages are read from
+    the file as they are first used, and pushes after resuming never change the file.
+
+    :param directory: Directory of the checkpoint
+    :return: Dict of arrays and the counters, for memory.load_checkpoint
+    """
+    with open(directory / 'counters.json') as f:
+        counters = json.load(f)
+    arrays = {path.stem: np.load(path, mmap_mode='c') for path in directory.glob('*.npy')}
+    return arrays, counters
@@ -1,9 +1,66 @@
+"""
+Metrics of the deep Q-learning scripts. Per-episode metrics are kept in fixed-size ring arrays with running sums, so
+the moving averages cost the same at episode 40000 as at episode 1, and are appended to an episode CSV log that is
+written in batches. Plots are rendered by a background thread from the moving averages, or on demand from the log with
+    python -m util.deep_q_logging data/checkpoints
+"""
+import argparse
+import datetime
+import threading
+import time
+from pathlib import Path
+
 import numpy as np
-import time, datetime
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+PLOTS = {
+    "ep_rewards": "reward_plot.jpg",
+    "ep_lengths": "length_plot.jpg",
+    "ep_avg_losses": "loss_plot.jpg",
+    "ep_avg_qs": "q_plot.jpg",
+}
+# column of each plotted metric in the log written by record()
+LOG_COLUMNS = {"ep_rewards": 3, "ep_lengths": 4, "ep_avg_losses": 5, "ep_avg_qs": 6}
+
+
+class RollingMean():
+    def __init__(self, window=100):
+        """
+        Mean of the last window values, kept in a ring array with a running sum.
+        The sum is recomputed from the ring each time it wraps around, so float error can't build up over a long run.
+        """
+        self.values = np.zeros(window)
+        self.window = window
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+
+    def append(self, value):
+        self.total += value - self.values[self.index]
+        self.values[self.index] = value
+        self.index += 1
+        if self.index == self.window:
+            self.index = 0
+            self.total = float(self.values.sum())
+        self.count = min(self.count + 1, self.window)
+
+    def mean(self):
+        "Mean of the values in the window, nan before the first one like np.mean of an empty list"
+        return self.total / self.count if self.count else float("nan")
+
+    def __len__(self):
+        return self.count
+
 
 class MetricLogger():
-    def __init__(self, save_dir):
+    def __init__(self, save_dir, window=100, flush_every=100, plot=True, timer=None):
+        """
+        :param save_dir: Directory of the log, episode log and plots
+        :param window: Number of episodes the moving averages are taken over
+        :param flush_every: Number of episodes the episode log buffers before writing them
+        :param plot: Whether record() has the plots redrawn by a background thread (plot_log draws them on demand)
+        :param timer: util.profiling.PhaseTimer whose phases record() reports, with the steps/s, and then resets
+        """
         self.save_log = save_dir / "log"
         with open(self.save_log, "w") as f:
             f.write(
@@ -11,16 +68,23 @@ class MetricLogger():
                 f"{'MeanLength':>15}{'MeanLoss':>15}{'MeanQValue':>15}"
                 f"{'TimeDelta':>15}{'Time':>20}\n"
             )
-        self.ep_rewards_plot = save_dir / "reward_plot.jpg"
-        self.ep_lengths_plot = save_dir / "length_plot.jpg"
-        self.ep_avg_losses_plot = save_dir / "loss_plot.jpg"
-        self.ep_avg_qs_plot = save_dir / "q_plot.jpg"
+        self.save_episodes = save_dir / "episodes.csv"
+        self.episode_file = open(self.save_episodes, "w")
+        self.episode_file.write("episode,reward,length,avg_loss,avg_q\n")
+        self.episode_rows = []
+        self.flush_every = flush_every
+        self.episodes = 0
+
+        self.ep_rewards_plot = save_dir / PLOTS["ep_rewards"]
+        self.ep_lengths_plot = save_dir / PLOTS["ep_lengths"]
+        self.ep_avg_losses_plot = save_dir / PLOTS["ep_avg_losses"]
+        self.ep_avg_qs_plot = save_dir / PLOTS["ep_avg_qs"]
 
-        # History metrics
-        self.ep_rewards = []
-        self.ep_lengths = []
-        self.ep_avg_losses = []
-        self.ep_avg_qs = []
+        # Metrics of the last window episodes
+        self.ep_rewards = RollingMean(window)
+        self.ep_lengths = RollingMean(window)
+        self.ep_avg_losses = RollingMean(window)
+        self.ep_avg_qs = RollingMean(window)
 
         # Moving averages, added for every call to record()
         self.moving_avg_ep_rewards = []
@@ -30,10 +94,23 @@ class MetricLogger():
 
         # Current episode metric
         self.init_episode()
+        # Current episode metrics of each env, for log_vector_step
+        self.vec_ep_rewards = None
 
         # Timing
         self.record_time = time.time()
+        self.record_step = None
 
+        # Per-phase timings, written to profile.csv by record()
+        self.timer = timer
+        if timer is not None:
+            timer.reset()
+            self.save_profile = save_dir / "profile.csv"
+            with open(self.save_profile, "w") as f:
+                f.write("episode,step,steps_per_s,phase,calls,seconds,share,mean,p50,p99\n")
+
+        # Plots are drawn by a background thread; record() only tells it how many moving averages there are
+        self.plotter = PlotThread(self) if plot else None
 
     def log_step(self, reward, loss, q):
         self.curr_ep_reward += reward
@@ -43,20 +120,58 @@ class MetricLogger():
             self.curr_ep_q += q
             self.curr_ep_loss_length += 1
 
+    def log_vector_step(self, rewards, dones, loss, q):
+        """
+        Logs one step of a batch of envs, and marks the end of the episodes that finished on it.
+        Returns the number of episodes that finished.
+        """
+        if self.vec_ep_rewards is None:
+            self.vec_ep_rewards = np.zeros(len(rewards))
+            self.vec_ep_lengths = np.zeros(len(rewards), dtype=int)
+            self.vec_ep_losses = np.zeros(len(rewards))
+            self.vec_ep_qs = np.zeros(len(rewards))
+            self.vec_ep_loss_lengths = np.zeros(len(rewards), dtype=int)
+        self.vec_ep_rewards += rewards
+        self.vec_ep_lengths += 1
+        if loss:
+            self.vec_ep_losses += loss
+            self.vec_ep_qs += q
+            self.vec_ep_loss_lengths += 1
+
+        finished = np.flatnonzero(dones)
+        for i in finished:
+            self.add_episode(self.vec_ep_rewards[i], self.vec_ep_lengths[i], self.vec_ep_losses[i],
+                             self.vec_ep_qs[i], self.vec_ep_loss_lengths[i])
+        for metric in [self.vec_ep_rewards, self.vec_ep_lengths, self.vec_ep_losses, self.vec_ep_qs,
+                       self.vec_ep_loss_lengths]:
+            metric[finished] = 0
+        return len(finished)
+
     def log_episode(self):
         "Mark end of episode"
-        self.ep_rewards.append(self.curr_ep_reward)
-        self.ep_lengths.append(self.curr_ep_length)
-        if self.curr_ep_loss_length == 0:
-            ep_avg_loss = 0
-            ep_avg_q = 0
+        self.add_episode(self.curr_ep_reward, self.curr_ep_length, self.curr_ep_loss, self.curr_ep_q,
+                         self.curr_ep_loss_length)
+        self.init_episode()
+
+    def add_episode(self, reward, length, loss, q, loss_length):
+        "Add the metrics of a finished episode, with the sums of its losses and Q values"
+        reward = float(reward)
+        length = int(length)
+        if loss_length == 0:
+            ep_avg_loss = 0.0
+            ep_avg_q = 0.0
         else:
-            ep_avg_loss = np.round(self.curr_ep_loss / self.curr_ep_loss_length, 5)
-            ep_avg_q = np.round(self.curr_ep_q / self.curr_ep_loss_length, 5)
+            ep_avg_loss = round(float(loss) / loss_length, 5)
+            ep_avg_q = round(float(q) / loss_length, 5)
+        self.ep_rewards.append(reward)
+        self.ep_lengths.append(length)
         self.ep_avg_losses.append(ep_avg_loss)
         self.ep_avg_qs.append(ep_avg_q)
 
-        self.init_episode()
+        self.episode_rows.append(f"{self.episodes},{reward},{length},{ep_avg_loss},{ep_avg_q}\n")
+        self.episodes += 1
+        if len(self.episode_rows) >= self.flush_every:
+            self.flush()
 
     def init_episode(self):
         self.curr_ep_reward = 0.0
@@ -66,19 +181,18 @@ class MetricLogger():
         self.curr_ep_loss_length = 0
 
     def record(self, episode, epsilon, step):
-        mean_ep_reward = np.round(np.mean(self.ep_rewards[-100:]), 3)
-        mean_ep_length = np.round(np.mean(self.ep_lengths[-100:]), 3)
-        mean_ep_loss = np.round(np.mean(self.ep_avg_losses[-100:]), 3)
-        mean_ep_q = np.round(np.mean(self.ep_avg_qs[-100:]), 3)
+        mean_ep_reward = round(self.ep_rewards.mean(), 3)
+        mean_ep_length = round(self.ep_lengths.mean(), 3)
+        mean_ep_loss = round(self.ep_avg_losses.mean(), 3)
+        mean_ep_q = round(self.ep_avg_qs.mean(), 3)
         self.moving_avg_ep_rewards.append(mean_ep_reward)
         self.moving_avg_ep_lengths.append(mean_ep_length)
         self.moving_avg_ep_avg_losses.append(mean_ep_loss)
         self.moving_avg_ep_avg_qs.append(mean_ep_q)
 
-
         last_record_time = self.record_time
         self.record_time = time.time()
-        time_since_last_record = np.round(self.record_time - last_record_time, 3)
+        time_since_last_record = round(self.record_time - last_record_time, 3)
 
         print(
             f"Episode {episode} - "
@@ -100,7 +214,108 @@ class MetricLogger():
                 f"{datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'):>20}\n"
             )
 
-        for metric in ["ep_rewards", "ep_lengths", "ep_avg_losses", "ep_avg_qs"]:
-            plt.plot(getattr(self, f"moving_avg_{metric}"))
-            plt.savefig(getattr(self, f"{metric}_plot"))
-            plt.clf()
\ No newline at end of file
+        if self.timer is not None:
+            self.record_profile(episode, step, time_since_last_record)
+
+        if self.plotter is not None:
+            self.plotter.request(len(self.moving_avg_ep_avg_qs))
+
+    def record_profile(self, episode, step, seconds):
+        "Print and log the steps/s and the time of each phase since the last record, then start a new window"
+        # the step of the first record isn't known before it (a resumed run starts at its checkpoint's step)
+        if self.record_step is None or not seconds:
+            steps_per_s = float("nan")
+        else:
+            steps_per_s = (step - self.record_step) / seconds
+        self.record_step = step
+        summary = self.timer.summary()
+        print(f"Steps/s {steps_per_s:.1f} - " + " - ".join(
+            f"{name} {phase['share']:.1%} ({phase['mean'] * 1e3:.3f} ms, p99 < {phase['p99'] * 1e3:.3f} ms)"
+            for name, phase in summary.items()
+        ))
+        with open(self.save_profile, "a") as f:
+            f.writelines(
+                f"{episode},{step},{steps_per_s:.3f},{name},{phase['calls']},{phase['seconds']:.6f},"
+                f"{phase['share']:.6f},{phase['mean']:.9f},{phase['p50']:.9f},{phase['p99']:.9f}\n"
+                for name, phase in summary.items()
+            )
+        self.timer.reset()
+
+    def flush(self):
+        "Write the buffered rows of the episode log"
+        if self.episode_rows:
+            self.episode_file.writelines(self.episode_rows)
+            self.episode_file.flush()
+            self.episode_rows = []
+
+    def close(self):
+        "Write the rest of the episode log and the last plots"
+        self.flush()
+        self.episode_file.close()
+        if self.plotter is not None:
+            self.plotter.close()
+            self.plotter = None
+
+
+class PlotThread():
+    def __init__(self, logger):
+        """
+        Redraws the plots of a logger's moving averages in a daemon thread. Requests made while a plot is drawn are
+        merged into one, so a slow draw never queues up work or holds up training.
+        """
+        self.logger = logger
+        self.condition = threading.Condition()
+        self.pending = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, count):
+        "Redraw the plots with the first count moving averages"
+        with self.condition:
+            self.pending = count
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                count, self.pending = self.pending, None
+                if count is None:
+                    return
+            # the lists are only appended to, so their first count entries can be read while record() appends
+            for metric in PLOTS:
+                save_plot(getattr(self.logger, f"moving_avg_{metric}")[:count], getattr(self.logger, f"{metric}_plot"))
+
+    def close(self):
+        "Draw the last requested plots and stop"
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+def save_plot(values, path):
+    "Save a line plot of values, on a figure of its own so threads don't share pyplot's state"
+    figure = Figure()
+    figure.add_subplot().plot(values)
+    figure.savefig(path)
+
+
+def plot_log(save_dir):
+    """
+    Draws the plots of the moving averages in the log of a run, e.g. of a run logged with plot=False or one still
+    running.
+    """
+    save_dir = Path(save_dir)
+    rows = np.loadtxt(save_dir / "log", skiprows=1, usecols=list(LOG_COLUMNS.values()), ndmin=2)
+    for i, metric in enumerate(LOG_COLUMNS):
+        save_plot(rows[:, i], save_dir / PLOTS[metric])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the plots of a deep Q-learning run from its log.")
+    parser.add_argument("save_dir", type=Path)
+    args = parser.parse_args()
+    plot_log(args.save_dir)
@@ -0,0 +1,46 @@
+"""
+Worker-local pool of Super Mario Bros environments. Building an environment loads the ROM and plays through the start
+screen, which is a large share of a short GA rollout, so every process builds each env id once and resets it between
+individuals (and generations) instead of making and closing a new one each time.
+"""
+import gym_super_mario_bros
+from gym_super_mario_bros.actions import SIMPLE_MOVEMENT
+from nes_py.wrappers import JoypadSpace
+
+# env id -> environment, one set per process
+_envs = {}
+
+
+def make_env(env_name):
+    """
+    Builds a new environment limited to the simple movement actions.
+
+    :param env_name: The env id to make (e.g. SuperMarioBros-1-1-v3)
+    :return: The new environment
+    """
+    env = gym_super_mario_bros.make(env_name)
+    return JoypadSpace(env, SIMPLE_MOVEMENT)
+
+
+def get_env(env_name):
+    """
+    Returns this process' environment for the env id, building it on first use. The caller must reset it before
+    running an individual.
+
+    :param env_name: The env id to get (e.g. SuperMarioBros-1-1-v3)
+    :return: The cached environment
+    """
+    env = _envs.get(env_name)
+    if env is None:
+        env = make_env(env_name)
+        _envs[env_name] = env
+    return env
+
+
+def close_envs():
+    """
+    Closes every environment cached by this process.
+    """
+    for env in _envs.values():
+        env.close()
+    _envs.clear()
@@ -41,14 +41,27 @@ def overwrite_seq_file(best_sequence, generation, filename):
         return False
 
 
+def read_seq_file(path):
+    """
+    Reads a best sequence file written by overwrite_seq_file
+
+    :param path: Path of the file (e.g. data/best_seq_1_1.txt)
+    :return: The generation it was found in, list of its actions
+    """
+    with open(path) as file_to_read:
+        generation = int(file_to_read.readline())
+        actions = [int(action) for action in file_to_read.read().split(",")]
+    return generation, actions
+
+
 def overwrite_policy_file(policy, generation, filename):
     """
-    Overwrites the best policy file
+    Overwrites the best policy file, with the policy array stored as nested JSON lists
     """
     try:
         with open(f"./data/{filename}", "w") as file_to_write:
             file_to_write.write(f"{generation}\n")
-            str_to_add = json.dumps(policy)
+            str_to_add = json.dumps(policy.tolist())
             file_to_write.write(str_to_add)
         return True
     except Exception as e:
@@ -0,0 +1,197 @@
+"""
+Per-phase timing of the deep Q-learning loop. Code marks its phases with PhaseTimer.phase; each phase gets its own
+time (less the time of the phases nested in it) added to a histogram of power-of-two nanosecond buckets, which costs
+a few hundred nanoseconds per phase and no memory per call. A disabled timer hands out a shared no-op phase, so the
+marks can stay in the hot path.
+
+TraceWindow additionally records a cProfile or torch.profiler trace of one window of steps.
+"""
+import cProfile
+import time
+
+import gym
+
+# bucket b counts the phases that took less than 2 ** b ns (and at least 2 ** (b - 1) ns)
+BUCKETS = 64
+
+
+class PhaseTimer():
+    def __init__(self, enabled=True):
+        """
+        :param enabled: Whether phases are timed at all
+        """
+        self.enabled = enabled
+        self.histograms = {}
+        self.totals = {}
+        self.counts = {}
+        # [start, time of nested phases] of the phases currently running, innermost last
+        self._stack = []
+        self._phases = {}
+        self.window_start = time.perf_counter()
+
+    def phase(self, name):
+        """
+        Context manager timing one phase, e.g. ``with timer.phase('act'): ...``
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name, nanoseconds):
+        "Adds one timing of a phase"
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * BUCKETS
+            self.totals[name] = 0
+            self.counts[name] = 0
+        histogram[min(nanoseconds.bit_length(), BUCKETS - 1)] += 1
+        self.totals[name] += nanoseconds
+        self.counts[name] += 1
+
+    def percentile(self, name, q):
+        "Upper bound in seconds of the bucket holding the q-th percentile of a phase"
+        histogram = self.histograms[name]
+        target = q / 100 * self.counts[name]
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= target:
+                return 2 ** bucket / 1e9
+        return 0.0
+
+    def summary(self):
+        """
+        Returns the timings since the last reset, as phase -> dict of calls, total seconds, share of the window,
+        mean seconds, and p50 and p99 (upper bounds of their buckets), slowest phase first. Phases that didn't run
+        since the last reset are left out.
+        """
+        window = time.perf_counter() - self.window_start
+        phases = sorted((name for name in self.totals if self.counts[name]), key=self.totals.get, reverse=True)
+        return {
+            name: {
+                'calls': self.counts[name],
+                'seconds': self.totals[name] / 1e9,
+                'share': self.totals[name] / 1e9 / window if window else 0.0,
+                'mean': self.totals[name] / 1e9 / self.counts[name],
+                'p50': self.percentile(name, 50),
+                'p99': self.percentile(name, 99),
+            }
+            for name in phases
+        }
+
+    def reset(self):
+        "Starts a new window"
+        for name in self.histograms:
+            self.histograms[name] = [0] * BUCKETS
+            self.totals[name] = 0
+            self.counts[name] = 0
+        self.window_start = time.perf_counter()
+
+
+class _Phase():
+    __slots__ = ('timer', 'name')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._stack.append([time.perf_counter_ns(), 0])
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        stack = self.timer._stack
+        start, nested = stack.pop()
+        elapsed = end - start
+        self.timer.add(self.name, elapsed - nested)
+        if stack:
+            stack[-1][1] += elapsed
+
+
+class _NullPhase():
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class TimedEnv(gym.Wrapper):
+    def __init__(self, env, timer, name):
+        """
+        Times the step and reset calls of the env it wraps as one phase.
+        """
+        super().__init__(env)
+        self.timer = timer
+        self.name = name
+
+    def step(self, action):
+        with self.timer.phase(self.name):
+            return self.env.step(action)
+
+    def reset(self, **kwargs):
+        with self.timer.phase(self.name):
+            return self.env.reset(**kwargs)
+
+
+class TraceWindow():
+    def __init__(self, kind, save_dir, start_step=0, steps=1000):
+        """
+        Records a trace of the steps from start_step to start_step + steps, with cProfile (written to profile.prof,
+        read with pstats or snakeviz) or torch.profiler (written to trace.json, read with chrome://tracing).
+
+        :param kind: 'cprofile' or 'torch'
+        :param save_dir: Directory the trace is written to
+        :param start_step: Step the trace starts at
+        :param steps: Number of steps traced
+        """
+        if kind not in ('cprofile', 'torch'):
+            raise ValueError(f"Expecting a trace kind 'cprofile' or 'torch', got: {kind}")
+        self.kind = kind
+        self.save_dir = save_dir
+        self.start_step = start_step
+        self.end_step = start_step + steps
+        self.profiler = None
+        self.done = False
+
+    def step(self, curr_step):
+        "Starts or stops the trace, called once per loop with the current step"
+        if self.done:
+            return
+        if self.profiler is None and curr_step >= self.start_step:
+            self._start()
+        elif self.profiler is not None and curr_step >= self.end_step:
+            self.close()
+
+    def close(self):
+        "Stops the trace and writes it, if it is running"
+        if self.profiler is None:
+            return
+        if self.kind == 'cprofile':
+            self.profiler.disable()
+            path = self.save_dir / 'profile.prof'
+            self.profiler.dump_stats(path)
+        else:
+            self.profiler.__exit__(None, None, None)
+            path = self.save_dir / 'trace.json'
+            self.profiler.export_chrome_trace(str(path))
+        print(f"Trace of steps {self.start_step} to {self.end_step} saved to {path}")
+        self.profiler = None
+        self.done = True
+
+    def _start(self):
+        if self.kind == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            import torch.profiler
+            self.profiler = torch.profiler.profile()
+            self.profiler.__enter__()
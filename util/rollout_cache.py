@@ -0,0 +1,167 @@
+"""
+Prefix-snapshot cache for GA rollouts. Children made by crossover and mutation share a prefix of actions with one of
+their parents, so a child can resume from an emulator state saved somewhere along that prefix instead of replaying it
+from env.reset().
+
+nes_py only keeps one save-state per emulator (NESEnv._backup/_restore), so a snapshot is an emulator "parked" at a
+checkpoint: its backup holds the state after the first `depth` actions, and restoring it resumes any sequence with
+that exact prefix. Snapshots are keyed by a hash of the env id and the action prefix, are only taken at multiples of
+checkpoint_every, and are evicted least recently used first once the cache is over its memory budget.
+
+When a child resumes from a snapshot and shares an even longer prefix with its parent, the same emulator is parked
+again deeper along it. Siblings should therefore be evaluated in increasing order of shared prefix so that moving a
+snapshot deeper never loses a checkpoint a later sibling still needs.
+"""
+import hashlib
+from collections import OrderedDict
+
+from util.env_pool import get_env, make_env
+
+# rough size of one parked emulator: the NES state, its backup copy, the frame buffer and the gym wrappers
+SNAPSHOT_NBYTES = 1 << 20
+
+# cache used by this worker process, set up by init_worker_cache
+_worker_cache = None
+
+
+class RolloutCache:
+    """
+    LRU cache of emulators parked at checkpoints along action sequences.
+    """
+
+    def __init__(self, checkpoint_every=500, max_bytes=256 * 2**20):
+        """
+        Initializes the cache.
+
+        :param checkpoint_every: Number of actions between checkpoints a snapshot can be taken at
+        :param max_bytes: Memory budget for parked emulators
+        """
+        self.checkpoint_every = checkpoint_every
+        self.max_snapshots = max(1, max_bytes // SNAPSHOT_NBYTES)
+        # prefix key -> (parked env, depth), least recently used first
+        self._snapshots = OrderedDict()
+        # the rollout in flight: its prefix keys, the key it resumed from and whether its env is a new one
+        self._keys = []
+        self._resumed_key = None
+        self._is_new_env = False
+        self.steps_run = 0
+        self.steps_skipped = 0
+
+    def prefix_keys(self, sequence, env_name):
+        """
+        Hashes every checkpoint prefix of the sequence. Only prefixes shorter than the sequence are hashed, so a resumed
+        rollout always has at least one action left to take.
+
+        :param sequence: The sequence of actions
+        :param env_name: The env the sequence is run in
+        :return: List of keys, the k-th one for the first (k + 1) * checkpoint_every actions
+        """
+        hasher = hashlib.blake2b(env_name.encode(), digest_size=16)
+        keys = []
+        for depth in range(self.checkpoint_every, len(sequence), self.checkpoint_every):
+            hasher.update(bytes(sequence[depth - self.checkpoint_every : depth]))
+            keys.append(hasher.digest())
+        return keys
+
+    def resume(self, sequence, env_name, shared_prefix=0):
+        """
+        Gets an environment to run the sequence in, restored to the deepest checkpoint the sequence shares with a
+        parked emulator.
+
+        :param sequence: The sequence that will be run
+        :param env_name: The env to run the sequence in
+        :param shared_prefix: Number of leading actions the sequence shares with its parent
+        :return: The env, the index of the first action left to run, and the index to park at (None for no parking)
+        """
+        self._keys = self.prefix_keys(sequence, env_name)
+        self._resumed_key = None
+        self._is_new_env = False
+        env = None
+        start = 0
+        for k in range(len(self._keys) - 1, -1, -1):
+            if self._keys[k] in self._snapshots:
+                self._resumed_key = self._keys[k]
+                env, start = self._snapshots[self._resumed_key]
+                self._snapshots.move_to_end(self._resumed_key)
+                break
+
+        # deepest checkpoint inside the prefix shared with the parent
+        park_at = min(shared_prefix // self.checkpoint_every, len(self._keys))
+        park_at *= self.checkpoint_every
+        if park_at <= start:
+            park_at = None
+
+        if env is not None:
+            env.unwrapped._restore()
+            env.unwrapped.done = False
+        elif park_at is not None:
+            # a parked emulator's backup replaces its reset state, so it can't be the pooled env
+            env = make_env(env_name)
+            env.reset()
+            self._is_new_env = True
+        else:
+            env = get_env(env_name)
+            env.reset()
+        return env, start, park_at
+
+    def park(self, env, depth):
+        """
+        Saves the current state of the env as the snapshot for the first depth actions of the rollout in flight.
+
+        :param env: The env the rollout is running in
+        :param depth: Number of actions taken so far, a multiple of checkpoint_every
+        """
+        env.unwrapped._backup()
+        if self._resumed_key is not None:
+            # the env's previous snapshot was just overwritten
+            del self._snapshots[self._resumed_key]
+        key = self._keys[depth // self.checkpoint_every - 1]
+        self._snapshots[key] = (env, depth)
+        self._resumed_key = key
+        self._is_new_env = False
+        while len(self._snapshots) > self.max_snapshots:
+            evicted_env, evicted_depth = self._snapshots.popitem(last=False)[1]
+            evicted_env.close()
+
+    def release(self, env, start, max_reached):
+        """
+        Finishes the rollout in flight.
+
+        :param env: The env the rollout ran in
+        :param start: The index the rollout resumed at
+        :param max_reached: Index of the last action taken
+        """
+        if self._is_new_env:
+            # died before reaching its checkpoint, nothing to keep
+            env.close()
+        self.steps_run += max_reached + 1 - start
+        self.steps_skipped += start
+        self._keys = []
+        self._resumed_key = None
+        self._is_new_env = False
+
+    def close(self):
+        """
+        Closes every parked emulator.
+        """
+        for env, depth in self._snapshots.values():
+            env.close()
+        self._snapshots.clear()
+
+
+def init_worker_cache(checkpoint_every, max_bytes):
+    """
+    Pool initializer that gives the worker process its own rollout cache.
+
+    :param checkpoint_every: Number of actions between checkpoints
+    :param max_bytes: Memory budget for this worker's parked emulators
+    """
+    global _worker_cache
+    _worker_cache = RolloutCache(checkpoint_every, max_bytes)
+
+
+def get_worker_cache():
+    """
+    Returns this process' rollout cache, or None if it was not set up.
+    """
+    return _worker_cache
@@ -0,0 +1,116 @@
+"""
+Run modes shared by the training scripts: headless (the default, no rendering at all), render (show every Nth episode
+in a window) or video (record every Nth episode to an mp4 file offscreen, which works on machines without a display).
+Scripts add the options with add_run_mode_arguments and wrap the env they want shown with wrap_run_mode; in headless
+mode the env is returned as is, so training pays nothing for the option.
+"""
+from pathlib import Path
+
+import cv2
+import gym
+
+RUN_MODES = ('headless', 'render', 'video')
+
+
+def add_run_mode_arguments(parser):
+    """
+    Adds --run-mode, --render-every and --video-dir to an argparse parser.
+    """
+    parser.add_argument("--run-mode", default="headless", choices=RUN_MODES)
+    parser.add_argument("--render-every", default=1, type=int)
+    parser.add_argument("--video-dir", default="video", type=Path)
+
+
+def run_mode_from_args(args):
+    """
+    Returns the run mode options parsed by add_run_mode_arguments, as keyword arguments of wrap_run_mode.
+    """
+    return {'mode': args.run_mode, 'every': args.render_every, 'video_dir': args.video_dir}
+
+
+def wrap_run_mode(env, mode='headless', every=1, video_dir='video', name='episode'):
+    """
+    Wraps an env to render or record every every-th episode.
+
+    :param env: The env, wrapped as low as possible so every emulator frame is shown
+    :param mode: One of RUN_MODES
+    :param every: Episodes between shown episodes (the first one is always shown)
+    :param video_dir: Directory videos are written to
+    :param name: Prefix of the video file names, followed by the episode number
+    :return: The env itself in headless mode, otherwise a RunModeWrapper
+    """
+    if mode not in RUN_MODES:
+        raise ValueError(f"Expecting a run mode in {RUN_MODES}, got: {mode}")
+    if mode == 'headless':
+        return env
+    return RunModeWrapper(env, mode, every, video_dir, name)
+
+
+class RunModeWrapper(gym.Wrapper):
+    def __init__(self, env, mode, every=1, video_dir='video', name='episode', fps=60):
+        """
+        Renders every every-th episode in a window, or writes its frames to an mp4 file as they are played.
+        episodes counts the episodes started and numbers the videos; callers that only play the episodes they want
+        shown can set it before reset.
+        """
+        super().__init__(env)
+        self.mode = mode
+        self.every = max(1, int(every))
+        self.video_dir = Path(video_dir)
+        self.name = name
+        self.fps = fps
+        self.episodes = 0
+        self._shown = False
+        self._video_path = None
+        self._writer = None
+
+    def reset(self, **kwargs):
+        self.end_episode()
+        observation = self.env.reset(**kwargs)
+        self.begin_episode()
+        return observation
+
+    def begin_episode(self):
+        """
+        Starts an episode from the env's current state, showing it if it is an every-th one. reset calls it after
+        resetting the env; callers that play on from a state they restored call it themselves.
+        """
+        self.end_episode()
+        self._shown = self.episodes % self.every == 0
+        if self._shown and self.mode == 'video':
+            self.video_dir.mkdir(parents=True, exist_ok=True)
+            self._video_path = self.video_dir / f"{self.name}_{self.episodes}.mp4"
+        self.episodes += 1
+        if self._shown:
+            self._show()
+
+    def step(self, action):
+        result = self.env.step(action)
+        if self._shown:
+            self._show()
+        return result
+
+    def close(self):
+        self.end_episode()
+        return super().close()
+
+    def _show(self):
+        if self.mode == 'render':
+            self.env.render()
+            return
+        frame = self.env.render(mode='rgb_array')
+        if self._writer is None:
+            height, width, _ = frame.shape
+            self._writer = cv2.VideoWriter(str(self._video_path), cv2.VideoWriter_fourcc(*'mp4v'), self.fps,
+                                           (width, height))
+        self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def end_episode(self):
+        """
+        Finishes showing the current episode, saving its video.
+        """
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            print(f"Video saved to {self._video_path}")
+        self._shown = False
@@ -0,0 +1,51 @@
+"""
+Seeding for reproducible runs. seed_everything seeds the python, numpy and torch RNGs of a process, seed_env an env's
+own RNGs, and derive_seed gives every process or job of a run its own seed from the run's seed, so parallel work
+doesn't share a random stream and doesn't depend on which worker picks up which job.
+
+The emulator itself is deterministic: once the agent's RNGs are seeded, an episode is the same on every run.
+"""
+import random
+
+import numpy as np
+import torch
+
+
+def derive_seed(seed, *keys):
+    """
+    Derives an independent seed from a seed and any number of integer keys (e.g. a generation and an index).
+
+    :param seed: The run's seed
+    :param keys: Integers identifying the process or job
+    :return: int below 2 ** 32
+    """
+    return int(np.random.SeedSequence([seed, *keys]).generate_state(1)[0])
+
+
+def seed_everything(seed):
+    """
+    Seeds the python, numpy and torch (CPU and CUDA) RNGs of this process.
+
+    :param seed: The seed, an int below 2 ** 32
+    :return: The seed
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+    return seed
+
+
+def seed_env(env, seed):
+    """
+    Seeds the RNGs of an env: the base env's and its action space's. Seeds through the base env rather than
+    reset(seed=...), which JoypadSpace doesn't pass on.
+
+    :param env: The env, wrapped or not
+    :param seed: The seed
+    :return: The env
+    """
+    env.unwrapped.seed(seed)
+    env.action_space.seed(seed)
+    return env
@@ -0,0 +1,230 @@
+"""
+Replays an action sequence (a best sequence of the GA) headless at full emulator speed, recording where Mario dies,
+with snapshots of the emulator every K actions so a long sequence can be resumed or scrubbed to any point without
+playing it again from the start.
+
+nes_py can't serialize an emulator and only keeps one save-state per emulator (see util/rollout_cache.py), so a
+snapshot is a forked copy of the process playing the sequence, paused at its step. A fork costs about as much as a few
+emulator steps wherever it is taken (memory is copy-on-write), so snapshots are taken while the sequence is played.
+Seeking forks the closest snapshot before the target and plays on from there, fewer than K actions. The sequence is
+played in forked worker processes that the SequenceReplay controls over a unix socket, which needs os.fork (Linux or
+macOS).
+"""
+import os
+import secrets
+import signal
+from multiprocessing.connection import Client, Listener
+
+from util.env_pool import make_env
+from util.run_mode import wrap_run_mode
+
+
+class _Player:
+    """
+    The env a sequence is played in and everything seen so far, in a worker or snapshot process.
+    """
+
+    def __init__(self, actions, env_name):
+        self.actions = actions
+        self.env = make_env(env_name)
+        self.env.reset()
+        self.step = 0  # number of actions taken
+        self.info = None
+        self.done = False
+        # (step, world, stage, x position) of every death
+        self.deaths = []
+
+    def state(self):
+        return {
+            "step": self.step,
+            "info": self.info,
+            "done": self.done,
+            "deaths": list(self.deaths),
+        }
+
+    def play(self, to, stop_when_dead, snapshot_every, snapshot_steps, connection, address, authkey, run_mode):
+        """
+        Plays actions up to the to-th (or to the end of the sequence or the game), forking a snapshot at every
+        snapshot_every-th step not in snapshot_steps (none while the game is shown).
+
+        :return: The steps of the snapshots taken
+        """
+        env = self.env
+        shown = None
+        if run_mode is not None and run_mode["mode"] != "headless":
+            # one video per call, named after the step it starts at
+            shown = wrap_run_mode(env, **dict(run_mode, every=1, name="replay"))
+            shown.episodes = self.step
+            shown.begin_episode()
+            env = shown
+        taken = []
+        end = len(self.actions) if to is None else min(to, len(self.actions))
+        while self.step < end and not self.done:
+            if (
+                shown is None
+                and snapshot_every
+                and self.step % snapshot_every == 0
+                and self.step not in snapshot_steps
+            ):
+                _fork_snapshot(self, connection, address, authkey)
+                taken.append(self.step)
+            previous = self.info
+            _, _, self.done, self.info = env.step(self.actions[self.step])
+            self.step += 1
+            # a 1-up raises the life counter, which wraps to 255 on game over
+            life_lost = previous is not None and (
+                self.info["life"] < previous["life"] or self.info["life"] == 255 != previous["life"]
+            )
+            if life_lost or (self.done and not self.info["flag_get"]):
+                # the level is already reset when the life counter changes, so the death was at the last position
+                where = previous if life_lost else self.info
+                self.deaths.append((self.step - 1, where["world"], where["stage"], int(where["x_pos"])))
+                if stop_when_dead:
+                    break
+        if shown is not None:
+            shown.end_episode()
+        return taken
+
+
+def _connect(kind, player, address, authkey):
+    connection = Client(address, family="AF_UNIX", authkey=authkey)
+    connection.send((kind, player.state()))
+    return connection
+
+
+def _serve(kind, player, address, authkey):
+    """
+    Connects a forked process to the controller and runs its commands until it is closed. Never returns.
+    """
+    # children of this process are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        connection = _connect(kind, player, address, authkey)
+        while True:
+            command, *arguments = connection.recv()
+            if command == "play":
+                to, stop_when_dead, snapshot_every, snapshot_steps, run_mode = arguments
+                taken = player.play(
+                    to, stop_when_dead, snapshot_every, set(snapshot_steps), connection, address, authkey, run_mode
+                )
+                connection.send(dict(player.state(), snapshots=taken))
+            elif command == "snapshot":
+                _fork_snapshot(player, connection, address, authkey)
+                connection.send(player.step)
+            elif command == "fork":
+                # a new worker playing on from this snapshot, which stays paused
+                if os.fork() == 0:
+                    connection.close()
+                    _serve("worker", player, address, authkey)
+            else:
+                break
+    except (EOFError, OSError, KeyboardInterrupt):
+        # the controller is gone
+        pass
+    # skip the exit handlers, which belong to the process this one was forked from
+    os._exit(0)
+
+
+def _fork_snapshot(player, connection, address, authkey):
+    if os.fork() == 0:
+        connection.close()
+        _serve("snapshot", player, address, authkey)
+
+
+class SequenceReplay:
+    def __init__(self, actions, env_name, snapshot_every=0):
+        """
+        Starts a worker process at the start of the sequence, and a snapshot of it there.
+
+        :param actions: The sequence of actions
+        :param env_name: The env to play it in (e.g. SuperMarioBros-1-1-v3)
+        :param snapshot_every: Actions between snapshots (0 for none but the one at the start)
+        """
+        self.actions = actions
+        self.env_name = env_name
+        self.snapshot_every = snapshot_every
+        self._authkey = secrets.token_bytes(16)
+        self._listener = Listener(family="AF_UNIX", authkey=self._authkey, backlog=64)
+        # snapshot step -> connection to it
+        self.snapshots = {}
+        self._pid = os.fork()
+        if self._pid == 0:
+            _serve("worker", _Player(actions, env_name), self._listener.address, self._authkey)
+        self._worker = self._accept("worker")
+        self.snapshot()
+
+    def _accept(self, kind):
+        connection = self._listener.accept()
+        connected_kind, state = connection.recv()
+        if connected_kind != kind:
+            raise RuntimeError(f"Expecting a {kind} to connect, got: {connected_kind}")
+        self._set_state(state)
+        return connection
+
+    def _set_state(self, state):
+        self.step = state["step"]
+        self.info = state["info"]
+        self.done = state["done"]
+        self.deaths = state["deaths"]
+
+    def snapshot(self):
+        """
+        Takes a snapshot at the current step, if there isn't one already.
+        """
+        if self.step in self.snapshots:
+            return
+        worker_state = (self.step, self.info, self.done, self.deaths)
+        self._worker.send(("snapshot",))
+        connection = self._accept("snapshot")
+        self.snapshots[self._worker.recv()] = connection
+        self.step, self.info, self.done, self.deaths = worker_state
+
+    def play(self, to=None, stop_when_dead=False, run_mode=None):
+        """
+        Plays on from the current step, taking snapshots along the way.
+
+        :param to: Number of actions to have taken when it stops (None for the whole sequence)
+        :param stop_when_dead: Whether to stop at the first death, like the GA's fitness runs
+        :param run_mode: Keyword arguments of util.run_mode.wrap_run_mode to show what is played (None for headless).
+            No snapshots are taken while the game is shown
+        :return: Dict of the step, info, done flag and deaths so far
+        """
+        self._worker.send(("play", to, stop_when_dead, self.snapshot_every, sorted(self.snapshots), run_mode))
+        state = self._worker.recv()
+        for _ in state.pop("snapshots"):
+            connection = self._listener.accept()
+            _, snapshot_state = connection.recv()
+            self.snapshots[snapshot_state["step"]] = connection
+        self._set_state(state)
+        return state
+
+    def seek(self, step):
+        """
+        Moves to the state after the first step actions: plays on if the closest snapshot before it is behind the
+        current step, otherwise restarts from that snapshot.
+
+        :param step: Number of actions taken at the target
+        :return: Dict of the step, info, done flag and deaths at the target
+        """
+        base = max(s for s in self.snapshots if s <= step)
+        if step < self.step or base > self.step:
+            self._worker.send(("close",))
+            self._worker.close()
+            self.snapshots[base].send(("fork",))
+            self._worker = self._accept("worker")
+        return self.play(to=step)
+
+    def close(self):
+        """
+        Stops the worker and every snapshot.
+        """
+        for connection in [self._worker, *self.snapshots.values()]:
+            try:
+                connection.send(("close",))
+            except OSError:
+                pass
+            connection.close()
+        self.snapshots.clear()
+        self._listener.close()
+        os.waitpid(self._pid, 0)
+
@@ -0,0 +1,105 @@
+"""
+GA population held in shared memory. The driver owns a uint8 array with the genes of every individual and a float64
+array with one row of results per individual; worker processes attach to both once, receive only the index of the
+individual to evaluate, and write its results row in place. Nothing but indices is pickled between processes.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# population attached by this worker process, set up by attach_worker
+_worker_population = None
+
+
+class SharedPopulation:
+    """
+    Genes and results of a GA population in shared memory.
+    """
+
+    def __init__(self, number, gene_shape, number_of_fields, names=None):
+        """
+        Creates the shared arrays, or attaches to existing ones when names are given.
+
+        :param number: Number of individuals
+        :param gene_shape: Shape of the genes of one individual
+        :param number_of_fields: Number of results stored per individual
+        :param names: Names of the existing genes and results blocks (None to create new ones)
+        """
+        self.number = number
+        self.gene_shape = tuple(gene_shape)
+        self.number_of_fields = number_of_fields
+        self._is_owner = names is None
+        if names is None:
+            genes_size = number * int(np.prod(self.gene_shape))
+            results_size = number * number_of_fields * np.dtype(np.float64).itemsize
+            self._genes_memory = shared_memory.SharedMemory(
+                create=True, size=max(1, genes_size)
+            )
+            self._results_memory = shared_memory.SharedMemory(
+                create=True, size=max(1, results_size)
+            )
+        else:
+            self._genes_memory = shared_memory.SharedMemory(name=names[0])
+            self._results_memory = shared_memory.SharedMemory(name=names[1])
+        self.genes = np.ndarray(
+            (number,) + self.gene_shape, dtype=np.uint8, buffer=self._genes_memory.buf
+        )
+        self.results = np.ndarray(
+            (number, number_of_fields),
+            dtype=np.float64,
+            buffer=self._results_memory.buf,
+        )
+
+    def spec(self):
+        """
+        Returns what a worker needs to attach to this population (picklable).
+        """
+        return (
+            self.number,
+            self.gene_shape,
+            self.number_of_fields,
+            (self._genes_memory.name, self._results_memory.name),
+        )
+
+    def result_row(self, index):
+        """
+        Returns the results row of an individual as a list, with whole numbers as ints.
+
+        :param index: The individual
+        :return: List of results
+        """
+        return [
+            int(value) if value.is_integer() else value
+            for value in self.results[index].tolist()
+        ]
+
+    def close(self):
+        """
+        Detaches from the shared memory, and frees it if this is the process that created it.
+        """
+        # the views have to go before the memory can be closed
+        del self.genes
+        del self.results
+        self._genes_memory.close()
+        self._results_memory.close()
+        if self._is_owner:
+            self._genes_memory.unlink()
+            self._results_memory.unlink()
+
+
+def attach_worker(spec):
+    """
+    Pool initializer that attaches the worker process to the driver's population.
+
+    :param spec: SharedPopulation.spec() of the driver's population
+    """
+    global _worker_population
+    number, gene_shape, number_of_fields, names = spec
+    _worker_population = SharedPopulation(number, gene_shape, number_of_fields, names)
+
+
+def get_worker_population():
+    """
+    Returns the population this worker process is attached to.
+    """
+    return _worker_population
@@ -0,0 +1,80 @@
+"""
+State encoding for tabular Q-learning on pixels: a frame is converted to grayscale, downsampled, quantized to a few
+gray levels and its bytes hashed to a 64-bit integer key, once per env step. Nearby frames that only differ below the
+quantization share a key, which is what makes a table over pixels learn anything.
+
+Keys are xxh3 hashes if the xxhash package is installed and blake2b otherwise; either is computed straight from the
+quantized frame's buffer, without a copy to bytes.
+"""
+import hashlib
+
+import cv2
+import numpy as np
+
+from util.wrappers import grayscale
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class FrameEncoder:
+    def __init__(self, shape=(60, 64), levels=8, hash_name=None):
+        """
+        :param shape: (height, width) frames are downsampled to
+        :param levels: Number of gray levels kept, a power of two up to 256
+        :param hash_name: 'xxh3' or 'blake2b' (None for xxh3 if xxhash is installed, else blake2b)
+        """
+        if levels < 1 or levels > 256 or levels & (levels - 1):
+            raise ValueError(f"Expecting a power of two up to 256 gray levels, got: {levels}")
+        if isinstance(shape, int):
+            shape = (shape, shape)
+        self.shape = tuple(shape)
+        self.levels = levels
+        self._shift = 8 - (levels.bit_length() - 1)
+
+        if hash_name is None:
+            hash_name = 'xxh3' if xxhash is not None else 'blake2b'
+        if hash_name == 'xxh3':
+            if xxhash is None:
+                raise ImportError("xxh3 keys need the xxhash package")
+            self._hash = xxhash.xxh3_64_intdigest
+        elif hash_name == 'blake2b':
+            self._hash = _blake2b_64
+        else:
+            raise ValueError(f"Expecting hash_name 'xxh3' or 'blake2b', got: {hash_name}")
+        self.hash_name = hash_name
+
+    def quantize(self, observation):
+        """
+        Downsamples an RGB frame and quantizes it.
+
+        :param observation: RGB frame, (height, width, 3)
+        :return: uint8 array of self.shape holding gray levels 0 to levels - 1
+        """
+        # cv2 sizes are (width, height); INTER_AREA averages the source pixels under each output pixel
+        small = cv2.resize(grayscale(observation), self.shape[::-1], interpolation=cv2.INTER_AREA)
+        return np.right_shift(small, self._shift, out=small)
+
+    def key(self, quantized):
+        """
+        Hashes a quantized frame to its 64-bit key.
+
+        :param quantized: Array returned by quantize
+        :return: Non-negative int below 2 ** 64
+        """
+        return self._hash(memoryview(np.ascontiguousarray(quantized)).cast('B'))
+
+    def encode(self, observation):
+        """
+        Encodes an RGB frame to its 64-bit key.
+
+        :param observation: RGB frame, (height, width, 3)
+        :return: Non-negative int below 2 ** 64
+        """
+        return self.key(self.quantize(observation))
+
+
+def _blake2b_64(buffer):
+    return int.from_bytes(hashlib.blake2b(buffer, digest_size=8).digest(), 'little')
@@ -1,9 +1,34 @@
 import gym
 import torch
 import random, datetime, numpy as np
+import cv2
 from skimage import transform
 
 from gym.spaces import Box
+from gym.wrappers import FrameStack
+
+#NES Emulator for OpenAI Gym
+from nes_py.wrappers import JoypadSpace
+
+# Super Mario environment for OpenAI Gym
+import gym_super_mario_bros
+
+from util.profiling import TimedEnv
+from util.run_mode import wrap_run_mode
+
+def grayscale(observation):
+    """
+    Converts an RGB frame to grayscale with OpenCV.
+    """
+    height, width, _ = observation.shape
+    if observation.strides == (width * 4, 4, -1):
+        # nes_py's screen is a view reversing the channels of its BGRx buffer, which cv2 would first copy to a
+        # contiguous array; the buffer itself can be converted directly
+        bgrx = np.lib.stride_tricks.as_strided(observation[..., ::-1], shape=(height, width, 4),
+                                               strides=(width * 4, 4, 1))
+        return cv2.cvtColor(bgrx, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(observation, cv2.COLOR_RGB2GRAY)
+
 
 class ResizeObservation(gym.ObservationWrapper):
     def __init__(self, env, shape):
@@ -24,6 +49,33 @@ class ResizeObservation(gym.ObservationWrapper):
         return resize_obs
 
 
+class PreprocessObservation(gym.ObservationWrapper):
+    def __init__(self, env, shape=84, normalize=False):
+        """
+        Grayscale and downscale in one pass with OpenCV, replacing GrayScaleObservation + ResizeObservation.
+        Frames stay uint8 unless normalize is set, in which case they are float32 in [0, 1].
+        """
+        super().__init__(env)
+        if isinstance(shape, int):
+            self.shape = (shape, shape)
+        else:
+            self.shape = tuple(shape)
+        self.normalize = normalize
+
+        if normalize:
+            self.observation_space = Box(low=0.0, high=1.0, shape=self.shape, dtype=np.float32)
+        else:
+            self.observation_space = Box(low=0, high=255, shape=self.shape, dtype=np.uint8)
+
+    def observation(self, observation):
+        gray = grayscale(observation)
+        # cv2 sizes are (width, height); INTER_AREA averages the source pixels under each output pixel
+        resize_obs = cv2.resize(gray, self.shape[::-1], interpolation=cv2.INTER_AREA)
+        if self.normalize:
+            return resize_obs.astype(np.float32) / 255
+        return resize_obs
+
+
 class SkipFrame(gym.Wrapper):
     def __init__(self, env, skip):
         """Return only every `skip`-th frame"""
@@ -41,3 +93,31 @@ class SkipFrame(gym.Wrapper):
             if done:
                 break
         return obs, total_reward, done, info
+
+
+def make_mario_env(env_name='SuperMarioBros-1-1-v0', run_mode=None, timer=None):
+    """
+    Builds the env the Deep Q-Learning agent plays: two actions, every 4th frame, grayscale, 84x84, last 4 frames
+    stacked. Frames stay uint8 (for the replay buffer), the agent scales them to [0, 1] at the network.
+    run_mode takes the keyword arguments of util.run_mode.wrap_run_mode, to render or record every emulator frame of
+    some episodes (None for headless).
+    timer is a util.profiling.PhaseTimer to time the emulator's steps with, as the 'emulator' phase.
+    """
+    env = gym_super_mario_bros.make(env_name)
+
+    # Limit the action-space to
+    #   0. walk right
+    #   1. jump right
+    env = JoypadSpace(
+        env,
+        [['right'],
+        ['right', 'A']]
+    )
+    if timer is not None:
+        env = TimedEnv(env, timer, 'emulator')
+    if run_mode is not None:
+        env = wrap_run_mode(env, **run_mode)
+    env = SkipFrame(env, skip=4)
+    env = PreprocessObservation(env, shape=84)
+    env = FrameStack(env, num_stack=4)
+    return env